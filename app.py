@@ -2,11 +2,17 @@ from flask import Flask
 from services.auth_service import AuthService
 from services.subscription_service import SubscriptionService
 from services.metrics_service import MetricsService
+from services.cohort_service import CohortService
 from database import init_db, get_db
+from indexes import ensure_indexes
+from config import Config
+from pymongo.errors import PyMongoError
 
 from routes.auth_routes import auth_bp
 from routes.subscription_routes import subscription_bp
 from routes.metrics_routes import metrics_bp
+from cli import register_commands
+from utils.identity_map import query_counts
 
 def create_app():
     """
@@ -18,14 +24,32 @@ def create_app():
     init_db()
     db_instance = get_db()
 
+    if Config.MONGO_ENSURE_INDEXES:
+        try:
+            ensure_indexes(db_instance)
+        except PyMongoError as error:
+            # Un índice en conflicto (o datos duplicados) no debe impedir arrancar; se revisa con `flask indexes report`.
+            app.logger.warning(f"Could not ensure MongoDB indexes: {error}")
+
     app.auth_service = AuthService(db_instance)
     app.subscription_service = SubscriptionService(db_instance)
     app.metrics_service = MetricsService(db_instance)
+    app.cohort_service = CohortService(db_instance)
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(subscription_bp)
     app.register_blueprint(metrics_bp) 
 
+    register_commands(app)
+
+    @app.after_request
+    def add_query_counts_header(response):
+        # Lecturas por colección de la petición (identity map); útil en tests para detectar lecturas duplicadas.
+        if app.testing or Config.EXPOSE_QUERY_COUNTS:
+            counts = query_counts()
+            response.headers["X-Query-Counts"] = ",".join(f"{name}={count}" for name, count in sorted(counts.items()))
+        return response
+
     return app 
 
 if __name__ == '__main__':
@@ -0,0 +1,32 @@
+"""
+Microbenchmark de verificación de JWT: jwt.decode completo frente a decode_token con caché.
+Uso: python -m benchmarks.jwt_verification [iteraciones]
+"""
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+import jwt
+from config import Config
+from utils.auth import decode_token, decoded_tokens
+
+def main(iterations=50000):
+    token = jwt.encode(
+        {"sub": "60d5ec49f7e3b1a2b3c4d5e6", "email": "bench@example.com",
+         "exp": datetime.now(timezone.utc) + timedelta(hours=1)},
+        Config.JWT_SECRET_KEY, algorithm="HS256"
+    )
+
+    uncached = timeit.timeit(
+        lambda: jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=["HS256"]), number=iterations
+    )
+    decode_token(token)
+    cached = timeit.timeit(lambda: decode_token(token), number=iterations)
+
+    print(f"jwt.decode:           {uncached / iterations * 1e6:8.2f} us/token")
+    print(f"decode_token (cache): {cached / iterations * 1e6:8.2f} us/token")
+    print(f"speedup:              {uncached / cached:8.1f}x")
+    if decoded_tokens is not None:
+        print(f"cache stats:          {decoded_tokens.stats()}")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,17 @@
+from cli.migrations import migrations_cli
+from cli.ledger import ledger_cli
+from cli.analytics import analytics_cli
+from cli.keys import keys_cli
+from cli.indexes import indexes_cli
+from cli.customers import customers_cli
+
+def register_commands(app):
+    """
+    Registra los comandos de mantenimiento en el CLI de Flask (flask <grupo> <comando>).
+    """
+    app.cli.add_command(migrations_cli)
+    app.cli.add_command(ledger_cli)
+    app.cli.add_command(analytics_cli)
+    app.cli.add_command(keys_cli)
+    app.cli.add_command(indexes_cli)
+    app.cli.add_command(customers_cli)
@@ -0,0 +1,14 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+analytics_cli = AppGroup('analytics', help="Instantánea columnar para métricas en memoria.")
+
+@analytics_cli.command('refresh-snapshot')
+@click.option('--path', default=None, help="Directorio de la instantánea (por defecto ANALYTICS_SNAPSHOT_PATH).")
+def refresh_snapshot(path):
+    """
+    Genera o actualiza incrementalmente la instantánea. Programar periódicamente con un solo escritor.
+    """
+    changed_rows = current_app.metrics_service.refresh_snapshot(path)
+    click.echo(f"Snapshot refreshed: {changed_rows} rows inserted or updated")
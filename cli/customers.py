@@ -0,0 +1,22 @@
+import json
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+customers_cli = AppGroup('customers', help="Gestión de clientes en bloque.")
+
+@customers_cli.command('import')
+@click.argument('source', type=click.File('rb'))
+@click.option('--batch-size', default=None, type=int, help="Clientes por insert_many (por defecto CUSTOMER_IMPORT_BATCH_SIZE).")
+@click.option('--results', is_flag=True, help="Escribir el resultado de cada línea como NDJSON.")
+def import_customers(source, batch_size, results):
+    """
+    Importa clientes desde un fichero NDJSON ('-' para stdin), con el mismo formato que POST /customers/import.
+    """
+    counts = {}
+    for result in current_app.auth_service.import_customers(source, batch_size=batch_size):
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+        if results or result["status"] == "invalid":
+            click.echo(json.dumps(result))
+    summary = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+    click.echo(f"Import finished ({summary or 'no rows'})", err=True)
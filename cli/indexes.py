@@ -0,0 +1,27 @@
+import click
+from flask.cli import AppGroup
+from database import get_db
+from indexes import ensure_indexes, index_report
+
+indexes_cli = AppGroup('indexes', help="Índices de MongoDB declarados en indexes.py.")
+
+@indexes_cli.command('ensure')
+@click.option('--collection', 'collections', multiple=True, help="Limitar a una colección (repetible).")
+def ensure(collections):
+    """
+    Crea los índices que falten. Es idempotente; Config.MONGO_ENSURE_INDEXES lo hace también al arrancar.
+    """
+    index_names = ensure_indexes(get_db(), list(collections) or None)
+    click.echo(f"Indexes ensured: {', '.join(index_names)}")
+
+@indexes_cli.command('report')
+def report():
+    """
+    Muestra cada índice del registro, si existe y qué consultas de los servicios cubre.
+    """
+    for entry in index_report(get_db()):
+        status = "ok" if entry["present"] else "MISSING"
+        keys = ", ".join(f"{field} {direction}" for field, direction in entry["keys"])
+        click.echo(f"[{status}] {entry['collection']}.{entry['name']} ({keys})")
+        for query in entry["covers"]:
+            click.echo(f"    - {query}")
@@ -0,0 +1,20 @@
+import click
+from datetime import datetime
+from flask.cli import AppGroup
+from config import Config
+from utils.jwt_keys import generate_signing_key
+
+keys_cli = AppGroup('keys', help="Claves de firma de JWT (EdDSA/RS256).")
+
+@keys_cli.command('generate')
+@click.option('--algorithm', default=None, help="EdDSA o RS256 (por defecto JWT_ALGORITHM).")
+@click.option('--kid', default=None, help="Identificador de la clave (por defecto, la fecha UTC actual).")
+def generate_key(algorithm, kid):
+    """
+    Genera una clave nueva en JWT_KEYS_DIR. Al reiniciar pasa a ser la activa (salvo JWT_ACTIVE_KID);
+    las anteriores siguen verificando hasta que se borran.
+    """
+    algorithm = algorithm or Config.JWT_ALGORITHM
+    kid = kid or datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    path = generate_signing_key(Config.JWT_KEYS_DIR, kid, algorithm)
+    click.echo(f"Generated {algorithm} signing key '{kid}' at {path}")
@@ -0,0 +1,27 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+ledger_cli = AppGroup('ledger', help="Mantenimiento del revenue_ledger.")
+
+@ledger_cli.command('sweep')
+def sweep():
+    """
+    Resta del ledger las suscripciones expiradas. Programar periódicamente (p. ej. cron cada minuto).
+    """
+    swept = current_app.metrics_service.revenue_ledger.sweep_expired()
+    click.echo(f"Removed {swept} expired subscriptions from the ledger")
+
+@ledger_cli.command('reconcile')
+@click.option('--dry-run', is_flag=True, help="Solo reporta la deriva, sin reescribir el ledger.")
+def reconcile(dry_run):
+    """
+    Recalcula el ledger desde subscriptions y reporta la deriva.
+    """
+    report = current_app.metrics_service.revenue_ledger.reconcile(apply=not dry_run)
+    for key, drift in report["drift"].items():
+        click.echo(f"{key}: ledger={report['ledger'][key]} expected={report['expected'][key]} drift={drift}")
+    if dry_run:
+        click.echo("Dry run: ledger not modified")
+    else:
+        click.echo("Ledger rebuilt")
@@ -0,0 +1,18 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from database import get_db
+from indexes import ensure_indexes
+
+migrations_cli = AppGroup('migrations', help="Migraciones de datos sobre MongoDB.")
+
+@migrations_cli.command('monthly-amount')
+def backfill_monthly_amount():
+    """
+    Rellena monthly_amount en suscripciones existentes y crea los índices de subscriptions.
+    Uso: flask --app app migrations monthly-amount
+    """
+    modified = current_app.metrics_service.backfill_monthly_amount()
+    index_names = ensure_indexes(get_db(), ["subscriptions"])
+    click.echo(f"Backfilled monthly_amount on {modified} subscriptions")
+    click.echo(f"Indexes ensured: {', '.join(index_names)}")
\ No newline at end of file
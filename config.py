@@ -6,5 +6,32 @@ load_dotenv()
 class Config:
     MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
     MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "subscription_manager")
+    EXPOSE_QUERY_COUNTS = os.getenv("EXPOSE_QUERY_COUNTS", "false").lower() == "true" # cabecera X-Query-Counts
+    MONGO_ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true" # índices de indexes.py al arrancar
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "vbocfklifuoltv;jutdcvidickluyszxcidxk")
-    JWT_ACCESS_TOKEN_EXPIRES_SECONDS = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRES_SECONDS", 3600)) # 1 hora
\ No newline at end of file
+    JWT_ACCESS_TOKEN_EXPIRES_SECONDS = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRES_SECONDS", 3600)) # 1 hora
+    JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256") # "HS256", "EdDSA" o "RS256"
+    JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR", "keys") # claves privadas <kid>.pem para EdDSA/RS256
+    JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID", "") # vacío = el kid más reciente
+    JWT_JWKS_URL = os.getenv("JWT_JWKS_URL", "") # si se define, jwt_required verifica contra este JWKS
+    JWKS_CACHE_MAX_AGE_SECONDS = int(os.getenv("JWKS_CACHE_MAX_AGE_SECONDS", 300))
+    JWT_DECODE_CACHE_MAX_ENTRIES = int(os.getenv("JWT_DECODE_CACHE_MAX_ENTRIES", 10000)) # 0 desactiva la caché
+    JWT_REFRESH_TOKEN_EXPIRES_SECONDS = int(os.getenv("JWT_REFRESH_TOKEN_EXPIRES_SECONDS", 2592000)) # 30 días
+    METRICS_CACHE_TTL_SECONDS = int(os.getenv("METRICS_CACHE_TTL_SECONDS", 30)) # 0 desactiva la caché
+    METRICS_CACHE_MAX_ENTRIES = int(os.getenv("METRICS_CACHE_MAX_ENTRIES", 256))
+    METRICS_BACKEND = os.getenv("METRICS_BACKEND", "mongo") # "mongo" o "snapshot"
+    ANALYTICS_SNAPSHOT_PATH = os.getenv("ANALYTICS_SNAPSHOT_PATH", "/tmp/subscription_snapshot")
+    ANALYTICS_SNAPSHOT_OVERLAP_SECONDS = int(os.getenv("ANALYTICS_SNAPSHOT_OVERLAP_SECONDS", 300)) # solape al releer cambios
+    METRICS_APPROXIMATE_COUNTS = os.getenv("METRICS_APPROXIMATE_COUNTS", "false").lower() == "true"
+    METRICS_HLL_ERROR_RATE = float(os.getenv("METRICS_HLL_ERROR_RATE", 0.01))
+    AUTH_CUSTOMER_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CUSTOMER_CACHE_TTL_SECONDS", 60)) # 0 desactiva la caché
+    AUTH_CUSTOMER_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CUSTOMER_CACHE_MAX_ENTRIES", 10000))
+    BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+    BCRYPT_POOL_WORKERS = int(os.getenv("BCRYPT_POOL_WORKERS", os.cpu_count() or 1)) # 0 = en el hilo de la petición
+    BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", 0)) # 0 = 4 por proceso del pool
+    BCRYPT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("BCRYPT_QUEUE_TIMEOUT_SECONDS", 5))
+    PRODUCT_CATALOG_STALENESS_SECONDS = float(os.getenv("PRODUCT_CATALOG_STALENESS_SECONDS", 5)) # cada cuánto se comprueba la versión
+    CUSTOMER_IMPORT_BATCH_SIZE = int(os.getenv("CUSTOMER_IMPORT_BATCH_SIZE", 1000))
+    SETTINGS_PATCH_MAX_OPERATIONS = int(os.getenv("SETTINGS_PATCH_MAX_OPERATIONS", 100)) # rutas modificadas por PATCH
+    SETTINGS_PATCH_MAX_BYTES = int(os.getenv("SETTINGS_PATCH_MAX_BYTES", 65536))
+    SUBSCRIBE_BATCH_MAX_ITEMS = int(os.getenv("SUBSCRIBE_BATCH_MAX_ITEMS", 1000))
\ No newline at end of file
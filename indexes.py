@@ -0,0 +1,131 @@
+from pymongo import ASCENDING, IndexModel
+
+# Registro declarativo de índices: colección, claves, opciones de create_index y
+# consultas de los servicios que cada índice resuelve (para `flask indexes report`).
+INDEXES = [
+    {
+        "collection": "customers",
+        "keys": [("email", ASCENDING)],
+        "options": {"name": "customer_email", "unique": True},
+        "covers": ["AuthService.register_customer", "AuthService.login_customer"]
+    },
+    {
+        "collection": "products",
+        "keys": [("name", ASCENDING)],
+        "options": {"name": "product_name", "unique": True},
+        "covers": ["SubscriptionService.add_product"]
+    },
+    {
+        "collection": "subscriptions",
+        "keys": [("customer_id", ASCENDING), ("product_id", ASCENDING), ("expiration_date", ASCENDING)],
+        "options": {"name": "customer_product_expiration"},
+        "covers": [
+            "SubscriptionService.subscribe_customer_to_product (suscripción activa)",
+            "SubscriptionService.subscribe_many (suscripciones activas del lote)"
+        ]
+    },
+    {
+        "collection": "subscriptions",
+        "keys": [("start_date", ASCENDING), ("expiration_date", ASCENDING)],
+        "options": {"name": "active_period"},
+        "covers": [
+            "MetricsService.get_active_subscriptions_in_period (sin paginar)",
+            "MetricsService.calculate_mrr_series",
+            "MetricsService.calculate_customer_retention_rate",
+            "MetricsService.calculate_churn_rate"
+        ]
+    },
+    {
+        "collection": "subscriptions",
+        "keys": [("start_date", ASCENDING), ("_id", ASCENDING), ("expiration_date", ASCENDING)],
+        "options": {"name": "active_period_keyset"},
+        "covers": ["MetricsService.get_active_subscriptions_in_period (paginado por start_date, _id)"]
+    },
+    {
+        "collection": "subscriptions",
+        "keys": [("customer_id", ASCENDING), ("start_date", ASCENDING), ("expiration_date", ASCENDING)],
+        "options": {"name": "customer_active_period"},
+        "covers": ["MetricsService.calculate_retention_series (orden por customer_id, start_date; series de retención y churn)"]
+    },
+    {
+        "collection": "subscriptions",
+        "keys": [("expiration_date", ASCENDING), ("monthly_amount", ASCENDING), ("customer_id", ASCENDING)],
+        "options": {"name": "active_revenue"},
+        "covers": [
+            "MetricsService.calculate_mrr (as_of)",
+            "RevenueLedgerService.reconcile"
+        ]
+    },
+    {
+        "collection": "subscriptions",
+        "keys": [("in_ledger", ASCENDING), ("expiration_date", ASCENDING)],
+        "options": {"name": "ledger_expiration"},
+        "covers": ["RevenueLedgerService.sweep_expired"]
+    },
+    {
+        "collection": "subscriptions",
+        "keys": [("updated_at", ASCENDING)],
+        "options": {"name": "updated_at"},
+        "covers": ["SubscriptionSnapshot.refresh (cambios incrementales)"]
+    },
+    {
+        "collection": "metric_results",
+        "keys": [("period_end", ASCENDING), ("period_start", ASCENDING)],
+        "options": {"name": "result_period"},
+        "covers": ["MetricResultsService.invalidate_range"]
+    },
+    {
+        "collection": "refresh_tokens",
+        "keys": [("expires_at", ASCENDING)],
+        "options": {"name": "refresh_expiry", "expireAfterSeconds": 0},
+        "covers": ["Purga TTL de refresh tokens caducados"]
+    },
+    {
+        "collection": "refresh_tokens",
+        "keys": [("family_id", ASCENDING)],
+        "options": {"name": "refresh_family"},
+        "covers": ["RefreshTokenService.revoke_family"]
+    },
+    {
+        "collection": "refresh_tokens",
+        "keys": [("customer_id", ASCENDING)],
+        "options": {"name": "refresh_customer"},
+        "covers": ["RefreshTokenService.revoke_customer"]
+    }
+]
+
+def _specs_for(collections=None):
+    return [spec for spec in INDEXES if collections is None or spec["collection"] in collections]
+
+def ensure_indexes(db, collections=None):
+    """
+    Crea los índices del registro que falten (idempotente: los existentes con la misma
+    definición no se tocan). Un create_indexes por colección. Retorna los nombres asegurados.
+    """
+    by_collection = {}
+    for spec in _specs_for(collections):
+        by_collection.setdefault(spec["collection"], []).append(IndexModel(spec["keys"], **spec["options"]))
+
+    names = []
+    for collection, models in by_collection.items():
+        names.extend(getattr(db, collection).create_indexes(models))
+    return names
+
+def index_report(db, collections=None):
+    """
+    Retorna, por cada índice del registro, si existe en la base de datos y qué consultas cubre.
+    """
+    existing = {}
+    report = []
+    for spec in _specs_for(collections):
+        collection = spec["collection"]
+        if collection not in existing:
+            existing[collection] = getattr(db, collection).index_information()
+        report.append({
+            "collection": collection,
+            "name": spec["options"]["name"],
+            "keys": spec["keys"],
+            "present": spec["options"]["name"] in existing[collection],
+            "covers": spec["covers"]
+        })
+    return report
@@ -1,5 +1,20 @@
 from datetime import datetime
 
+MONTHS_PER_PERIOD = {
+    "monthly": 1,
+    "annually": 12
+}
+
+def monthly_amount(price, periodicity):
+    """
+    Normaliza el precio de una suscripción a su importe mensual.
+    Retorna None si el precio o la periodicidad no son válidos.
+    """
+    months = MONTHS_PER_PERIOD.get(periodicity)
+    if price is None or months is None:
+        return None
+    return price / float(months)
+
 def subscription_model(
     customer_id, 
     product_id, 
@@ -9,6 +24,7 @@ def subscription_model(
     periodicity_at_subscription, 
     start_date=None
 ):
+    now = datetime.utcnow()
     return {
         "customer_id": customer_id,
         "product_id": product_id,
@@ -16,5 +32,8 @@ def subscription_model(
         "customization": customization,
         "price_at_subscription": price_at_subscription,        
         "periodicity_at_subscription": periodicity_at_subscription, 
-        "start_date": start_date if start_date is not None else datetime.utcnow() 
-    }
\ No newline at end of file
+        "monthly_amount": monthly_amount(price_at_subscription, periodicity_at_subscription),
+        "start_date": start_date if start_date is not None else now,
+        "updated_at": now,
+        "version": 0
+    }
@@ -1,4 +1,6 @@
-from flask import Blueprint, request, jsonify, current_app
+import json
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from config import Config
 from utils.auth import jwt_required 
 
 auth_bp = Blueprint('auth', __name__)
@@ -6,7 +8,7 @@ auth_bp = Blueprint('auth', __name__)
 @auth_bp.route('/login', methods=['POST'])
 def login():
     """
-    Inicia sesión de un cliente y retorna un JWT.
+    Inicia sesión de un cliente y retorna un JWT y un refresh token.
     Body: {"email": "cliente@example.com", "password": "secure_password"}
     """
     data = request.json
@@ -16,11 +18,42 @@ def login():
     if not email or not password:
         return jsonify({"error": "Email and password are required"}), 400
 
-    token, error = current_app.auth_service.login_customer(email, password)
+    tokens, error = current_app.auth_service.login_customer(email, password)
     if error:
+        if "busy" in error:
+            return jsonify({"error": error}), 503
         return jsonify({"error": error}), 401
     
-    return jsonify({"message": "Login successful", "access_token": token}), 200
+    return jsonify({"message": "Login successful", **tokens}), 200
+
+@auth_bp.route('/token/refresh', methods=['POST'])
+def refresh_token():
+    """
+    Renueva el access token. El refresh token presentado queda consumido y se retorna uno nuevo.
+    Body: {"refresh_token": "..."}
+    """
+    data = request.json or {}
+    token = data.get('refresh_token')
+
+    if not token:
+        return jsonify({"error": "refresh_token is required"}), 400
+
+    tokens, error = current_app.auth_service.refresh_access_token(token)
+    if error:
+        return jsonify({"error": error}), 401
+
+    return jsonify({"message": "Token refreshed", **tokens}), 200
+
+@auth_bp.route('/.well-known/jwks.json', methods=['GET'])
+def jwks():
+    """
+    Publica las claves públicas de firma (JWK Set) para que otros nodos verifiquen los tokens sin llamarnos.
+    """
+    response = jsonify(current_app.auth_service.key_ring.jwks())
+    response.cache_control.public = True
+    response.cache_control.max_age = Config.JWKS_CACHE_MAX_AGE_SECONDS
+    response.add_etag()
+    return response.make_conditional(request)
 
 @auth_bp.route('/register_customer', methods=['POST'])
 def register_customer():
@@ -38,9 +71,36 @@ def register_customer():
 
     customer_id, error = current_app.auth_service.register_customer(name, email, password) 
     if error:
+        if "busy" in error:
+            return jsonify({"error": error}), 503
         return jsonify({"error": error}), 409 
     
     return jsonify({
         "message": "Customer registered successfully",
         "customer_id": customer_id
     }), 201
+
+
+@auth_bp.route('/customers/import', methods=['POST'])
+@jwt_required
+def import_customers(current_user_id):
+    """
+    Importa clientes en bloque. Body NDJSON (application/x-ndjson), una línea por cliente:
+    {"name": "...", "email": "...", "password": "..."} o {"name": "...", "email": "...", "password_hash": "$2b$..."}
+    Parámetros de consulta: batch_size (opcional). Responde con un resultado NDJSON por línea.
+    """
+    try:
+        batch_size = int(request.args.get('batch_size', 0))
+    except ValueError:
+        return jsonify({"error": "batch_size must be an integer"}), 400
+    if batch_size < 0:
+        return jsonify({"error": "batch_size must be >= 0"}), 400
+
+    lines = iter(request.stream.readline, b"")
+    results = current_app.auth_service.import_customers(lines, batch_size=batch_size or None)
+
+    def generate():
+        for result in results:
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
\ No newline at end of file
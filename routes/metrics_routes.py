@@ -1,9 +1,56 @@
-from flask import Blueprint, request, jsonify, current_app
-from utils.auth import jwt_required 
+import json
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from utils.auth import jwt_required, decoded_tokens
+from bson import ObjectId
 from datetime import datetime, timedelta
+from services.metrics_service import GRANULARITIES
 
 metrics_bp = Blueprint('metrics', __name__, url_prefix='/metrics')
 
+def _parse_date_range(start_key='start_date', end_key='end_date'):
+    """
+    Lee un rango de fechas YYYY-MM-DD de los parámetros de consulta (fin inclusivo).
+    Retorna (start_date, end_date, error_response).
+    """
+    start_date_str = request.args.get(start_key)
+    end_date_str = request.args.get(end_key)
+
+    if not start_date_str or not end_date_str:
+        return None, None, (jsonify({"error": f"{start_key} and {end_key} are required query parameters"}), 400)
+
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d") + timedelta(days=1, seconds=-1)
+    except ValueError:
+        return None, None, (jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400)
+
+    if start_date >= end_date:
+        return None, None, (jsonify({"error": f"{start_key} must be before {end_key}"}), 400)
+    return start_date, end_date, None
+
+ACTIVE_SUBSCRIPTION_FIELDS = {
+    "customer_id": 1,
+    "product_id": 1,
+    "start_date": 1,
+    "expiration_date": 1,
+    "price_at_subscription": 1,
+    "periodicity_at_subscription": 1,
+    "monthly_amount": 1
+}
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _serialize_series(series):
+    return [
+        {**point, "period_start": point["period_start"].isoformat(), "period_end": point["period_end"].isoformat()}
+        for point in series
+    ]
+
 @metrics_bp.route('/mrr', methods=['GET'])
 @jwt_required
 def get_mrr(current_user_id):
@@ -13,6 +60,62 @@ def get_mrr(current_user_id):
     mrr = current_app.metrics_service.calculate_mrr()
     return jsonify({"mrr": mrr}), 200
 
+@metrics_bp.route('/mrr/series', methods=['GET'])
+@jwt_required
+def get_mrr_series(current_user_id):
+    """
+    Retorna la serie temporal de MRR y ARR al cierre de cada periodo.
+    Parámetros de consulta: start, end (formato: YYYY-MM-DD), granularity (day|week|month, por defecto month)
+    """
+    start_date, end_date, error_response = _parse_date_range('start', 'end')
+    if error_response:
+        return error_response
+
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of: {', '.join(GRANULARITIES)}"}), 400
+
+    series = current_app.metrics_service.calculate_mrr_series(start_date, end_date, granularity)
+    return jsonify({"granularity": granularity, "series": _serialize_series(series)}), 200
+
+@metrics_bp.route('/active_subscriptions', methods=['GET'])
+@jwt_required
+def stream_active_subscriptions(current_user_id):
+    """
+    Transmite como NDJSON (una suscripción por línea) las suscripciones activas en un periodo.
+    Parámetros de consulta: start_date, end_date (formato: YYYY-MM-DD), after (opcional, último _id recibido),
+    limit (opcional, tamaño de página), batch_size (opcional)
+    """
+    start_date, end_date, error_response = _parse_date_range()
+    if error_response:
+        return error_response
+
+    after = request.args.get('after')
+    if after is not None and not ObjectId.is_valid(after):
+        return jsonify({"error": "Invalid after cursor"}), 400
+    try:
+        limit = int(request.args.get('limit', 0))
+        batch_size = int(request.args.get('batch_size', 1000))
+    except ValueError:
+        return jsonify({"error": "limit and batch_size must be integers"}), 400
+    if limit < 0 or batch_size <= 0:
+        return jsonify({"error": "limit must be >= 0 and batch_size must be > 0"}), 400
+
+    subscriptions = current_app.metrics_service.get_active_subscriptions_in_period(
+        start_date,
+        end_date,
+        projection=ACTIVE_SUBSCRIPTION_FIELDS,
+        batch_size=batch_size,
+        after_id=ObjectId(after) if after else None,
+        limit=limit or None
+    )
+
+    def generate():
+        for subscription in subscriptions:
+            yield json.dumps(subscription, default=_json_default) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @metrics_bp.route('/arr', methods=['GET'])
 @jwt_required
 def get_arr(current_user_id):
@@ -81,6 +184,52 @@ def get_churn_rate(current_user_id):
     churn_rate = current_app.metrics_service.calculate_churn_rate(start_date, end_date)
     return jsonify({"churn_rate": churn_rate}), 200
 
+def _retention_series_response():
+    start_date, end_date, error_response = _parse_date_range('start', 'end')
+    if error_response:
+        return error_response
+
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of: {', '.join(GRANULARITIES)}"}), 400
+
+    series = current_app.metrics_service.calculate_retention_series(start_date, end_date, granularity)
+    return jsonify({"granularity": granularity, "series": _serialize_series(series)}), 200
+
+@metrics_bp.route('/retention/series', methods=['GET'])
+@jwt_required
+def get_retention_series(current_user_id):
+    """
+    Retorna CRR y Churn Rate para cada periodo consecutivo.
+    Parámetros de consulta: start, end (formato: YYYY-MM-DD), granularity (day|week|month, por defecto month)
+    """
+    return _retention_series_response()
+
+@metrics_bp.route('/churn/series', methods=['GET'])
+@jwt_required
+def get_churn_series(current_user_id):
+    """
+    Retorna Churn Rate y CRR para cada periodo consecutivo.
+    Parámetros de consulta: start, end (formato: YYYY-MM-DD), granularity (day|week|month, por defecto month)
+    """
+    return _retention_series_response()
+
+@metrics_bp.route('/cohorts', methods=['GET'])
+@jwt_required
+def get_cohorts(current_user_id):
+    """
+    Retorna la matriz de retención (clientes e ingresos) por cohorte mensual de adquisición.
+    Parámetros de consulta: start, end (opcionales, formato: YYYY-MM) para limitar las cohortes.
+    """
+    try:
+        start_month = datetime.strptime(request.args['start'], "%Y-%m") if request.args.get('start') else None
+        end_month = datetime.strptime(request.args['end'], "%Y-%m") if request.args.get('end') else None
+    except ValueError:
+        return jsonify({"error": "Invalid month format. Use YYYY-MM"}), 400
+
+    cohorts = current_app.cohort_service.calculate_cohorts(start_month, end_month)
+    return jsonify({"cohorts": cohorts}), 200
+
 @metrics_bp.route('/aov', methods=['GET'])
 @jwt_required
 def get_aov(current_user_id):
@@ -107,3 +256,34 @@ def get_purchase_frequency(current_user_id):
     """
     frequency = current_app.metrics_service.calculate_purchase_frequency()
     return jsonify({"purchase_frequency": frequency}), 200
+
+@metrics_bp.route('/summary', methods=['GET'])
+@jwt_required
+def get_summary(current_user_id):
+    """
+    Retorna todas las métricas puntuales en una sola consulta.
+    Parámetros de consulta: fields (opcional, separado por comas: mrr,arr,arpu,aov,rpr,purchase_frequency)
+    """
+    fields_param = request.args.get('fields')
+    fields = None
+    if fields_param:
+        fields = tuple(field.strip() for field in fields_param.split(',') if field.strip())
+        unknown_fields = [field for field in fields if field not in current_app.metrics_service.SUMMARY_FIELDS]
+        if unknown_fields:
+            return jsonify({"error": f"Unknown fields: {', '.join(unknown_fields)}"}), 400
+
+    summary = current_app.metrics_service.calculate_summary(fields)
+    return jsonify(summary), 200
+
+@metrics_bp.route('/cache_stats', methods=['GET'])
+@jwt_required
+def get_cache_stats(current_user_id):
+    """
+    Retorna aciertos, fallos y ocupación de las cachés de métricas, de clientes autenticados y de tokens, y el estado del catálogo de productos.
+    """
+    return jsonify({
+        "cache": current_app.metrics_service.cache_stats(),
+        "customer_cache": current_app.auth_service.customer_cache_stats(),
+        "token_cache": decoded_tokens.stats() if decoded_tokens else None,
+        "product_catalog": current_app.subscription_service.product_catalog.stats()
+    }), 200
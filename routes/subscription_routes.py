@@ -1,5 +1,8 @@
+import json
 from flask import Blueprint, request, jsonify, current_app
 from utils.auth import jwt_required 
+from utils import settings_patch
+from config import Config
 from datetime import datetime, timedelta
 
 subscription_bp = Blueprint('subscription', __name__)
@@ -49,8 +52,9 @@ def subscribe(current_user_id):
     if customer_id_str != current_user_id:
         return jsonify({"error": "You can only subscribe on behalf of yourself."}), 403
 
+    # jwt_required ya comprobó que el cliente existe y es el mismo que el del token.
     subscription_id, error = current_app.subscription_service.subscribe_customer_to_product(
-        customer_id_str, product_id_str, expiration_date_str, customization
+        customer_id_str, product_id_str, expiration_date_str, customization, customer_verified=True
     )
 
     if error:
@@ -67,6 +71,28 @@ def subscribe(current_user_id):
         "subscription_id": subscription_id
     }), 201
 
+@subscription_bp.route('/subscribe/batch', methods=['POST'])
+@jwt_required
+def subscribe_batch(current_user_id):
+    """
+    Crea varias suscripciones en una sola petición, con un resultado por item.
+    Body: {"subscriptions": [{"customer_id": "...", "product_id": "...", "expiration_date": "YYYY-MM-DDTHH:MM:SS", "customization": {...}}, ...]}
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('subscriptions')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "subscriptions must be a non-empty list"}), 400
+    if len(items) > Config.SUBSCRIBE_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"A batch can contain at most {Config.SUBSCRIBE_BATCH_MAX_ITEMS} subscriptions"}), 413
+
+    # Igual que /subscribe: solo en nombre del propio cliente, ya validado por jwt_required.
+    results = current_app.subscription_service.subscribe_many(
+        items, customer_id_str=current_user_id, customer_verified=True
+    )
+    created = sum(1 for result in results if result["status"] == "created")
+    return jsonify({"created": created, "failed": len(results) - created, "results": results}), 200
+
 @subscription_bp.route('/subscription_status/<string:subscription_id_str>', methods=['GET'])
 @jwt_required 
 def get_subscription_status(subscription_id_str, current_user_id):
@@ -103,33 +129,128 @@ def get_subscription_settings(subscription_id_str, current_user_id):
         elif "Product associated with this subscription is not customizable" in error:
             return jsonify({"error": error}), 400 
         return jsonify({"error": error}), 500 
-    return jsonify({
+    version = subscription.get("version", 0)
+    response = jsonify({
         "subscription_id": subscription_id_str,
-        "settings": settings
-    }), 200
+        "settings": settings,
+        "version": version
+    })
+    response.set_etag(str(version))
+    return response, 200
 
-@subscription_bp.route('/edit_subscription_settings/<string:subscription_id_str>', methods=['PUT'])
+PATCH_FORMATS = {
+    "application/merge-patch+json": settings_patch.MERGE_PATCH,
+    "application/json-patch+json": settings_patch.JSON_PATCH
+}
+
+def _if_match_version():
+    """
+    Versión esperada desde la cabecera If-Match ("3" o W/"3"); None si no hay cabecera o es "*".
+    """
+    if_match = request.headers.get('If-Match')
+    if not if_match or if_match.strip() == "*":
+        return None
+    tag = if_match.split(",")[0].strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    tag = tag.strip('"')
+    if not tag.isdigit():
+        raise ValueError("If-Match must be the ETag returned for these settings")
+    return int(tag)
+
+@subscription_bp.route('/subscription_settings/<string:subscription_id_str>', methods=['PATCH'])
 @jwt_required
-def edit_subscription_settings(subscription_id_str, current_user_id):
-    subscription = current_app.subscription_service.get_subscription_by_id(subscription_id_str)
-    if not subscription:
-        return jsonify({"error": "Subscription not found"}), 404
+def patch_subscription_settings(subscription_id_str, current_user_id):
+    """
+    Modifica solo las claves indicadas de la personalización.
+    Content-Type: application/merge-patch+json ({"color": "green", "old_key": null})
+    o application/json-patch+json ([{"op": "replace", "path": "/color", "value": "green"}]).
+    Con application/json se deduce el formato (objeto: merge patch, array: JSON Patch).
+    Cabecera If-Match opcional con el ETag (versión) de la última lectura.
+    """
+    if request.content_length and request.content_length > Config.SETTINGS_PATCH_MAX_BYTES:
+        return jsonify({"error": f"Patch exceeds the limit of {Config.SETTINGS_PATCH_MAX_BYTES} bytes"}), 413
+    if request.mimetype not in PATCH_FORMATS and request.mimetype != "application/json":
+        return jsonify({"error": "Unsupported patch media type"}), 415
+    # Sin Content-Length (chunked) el límite se aplica a lo leído: nunca más de límite + 1 bytes.
+    body = request.stream.read(Config.SETTINGS_PATCH_MAX_BYTES + 1)
+    if len(body) > Config.SETTINGS_PATCH_MAX_BYTES:
+        return jsonify({"error": f"Patch exceeds the limit of {Config.SETTINGS_PATCH_MAX_BYTES} bytes"}), 413
+    try:
+        patch = json.loads(body)
+    except ValueError:
+        patch = None
+    if patch is None:
+        return jsonify({"error": "A JSON patch body is required"}), 400
 
-    if str(subscription["customer_id"]) != current_user_id:
-       return jsonify({"error": "You are not authorized to edit these settings"}), 403
+    patch_format = PATCH_FORMATS.get(request.mimetype)
+    if patch_format is None:
+        patch_format = settings_patch.JSON_PATCH if isinstance(patch, list) else settings_patch.MERGE_PATCH
+    try:
+        expected_version = _if_match_version()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    version, error = current_app.subscription_service.patch_subscription_settings(
+        subscription_id_str, patch, patch_format, customer_id_str=current_user_id, expected_version=expected_version
+    )
+    if error:
+        if "Invalid" in error:
+            return jsonify({"error": error}), 400
+        elif "cannot be applied" in error:
+            return jsonify({"error": error}), 409
+        elif "not found" in error:
+            return jsonify({"error": error}), 404
+        elif "not authorized" in error:
+            return jsonify({"error": "You are not authorized to edit these settings"}), 403
+        elif "modified concurrently" in error:
+            return jsonify({"error": error}), 412
+        elif "Product associated with this subscription is not customizable" in error:
+            return jsonify({"error": error}), 400
+        return jsonify({"error": error}), 500
+
+    response = jsonify({"subscription_id": subscription_id_str, "version": version})
+    response.set_etag(str(version))
+    return response, 200
 
+def _expected_version(data):
+    """
+    Versión esperada opcional del body ("version"); la operación falla con 409 si la suscripción cambió.
+    """
+    version = data.get('version')
+    if version is not None and (isinstance(version, bool) or not isinstance(version, int) or version < 0):
+        raise ValueError("version must be a non-negative integer")
+    return version
+
+@subscription_bp.route('/edit_subscription_settings/<string:subscription_id_str>', methods=['PUT'])
+@jwt_required
+def edit_subscription_settings(subscription_id_str, current_user_id):
+    """
+    Reemplaza la personalización de una suscripción del usuario autenticado.
+    Body: {"settings": {...}, "version": 3 (opcional)}
+    """
     data = request.json
     new_settings = data.get('settings')
 
     if not new_settings:
         return jsonify({"error": "New settings are required"}), 400
+    try:
+        expected_version = _expected_version(data)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
 
-    success, error = current_app.subscription_service.edit_subscription_settings(subscription_id_str, new_settings)
+    success, error = current_app.subscription_service.edit_subscription_settings(
+        subscription_id_str, new_settings, customer_id_str=current_user_id, expected_version=expected_version
+    )
     if error:
         if "Invalid" in error:
             return jsonify({"error": error}), 400
         elif "not found" in error:
             return jsonify({"error": error}), 404
+        elif "not authorized" in error:
+            return jsonify({"error": "You are not authorized to edit these settings"}), 403
+        elif "modified concurrently" in error:
+            return jsonify({"error": error}), 409
         elif "Product associated with this subscription is not customizable" in error:
             return jsonify({"error": error}), 400
         elif "Settings already up to date" in error:
@@ -145,27 +266,30 @@ def edit_subscription_settings(subscription_id_str, current_user_id):
 def extend_subscription(subscription_id_str, current_user_id):
     """
     Establece una nueva fecha de expiración para una suscripción.
-    Body: {"new_expiration_date": "YYYY-MM-DDTHH:MM:SS"}
+    Body: {"new_expiration_date": "YYYY-MM-DDTHH:MM:SS", "version": 3 (opcional)}
     """
-    subscription = current_app.subscription_service.get_subscription_by_id(subscription_id_str)
-    if not subscription:
-        return jsonify({"error": "Subscription not found"}), 404
-
-    if str(subscription["customer_id"]) != current_user_id:
-       return jsonify({"error": "You are not authorized to extend this subscription"}), 403
-
     data = request.json
     new_expiration_date_str = data.get('new_expiration_date')
 
     if not new_expiration_date_str:
         return jsonify({"error": "New expiration date is required"}), 400
+    try:
+        expected_version = _expected_version(data)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
 
-    success, error = current_app.subscription_service.extend_subscription(subscription_id_str, new_expiration_date_str)
+    success, error = current_app.subscription_service.extend_subscription(
+        subscription_id_str, new_expiration_date_str, customer_id_str=current_user_id, expected_version=expected_version
+    )
     if error:
         if "Invalid" in error:
             return jsonify({"error": error}), 400
         elif "not found" in error:
             return jsonify({"error": error}), 404
+        elif "not authorized" in error:
+            return jsonify({"error": "You are not authorized to extend this subscription"}), 403
+        elif "modified concurrently" in error:
+            return jsonify({"error": error}), 409
         elif "Subscription expiration date already set to this value" in error:
             return jsonify({"message": error}), 200 
         return jsonify({"error": error}), 500
@@ -0,0 +1,270 @@
+import fcntl
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from bson import ObjectId
+from config import Config
+
+EPOCH = datetime(1970, 1, 1)
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+# Periodicidad -> meses que cubre un pago (uint8). 0 = desconocida.
+PERIODICITY_CODES = {"monthly": 1, "annually": 12}
+
+COLUMNS = {
+    "ids": "V12",
+    "start": np.int64,
+    "expiry": np.int64,
+    "price": np.float64,
+    "periodicity": np.uint8,
+    "customer": np.int32,
+    "product": np.int32
+}
+
+def _to_epoch(moment):
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - EPOCH) // timedelta(seconds=1)
+
+def _row_positions(ids_column, ids):
+    """
+    Posición de cada _id en la columna ids (-1 si no está), buscando sobre la columna ordenada.
+    """
+    if len(ids_column) == 0 or not ids:
+        return np.full(len(ids), -1, dtype=np.int64)
+    keys = ids_column.view("S12")
+    order = np.argsort(keys, kind="stable")
+    targets = np.array(ids, dtype="S12")
+    found = np.minimum(np.searchsorted(keys, targets, sorter=order), len(keys) - 1)
+    return np.where(keys[order[found]] == targets, order[found], -1)
+
+class SubscriptionSnapshot:
+    """
+    Instantánea columnar de subscriptions para analítica en memoria.
+    Cada columna es un .npy que los workers abren con mmap (una sola copia en la caché de páginas);
+    customer_id y product_id se codifican como int32 contra diccionarios guardados en meta.json.
+    Un único proceso escritor (flask analytics refresh-snapshot) genera nuevas generaciones y
+    los lectores las recargan cuando cambia meta.json.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._meta = None
+        self._meta_mtime = None
+        self._columns = None
+
+    # --- Lectura ---------------------------------------------------------------
+
+    def _meta_path(self):
+        return os.path.join(self.path, META_FILE)
+
+    def _column_path(self, name, generation):
+        return os.path.join(self.path, f"{name}.{generation}.npy")
+
+    def _load(self):
+        """
+        Abre (o reabre si hay una generación nueva) las columnas con mmap. Retorna False si no hay instantánea.
+        """
+        try:
+            mtime = os.stat(self._meta_path()).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._meta_mtime:
+            return True
+
+        with open(self._meta_path()) as meta_file:
+            meta = json.load(meta_file)
+        self._columns = {
+            name: np.load(self._column_path(name, meta["generation"]), mmap_mode="r")
+            for name in COLUMNS
+        }
+        self._meta = meta
+        self._meta_mtime = mtime
+        return True
+
+    def is_available(self):
+        return self._load()
+
+    def _active_mask(self, moment):
+        epoch = _to_epoch(moment)
+        return (self._columns["start"] <= epoch) & (self._columns["expiry"] > epoch)
+
+    def _monthly_amounts(self, mask):
+        periodicity = self._columns["periodicity"][mask]
+        price = self._columns["price"][mask]
+        return np.divide(price, periodicity, out=np.zeros_like(price), where=periodicity > 0)
+
+    def _customers_where(self, mask):
+        """
+        Array booleano por código de cliente: True si tiene alguna fila en la máscara.
+        """
+        counts = np.bincount(self._columns["customer"][mask], minlength=len(self._meta["customers"]))
+        return counts > 0
+
+    def mrr(self, as_of):
+        self._load()
+        return round(float(self._monthly_amounts(self._active_mask(as_of)).sum()), 2)
+
+    def arpu(self, as_of):
+        self._load()
+        mask = self._active_mask(as_of)
+        num_active_customers = int(np.count_nonzero(self._customers_where(mask)))
+        if num_active_customers == 0:
+            return 0.0
+        return round(float(self._monthly_amounts(mask).sum()) / num_active_customers, 2)
+
+    def customer_retention_rate(self, start_date, end_date):
+        self._load()
+        at_start = self._customers_where(self._active_mask(start_date))
+        at_end = self._customers_where(self._active_mask(end_date))
+        start_epoch, end_epoch = _to_epoch(start_date), _to_epoch(end_date)
+        starts = self._columns["start"]
+        new_customers = self._customers_where((starts >= start_epoch) & (starts <= end_epoch))
+
+        num_customers_at_start = int(np.count_nonzero(at_start))
+        if num_customers_at_start == 0:
+            return 0.0
+        retained = int(np.count_nonzero(at_end & ~new_customers))
+        return round(retained / num_customers_at_start * 100, 2)
+
+    def churn_rate(self, start_date, end_date):
+        self._load()
+        at_start = self._customers_where(self._active_mask(start_date))
+        at_end = self._customers_where(self._active_mask(end_date))
+
+        num_customers_at_start = int(np.count_nonzero(at_start))
+        if num_customers_at_start == 0:
+            return 0.0
+        lost = int(np.count_nonzero(at_start & ~at_end))
+        return round(lost / num_customers_at_start * 100, 2)
+
+    def rpr(self):
+        self._load()
+        counts = np.bincount(self._columns["customer"], minlength=len(self._meta["customers"]))
+        num_total_customers = int(np.count_nonzero(counts))
+        if num_total_customers == 0:
+            return 0.0
+        return round(int(np.count_nonzero(counts > 1)) / num_total_customers * 100, 2)
+
+    # --- Escritura -------------------------------------------------------------
+
+    def refresh(self, subscriptions_collection, overlap_seconds=None):
+        """
+        Actualiza la instantánea con las suscripciones nuevas (_id desde el último visto)
+        o modificadas (updated_at desde la marca de agua) y publica una nueva generación.
+        Ambas marcas se releen con un solape de overlap_seconds: updated_at y _id los genera el
+        reloj de cada worker, así que una escritura confirmada tras el refresco puede llevar una
+        marca anterior. Releer es seguro porque las filas se actualizan por _id.
+        Retorna el número de filas insertadas o cambiadas.
+        """
+        if overlap_seconds is None:
+            overlap_seconds = Config.ANALYTICS_SNAPSHOT_OVERLAP_SECONDS
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, LOCK_FILE), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return self._refresh_locked(subscriptions_collection, timedelta(seconds=overlap_seconds))
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh_locked(self, subscriptions_collection, overlap):
+        self._meta_mtime = None
+        if self._load():
+            meta = self._meta
+            current = self._columns
+            conditions = []
+            if meta["last_id"]:
+                since = ObjectId(meta["last_id"]).generation_time - overlap
+                conditions.append({"_id": {"$gte": ObjectId.from_datetime(since)}})
+            if meta["watermark"]:
+                conditions.append({"updated_at": {"$gte": datetime.fromisoformat(meta["watermark"]) - overlap}})
+            query = {"$or": conditions} if conditions else {}
+        else:
+            meta = {"generation": 0, "last_id": None, "watermark": None, "customers": [], "products": []}
+            current = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+            query = {}
+
+        customer_codes = {customer: code for code, customer in enumerate(meta["customers"])}
+        product_codes = {product: code for code, product in enumerate(meta["products"])}
+        last_id = ObjectId(meta["last_id"]) if meta["last_id"] else None
+        watermark = datetime.fromisoformat(meta["watermark"]) if meta["watermark"] else None
+
+        changed = subscriptions_collection.find(
+            query,
+            {"customer_id": 1, "product_id": 1, "start_date": 1, "expiration_date": 1,
+             "price_at_subscription": 1, "periodicity_at_subscription": 1, "updated_at": 1},
+            batch_size=10000
+        )
+        fetched = {}
+        for sub in changed:
+            customer = str(sub["customer_id"])
+            product = str(sub["product_id"])
+            fetched[sub["_id"].binary] = {
+                "ids": sub["_id"].binary,
+                "start": _to_epoch(sub["start_date"]),
+                "expiry": _to_epoch(sub["expiration_date"]),
+                "price": sub.get("price_at_subscription") or 0.0,
+                "periodicity": PERIODICITY_CODES.get(sub.get("periodicity_at_subscription"), 0),
+                "customer": customer_codes.setdefault(customer, len(customer_codes)),
+                "product": product_codes.setdefault(product, len(product_codes))
+            }
+            if last_id is None or sub["_id"] > last_id:
+                last_id = sub["_id"]
+            updated_at = sub.get("updated_at")
+            if updated_at and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+
+        # Solo se trabaja sobre las filas releídas: las columnas siguen siendo los arrays mapeados.
+        fetched_rows = list(fetched.values())
+        positions = _row_positions(current["ids"], list(fetched))
+        existing = positions >= 0
+        fetched_columns = {
+            name: np.array([values[name] for values in fetched_rows], dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+        differs = np.zeros(int(np.count_nonzero(existing)), dtype=bool)
+        for name in COLUMNS:
+            if name != "ids":
+                differs |= current[name][positions[existing]] != fetched_columns[name][existing]
+        updated = np.flatnonzero(existing)[differs]
+        appended = np.flatnonzero(~existing)
+        changed_rows = len(updated) + len(appended)
+
+        if changed_rows == 0 and meta["generation"] > 0:
+            return 0
+
+        columns = {}
+        for name in COLUMNS:
+            column = np.concatenate([current[name], fetched_columns[name][appended]])
+            column[positions[updated]] = fetched_columns[name][updated]
+            columns[name] = column
+
+        previous_generation = meta["generation"]
+        generation = previous_generation + 1
+        for name in COLUMNS:
+            np.save(self._column_path(name, generation), columns[name])
+
+        new_meta = {
+            "generation": generation,
+            "rows": len(columns["ids"]),
+            "last_id": str(last_id) if last_id else None,
+            "watermark": watermark.isoformat() if watermark else None,
+            "customers": list(customer_codes),
+            "products": list(product_codes),
+            "refreshed_at": datetime.utcnow().isoformat()
+        }
+        tmp_meta_path = self._meta_path() + ".tmp"
+        with open(tmp_meta_path, "w") as meta_file:
+            json.dump(new_meta, meta_file)
+        os.replace(tmp_meta_path, self._meta_path())
+
+        # Los lectores que aún mapean la generación anterior conservan sus páginas tras el unlink.
+        if previous_generation:
+            for name in COLUMNS:
+                try:
+                    os.remove(self._column_path(name, previous_generation))
+                except FileNotFoundError:
+                    pass
+        return changed_rows
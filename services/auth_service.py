@@ -1,44 +1,241 @@
-import jwt
+import json
 from datetime import datetime, timedelta, timezone
 from database import get_db
 from models.customer import customer_model
-from utils.security import hash_password, verify_password
+from utils.security import password_hasher, HasherBusyError, is_bcrypt_hash
+from services.refresh_token_service import RefreshTokenService
+from utils.jwt_keys import get_key_ring
+from utils.cache import TTLCache
 from config import Config
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from bson import ObjectId
+
+DUPLICATE_KEY_ERROR = 11000
 
 class AuthService:
-    def __init__(self, db):
+    def __init__(self, db, hasher=None, key_ring=None):
         self.db = db
         self.customers_collection = self.db.customers
+        self.password_hasher = hasher or password_hasher
+        self.refresh_tokens = RefreshTokenService(db)
+        self.key_ring = key_ring or get_key_ring()
+        self.verified_customers = None
+        if Config.AUTH_CUSTOMER_CACHE_TTL_SECONDS > 0:
+            self.verified_customers = TTLCache(
+                Config.AUTH_CUSTOMER_CACHE_MAX_ENTRIES, Config.AUTH_CUSTOMER_CACHE_TTL_SECONDS
+            )
 
     def register_customer(self, name, email, password):
-        if self.customers_collection.find_one({"email": email}):
-            return None, "Customer with this email already exists"
-        
-        hashed_password = hash_password(password)
+        """
+        Registra un cliente con una sola escritura; el índice único customer_email rechaza los emails repetidos.
+        """
+        try:
+            hashed_password = self.password_hasher.hash(password)
+        except HasherBusyError:
+            return None, "Authentication service is busy, try again later"
         customer_data = customer_model(name, email, hashed_password)
-        result = self.customers_collection.insert_one(customer_data)
+        try:
+            result = self.customers_collection.insert_one(customer_data)
+        except DuplicateKeyError:
+            return None, "Customer with this email already exists"
         return str(result.inserted_id), None
 
+    def import_customers(self, lines, batch_size=None):
+        """
+        Importación masiva desde NDJSON: una línea por cliente con name, email y password
+        (se hashea en el pool) o password_hash (un hash bcrypt existente, que se guarda tal cual).
+        Escribe con insert_many(ordered=False) por lotes de batch_size y genera un resultado por línea:
+        {"line", "email", "status": "created"|"duplicate"|"invalid", "customer_id" o "error"}.
+        """
+        batch_size = batch_size or Config.CUSTOMER_IMPORT_BATCH_SIZE
+        batch = []
+        for line_number, line in enumerate(lines, start=1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            batch.append((line_number, line))
+            if len(batch) >= batch_size:
+                yield from self._import_batch(batch)
+                batch = []
+        if batch:
+            yield from self._import_batch(batch)
+
+    def _import_batch(self, batch):
+        results = {}
+        rows = []
+        for line_number, line in batch:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                results[line_number] = {"line": line_number, "status": "invalid", "error": "Invalid JSON"}
+                continue
+            error = self._validate_import_row(data)
+            if error:
+                results[line_number] = {
+                    "line": line_number, "email": data.get("email") if isinstance(data, dict) else None,
+                    "status": "invalid", "error": error
+                }
+                continue
+            rows.append((line_number, data))
+
+        to_hash = [index for index, (_, data) in enumerate(rows) if not data.get("password_hash")]
+        hashes = self.password_hasher.hash_many([rows[index][1]["password"] for index in to_hash])
+        password_hashes = [data.get("password_hash") for _, data in rows]
+        for index, hashed_password in zip(to_hash, hashes):
+            password_hashes[index] = hashed_password
+
+        documents = [
+            customer_model(data["name"], data["email"], hashed_password)
+            for (_, data), hashed_password in zip(rows, password_hashes)
+        ]
+        # _id asignado aquí para poder informar del id de cada fila aunque insert_many falle parcialmente.
+        for document in documents:
+            document["_id"] = ObjectId()
+        write_errors = {}
+        if documents:
+            try:
+                self.customers_collection.insert_many(documents, ordered=False)
+            except BulkWriteError as error:
+                write_errors = {write_error["index"]: write_error for write_error in error.details["writeErrors"]}
+
+        for index, ((line_number, data), document) in enumerate(zip(rows, documents)):
+            result = {"line": line_number, "email": data["email"]}
+            write_error = write_errors.get(index)
+            if write_error is None:
+                result.update({"status": "created", "customer_id": str(document["_id"])})
+            elif write_error.get("code") == DUPLICATE_KEY_ERROR:
+                result.update({"status": "duplicate", "error": "Customer with this email already exists"})
+            else:
+                result.update({"status": "invalid", "error": write_error.get("errmsg", "Write error")})
+            results[line_number] = result
+
+        for line_number in sorted(results):
+            yield results[line_number]
+
+    @staticmethod
+    def _validate_import_row(data):
+        if not isinstance(data, dict):
+            return "Each line must be a JSON object"
+        if not data.get("name") or not data.get("email"):
+            return "Name and email are required"
+        if not isinstance(data["name"], str) or not isinstance(data["email"], str):
+            return "Name and email must be strings"
+        if data.get("password_hash"):
+            if not is_bcrypt_hash(data["password_hash"]):
+                return "password_hash must be a bcrypt hash"
+        elif not data.get("password"):
+            return "password or password_hash is required"
+        elif not isinstance(data["password"], str):
+            return "password must be a string"
+        return None
+
     def login_customer(self, email, password):
-        customer = self.customers_collection.find_one({"email": email})
+        # Una cuenta deshabilitada responde igual que una inexistente y no recibe tokens.
+        customer = self.customers_collection.find_one({"email": email, "disabled": {"$ne": True}})
         if not customer:
             return None, "Invalid credentials"
 
-        if not verify_password(password, customer["password_hash"]):
-            return None, "Invalid credentials"
+        try:
+            if not self.password_hasher.verify(password, customer["password_hash"]):
+                return None, "Invalid credentials"
+        except HasherBusyError:
+            return None, "Authentication service is busy, try again later"
+        if self.password_hasher.needs_rehash(customer["password_hash"]):
+            try:
+                self._rehash_password(customer, password)
+            except HasherBusyError:
+                # El rehash es opcional: el login ya está verificado y el siguiente lo reintentará.
+                pass
+
+        customer_id = str(customer["_id"])
+        return {
+            "access_token": self._issue_access_token(customer_id, customer["email"]),
+            "refresh_token": self.refresh_tokens.issue(customer_id, customer["email"]),
+            "expires_in": Config.JWT_ACCESS_TOKEN_EXPIRES_SECONDS
+        }, None
 
+    def refresh_access_token(self, refresh_token):
+        """
+        Renueva el access token con un refresh token rotatorio, sin bcrypt ni lectura de customers.
+        Retorna (tokens, error) con la misma forma que login_customer.
+        """
+        rotated, error = self.refresh_tokens.rotate(refresh_token)
+        if error:
+            return None, error
+        return {
+            "access_token": self._issue_access_token(rotated["customer_id"], rotated["email"]),
+            "refresh_token": rotated["refresh_token"],
+            "expires_in": Config.JWT_ACCESS_TOKEN_EXPIRES_SECONDS
+        }, None
+
+    def _issue_access_token(self, customer_id, email):
         payload = {
-            "sub": str(customer["_id"]), 
-            "email": customer["email"],
+            "sub": customer_id, 
+            "email": email,
             "exp": datetime.now(timezone.utc) + timedelta(seconds=Config.JWT_ACCESS_TOKEN_EXPIRES_SECONDS)
         }
-        
-        token = jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm="HS256")
-        
-        return token, None
+        return self.key_ring.encode(payload)
+
+    def _rehash_password(self, customer, password):
+        """
+        Actualiza el hash al coste configurado (BCRYPT_ROUNDS) tras un login correcto.
+        El filtro por el hash anterior evita pisar un cambio de contraseña concurrente.
+        """
+        new_hash = self.password_hasher.hash(password)
+        self.customers_collection.update_one(
+            {"_id": customer["_id"], "password_hash": customer["password_hash"]},
+            {"$set": {"password_hash": new_hash}}
+        )
 
     def get_customer_by_id(self, customer_id_str):
         from bson import ObjectId 
         if not ObjectId.is_valid(customer_id_str):
             return None
-        return self.customers_collection.find_one({"_id": ObjectId(customer_id_str)})
\ No newline at end of file
+        return self.customers_collection.find_one({"_id": ObjectId(customer_id_str)})
+
+    def customer_exists(self, customer_id_str):
+        """
+        Confirma que el cliente existe y no está deshabilitado.
+        Los IDs verificados se guardan en una caché en proceso; en un fallo solo se consulta el _id.
+        """
+        if self.verified_customers is not None and self.verified_customers.get(customer_id_str):
+            return True
+
+        from bson import ObjectId 
+        if not ObjectId.is_valid(customer_id_str):
+            return False
+        customer = self.customers_collection.find_one(
+            {"_id": ObjectId(customer_id_str), "disabled": {"$ne": True}},
+            {"_id": 1}
+        )
+        if customer is None:
+            return False
+        if self.verified_customers is not None:
+            self.verified_customers.set(customer_id_str, True)
+        return True
+
+    def invalidate_customer(self, customer_id_str):
+        """
+        Hook de invalidación: debe llamarse al borrar o deshabilitar un cliente.
+        En otros workers la entrada caduca tras AUTH_CUSTOMER_CACHE_TTL_SECONDS.
+        """
+        if self.verified_customers is not None:
+            self.verified_customers.invalidate(customer_id_str)
+
+    def disable_customer(self, customer_id_str):
+        from bson import ObjectId 
+        if not ObjectId.is_valid(customer_id_str):
+            return False, "Invalid customer_id format"
+        result = self.customers_collection.update_one(
+            {"_id": ObjectId(customer_id_str)},
+            {"$set": {"disabled": True}}
+        )
+        self.invalidate_customer(customer_id_str)
+        self.refresh_tokens.revoke_customer(customer_id_str)
+        if result.matched_count == 0:
+            return False, "Customer not found"
+        return True, None
+
+    def customer_cache_stats(self):
+        return self.verified_customers.stats() if self.verified_customers else None
\ No newline at end of file
@@ -0,0 +1,122 @@
+import numpy as np
+from datetime import datetime, time
+
+MIDNIGHT = time(0, 0)
+
+class CohortService:
+    """
+    Matrices de retención por cohorte mensual de adquisición.
+    Filas: mes de la primera suscripción del cliente. Columnas: meses desde la adquisición.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.subscriptions_collection = self.db.subscriptions
+
+    def _load_arrays(self, as_of):
+        """
+        Carga customer_id, start_date, expiration_date y monthly_amount en arrays de NumPy
+        con un único cursor proyectado. customer_id se codifica como entero y las fechas como
+        índice de mes (año * 12 + mes - 1); expiration_date es exclusiva, así que su último
+        mes activo es el del instante anterior.
+        """
+        cursor = self.subscriptions_collection.find(
+            {"start_date": {"$lte": as_of}},
+            {"_id": 0, "customer_id": 1, "start_date": 1, "expiration_date": 1, "monthly_amount": 1},
+            batch_size=10000
+        )
+        customer_codes = {}
+        customers, start_months, end_months, amounts = [], [], [], []
+        for sub in cursor:
+            start = sub["start_date"]
+            expiration = sub["expiration_date"]
+            end_month = expiration.year * 12 + expiration.month - 1
+            if expiration.day == 1 and expiration.time() == MIDNIGHT:
+                end_month -= 1
+            customers.append(customer_codes.setdefault(sub["customer_id"], len(customer_codes)))
+            start_months.append(start.year * 12 + start.month - 1)
+            end_months.append(end_month)
+            amounts.append(sub.get("monthly_amount") or 0.0)
+
+        return (
+            np.array(customers, dtype=np.int64),
+            np.array(start_months, dtype=np.int64),
+            np.array(end_months, dtype=np.int64),
+            np.array(amounts, dtype=np.float64),
+            len(customer_codes)
+        )
+
+    def calculate_cohorts(self, start_month=None, end_month=None, as_of=None):
+        """
+        Calcula la retención de clientes (logo) y de ingresos por cohorte mensual.
+        Un cliente cuenta como retenido en un mes si tiene alguna suscripción activa durante ese mes;
+        el ingreso de un mes es la suma de monthly_amount de sus suscripciones activas.
+        start_month/end_month (datetime) limitan las cohortes devueltas.
+        """
+        as_of = as_of or datetime.utcnow()
+        customers, start_months, end_months, amounts, num_customers = self._load_arrays(as_of)
+        if num_customers == 0:
+            return []
+
+        as_of_month = as_of.year * 12 + as_of.month - 1
+        end_months = np.minimum(end_months, as_of_month)
+
+        valid = end_months >= start_months
+        customers, start_months, end_months, amounts = (
+            customers[valid], start_months[valid], end_months[valid], amounts[valid]
+        )
+
+        first_months = np.full(num_customers, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first_months, customers, start_months)
+        has_cohort = first_months != np.iinfo(np.int64).max
+        if not has_cohort.any():
+            # Ninguna suscripción llega a estar activa un mes (p. ej. empieza y expira el día 1 a las 00:00).
+            return []
+        min_month = first_months[has_cohort].min()
+        num_months = int(as_of_month - min_month + 1)
+
+        # Expande cada suscripción en un registro por mes activo.
+        lengths = end_months - start_months + 1
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        row_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        months = start_months[rows] + (np.arange(lengths.sum()) - row_offsets)
+        row_customers = customers[rows]
+
+        cohort_index = first_months[row_customers] - min_month
+        ages = months - first_months[row_customers]
+
+        revenue = np.zeros((num_months, num_months), dtype=np.float64)
+        np.add.at(revenue, (cohort_index, ages), amounts[rows])
+
+        # Un cliente con varias suscripciones en el mismo mes cuenta una sola vez.
+        keys = np.sort(row_customers * num_months + (months - min_month))
+        unique_keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+        unique_customers = unique_keys // num_months
+        unique_months = unique_keys % num_months + min_month
+        logos = np.zeros((num_months, num_months), dtype=np.int64)
+        np.add.at(
+            logos,
+            (first_months[unique_customers] - min_month, unique_months - first_months[unique_customers]),
+            1
+        )
+
+        cohort_sizes = np.bincount(first_months[has_cohort] - min_month, minlength=num_months)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logo_retention = np.where(cohort_sizes[:, None] > 0, logos / cohort_sizes[:, None] * 100, 0.0)
+            revenue_retention = np.where(revenue[:, [0]] > 0, revenue / revenue[:, [0]] * 100, 0.0)
+
+        first_row = 0 if start_month is None else max(start_month.year * 12 + start_month.month - 1 - min_month, 0)
+        last_row = num_months - 1 if end_month is None else min(end_month.year * 12 + end_month.month - 1 - min_month, num_months - 1)
+
+        cohorts = []
+        for row in range(first_row, last_row + 1):
+            if cohort_sizes[row] == 0:
+                continue
+            observable_ages = num_months - row
+            cohorts.append({
+                "cohort": f"{(min_month + row) // 12:04d}-{(min_month + row) % 12 + 1:02d}",
+                "customers": int(cohort_sizes[row]),
+                "logo_retention": np.round(logo_retention[row, :observable_ages], 2).tolist(),
+                "revenue": np.round(revenue[row, :observable_ages], 2).tolist(),
+                "revenue_retention": np.round(revenue_retention[row, :observable_ages], 2).tolist()
+            })
+        return cohorts
@@ -0,0 +1,59 @@
+from datetime import datetime, timezone
+
+def as_naive_utc(moment):
+    """
+    Normaliza una fecha a UTC sin zona horaria, como la guarda MongoDB.
+    """
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+class MetricResultsService:
+    """
+    Almacén permanente de métricas de periodos cerrados (colección metric_results).
+    Un resultado solo se invalida cuando una escritura toca fechas dentro de su periodo.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.results_collection = self.db.metric_results
+
+    @staticmethod
+    def _result_id(metric, period_start, period_end):
+        return f"{metric}:{period_start.isoformat()}:{period_end.isoformat()}"
+
+    @staticmethod
+    def is_closed(period_end):
+        return as_naive_utc(period_end) < datetime.utcnow()
+
+    def get(self, metric, period_start, period_end):
+        stored = self.results_collection.find_one(
+            {"_id": self._result_id(metric, as_naive_utc(period_start), as_naive_utc(period_end))},
+            {"value": 1}
+        )
+        return stored["value"] if stored else None
+
+    def save(self, metric, period_start, period_end, value):
+        period_start = as_naive_utc(period_start)
+        period_end = as_naive_utc(period_end)
+        self.results_collection.replace_one(
+            {"_id": self._result_id(metric, period_start, period_end)},
+            {
+                "metric": metric,
+                "period_start": period_start,
+                "period_end": period_end,
+                "value": value,
+                "computed_at": datetime.utcnow()
+            },
+            upsert=True
+        )
+
+    def invalidate_range(self, changed_from, changed_until):
+        """
+        Elimina los resultados cuyo periodo se solapa con [changed_from, changed_until].
+        Retorna el número de resultados eliminados.
+        """
+        result = self.results_collection.delete_many({
+            "period_end": {"$gte": as_naive_utc(changed_from)},
+            "period_start": {"$lte": as_naive_utc(changed_until)}
+        })
+        return result.deleted_count
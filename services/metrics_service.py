@@ -1,44 +1,191 @@
 from database import get_db
 from datetime import datetime, timedelta, timezone
-from bson import ObjectId
+from bisect import bisect_left, bisect_right
+from services.revenue_ledger_service import RevenueLedgerService
+from services.metric_results_service import MetricResultsService
+from services.analytics_snapshot import SubscriptionSnapshot
+from utils.cache import TTLCache, cached_result, subscriptions_data_version
+from config import Config
+
+GRANULARITIES = ("day", "week", "month")
+
+def _next_period_start(period_start, granularity):
+    if granularity == "day":
+        return period_start + timedelta(days=1)
+    if granularity == "week":
+        return period_start + timedelta(weeks=1)
+    if period_start.month == 12:
+        return period_start.replace(year=period_start.year + 1, month=1)
+    return period_start.replace(month=period_start.month + 1)
+
+def build_periods(start_date, end_date, granularity):
+    """
+    Divide [start_date, end_date] en periodos consecutivos alineados al día, la semana (lunes) o el mes.
+    Retorna una lista de tuplas (inicio, fin) con fin inclusivo, igual que las rutas de métricas.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Granularity must be one of: {', '.join(GRANULARITIES)}")
+
+    aligned = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "week":
+        aligned -= timedelta(days=aligned.weekday())
+    elif granularity == "month":
+        aligned = aligned.replace(day=1)
+
+    periods = []
+    period_start = aligned
+    while period_start <= end_date:
+        next_start = _next_period_start(period_start, granularity)
+        periods.append((max(period_start, start_date), min(next_start - timedelta(seconds=1), end_date)))
+        period_start = next_start
+    return periods
+
+def _merge_intervals(intervals):
+    """
+    Une intervalos [inicio, expiración) ordenados por inicio que se solapan o se tocan.
+    """
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+def _is_active_at(merged_starts, merged, moment):
+    index = bisect_right(merged_starts, moment) - 1
+    return index >= 0 and merged[index][1] > moment
 
 class MetricsService:
+    # Métrica del resumen -> faceta de la agregación que la resuelve ("ledger": revenue_ledger, sin agregación).
+    SUMMARY_FIELDS = {
+        "mrr": "ledger",
+        "arr": "ledger",
+        "arpu": "ledger",
+        "aov": "orders",
+        "rpr": "customers",
+        "purchase_frequency": "customers"
+    }
+
     def __init__(self, db):
         self.db = db
         self.customers_collection = self.db.customers
         self.subscriptions_collection = self.db.subscriptions
+        self.revenue_ledger = RevenueLedgerService(db)
+        self.metric_results = MetricResultsService(db)
+        self.snapshot = None
+        if Config.METRICS_BACKEND == "snapshot":
+            self.snapshot = SubscriptionSnapshot(Config.ANALYTICS_SNAPSHOT_PATH)
+        self.cache = None
+        if Config.METRICS_CACHE_TTL_SECONDS > 0:
+            self.cache = TTLCache(Config.METRICS_CACHE_MAX_ENTRIES, Config.METRICS_CACHE_TTL_SECONDS)
+
+    def _use_snapshot(self):
+        """
+        Indica si las métricas deben responderse desde la instantánea columnar (METRICS_BACKEND=snapshot).
+        Si la instantánea aún no se ha generado, se consulta MongoDB.
+        """
+        return self.snapshot is not None and self.snapshot.is_available()
 
-    def get_active_subscriptions_in_period(self, start_date, end_date):
+    def get_active_subscriptions_in_period(self, start_date, end_date, projection=None, batch_size=1000, after_id=None, limit=None):
         """
-        Obtiene suscripciones activas en un periodo dado.
+        Genera las suscripciones activas en un periodo dado sin cargarlas todas en memoria.
+        La consulta se resuelve con el índice (start_date, expiration_date).
+        Paginación por clave sobre (start_date, _id), servida por el índice active_period_keyset:
+        con limit o after_id los resultados se ordenan por esa clave y la siguiente página se pide
+        con after_id igual al último _id recibido, así cada página continúa donde acabó la anterior.
         """
-        return list(self.subscriptions_collection.find({
+        query = {
             "start_date": {"$lte": end_date},
             "expiration_date": {"$gt": start_date}
-        }))
+        }
+        options = {"batch_size": batch_size}
+        if after_id is not None:
+            last = self.subscriptions_collection.find_one({"_id": after_id}, {"start_date": 1})
+            if last is None:
+                return
+            query["start_date"]["$gte"] = last["start_date"]
+            query["$or"] = [{"start_date": {"$gt": last["start_date"]}}, {"_id": {"$gt": after_id}}]
+        if limit or after_id is not None:
+            options["sort"] = [("start_date", 1), ("_id", 1)]
+        if limit:
+            options["limit"] = limit
 
-    def calculate_mrr(self):
+        cursor = self.subscriptions_collection.find(query, projection, **options)
+        try:
+            for subscription in cursor:
+                yield subscription
+        finally:
+            close = getattr(cursor, "close", None)
+            if close:
+                close()
+
+    def calculate_mrr(self, as_of=None):
         """
-        Calcula el Ingreso Recurrente Mensual (MRR) actual.
+        Calcula el Ingreso Recurrente Mensual (MRR).
+        Sin as_of se lee del revenue_ledger, mantenido incrementalmente por las escrituras de suscripciones.
+        Con as_of se agrega sobre las suscripciones activas en esa fecha.
         """
-        mrr = 0.0
-        active_subscriptions = self.subscriptions_collection.find({
-            "expiration_date": {"$gt": datetime.utcnow()}
-        })
+        if self._use_snapshot():
+            return self.snapshot.mrr(as_of or datetime.utcnow())
+
+        if as_of is None:
+            totals = self.revenue_ledger.get_totals()
+            return round(totals["mrr"], 2)
 
-        for sub in active_subscriptions:
-            price = sub.get("price_at_subscription")
-            periodicity = sub.get("periodicity_at_subscription")
+        pipeline = [
+            {"$match": {"start_date": {"$lte": as_of}, "expiration_date": {"$gt": as_of}}},
+            {"$group": {"_id": None, "mrr": {"$sum": "$monthly_amount"}}}
+        ]
+        result = list(self.subscriptions_collection.aggregate(pipeline))
+        if not result:
+            return 0.0
+        return round(result[0]["mrr"], 2)
 
-            if price is None or periodicity is None:
-                continue 
+    @cached_result(subscriptions_data_version)
+    def calculate_mrr_series(self, start_date, end_date, granularity="month"):
+        """
+        Calcula MRR y ARR al cierre de cada periodo entre start_date y end_date.
+        Cada suscripción aporta dos eventos (+monthly_amount en start_date, -monthly_amount en
+        expiration_date); se ordenan una vez y se recorren junto a los cierres de periodo: O(n log n).
+        """
+        periods = build_periods(start_date, end_date, granularity)
+        if not periods:
+            return []
 
-            if periodicity == "monthly":
-                mrr += price
-            elif periodicity == "annually":
-                mrr += (price / 12.0)
-        return round(mrr, 2)
+        subscriptions = self.subscriptions_collection.find(
+            {"start_date": {"$lte": end_date}, "expiration_date": {"$gt": periods[0][1]}},
+            {"_id": 0, "start_date": 1, "expiration_date": 1, "monthly_amount": 1},
+            batch_size=5000
+        )
+        events = []
+        for sub in subscriptions:
+            amount = sub.get("monthly_amount")
+            if not amount:
+                continue
+            events.append((sub["start_date"], amount))
+            events.append((sub["expiration_date"], -amount))
+        events.sort(key=lambda event: event[0])
 
+        series = []
+        mrr = 0.0
+        index = 0
+        for period_start, period_end in periods:
+            # Activa en t si start_date <= t < expiration_date: se aplican todos los eventos con fecha <= t.
+            while index < len(events) and events[index][0] <= period_end:
+                mrr += events[index][1]
+                index += 1
+            rounded_mrr = round(mrr, 2) or 0.0
+            series.append({
+                "period_start": period_start,
+                "period_end": period_end,
+                "mrr": rounded_mrr,
+                "arr": round(rounded_mrr * 12.0, 2)
+            })
+        return series
+
+    @cached_result(subscriptions_data_version)
     def calculate_arr(self):
         """
         Calcula el Ingreso Recurrente Anual (ARR) actual.
@@ -48,28 +195,51 @@ class MetricsService:
         arr = mrr * 12.0
         return round(arr, 2)
 
+    @cached_result(subscriptions_data_version)
     def calculate_arpu(self):
         """
-        Calcula el Ingreso Medio por Usuario (ARPU) actual.
+        Calcula el Ingreso Medio por Usuario (ARPU) actual a partir del revenue_ledger.
         """
-        mrr = self.calculate_mrr()
-        
-        active_customer_ids = self.subscriptions_collection.distinct(
-            "customer_id",
-            {"expiration_date": {"$gt": datetime.utcnow()}}
-        )
-        num_active_customers = len(active_customer_ids)
+        if self._use_snapshot():
+            return self.snapshot.arpu(datetime.utcnow())
+
+        totals = self.revenue_ledger.get_totals()
+        num_active_customers = totals["active_customers"]
 
-        if num_active_customers == 0:
+        if num_active_customers <= 0:
             return 0.0
         
-        arpu = mrr / num_active_customers
+        arpu = totals["mrr"] / num_active_customers
         return round(arpu, 2)
 
+    def _stored_period_metric(self, metric, start_date, end_date, compute):
+        """
+        Resuelve una métrica de periodo desde metric_results si el periodo ya está cerrado;
+        si no está guardada, la calcula y la guarda.
+        """
+        if not self.metric_results.is_closed(end_date):
+            return compute(start_date, end_date)
+
+        stored = self.metric_results.get(metric, start_date, end_date)
+        if stored is not None:
+            return stored
+        value = compute(start_date, end_date)
+        self.metric_results.save(metric, start_date, end_date, value)
+        return value
+
+    @cached_result(subscriptions_data_version)
     def calculate_customer_retention_rate(self, start_date, end_date):
         """
         Calcula la Tasa de Retención de Clientes (CRR) para un período dado.
+        Los periodos cerrados se guardan en metric_results.
         """
+        if self._use_snapshot():
+            return self.snapshot.customer_retention_rate(start_date, end_date)
+        return self._stored_period_metric(
+            "customer_retention_rate", start_date, end_date, self._compute_customer_retention_rate
+        )
+
+    def _compute_customer_retention_rate(self, start_date, end_date):
         customers_at_start_period = self.subscriptions_collection.distinct(
             "customer_id",
             {"start_date": {"$lte": start_date}, "expiration_date": {"$gt": start_date}}
@@ -105,10 +275,17 @@ class MetricsService:
         return round(crr, 2)
 
 
+    @cached_result(subscriptions_data_version)
     def calculate_churn_rate(self, start_date, end_date):
         """
         Calcula la Tasa de Abandono (Churn Rate - CR) para un período dado.
+        Los periodos cerrados se guardan en metric_results.
         """
+        if self._use_snapshot():
+            return self.snapshot.churn_rate(start_date, end_date)
+        return self._stored_period_metric("churn_rate", start_date, end_date, self._compute_churn_rate)
+
+    def _compute_churn_rate(self, start_date, end_date):
         customers_at_start_period = self.subscriptions_collection.distinct(
             "customer_id",
             {"start_date": {"$lte": start_date}, "expiration_date": {"$gt": start_date}}
@@ -133,6 +310,102 @@ class MetricsService:
         churn_rate = (num_lost_customers / num_customers_at_start) * 100
         return round(churn_rate, 2)
 
+    @cached_result(subscriptions_data_version)
+    def calculate_retention_series(self, start_date, end_date, granularity="month"):
+        """
+        Calcula CRR y Churn Rate para cada periodo consecutivo entre start_date y end_date
+        con un único recorrido de las suscripciones ordenadas por cliente.
+        Los intervalos activos de cada cliente se fusionan y cada uno se sitúa entre los periodos
+        por bisección: O((intervalos + altas) * log P) por cliente en vez de O(P).
+        """
+        periods = build_periods(start_date, end_date, granularity)
+        if not periods:
+            return []
+        period_starts = [period[0] for period in periods]
+        period_ends = [period[1] for period in periods]
+        # Arrays de diferencias: cada intervalo activo suma en un rango de periodos en O(log P).
+        active_start_diff = [0] * (len(periods) + 1)
+        active_end_diff = [0] * (len(periods) + 1)
+        active_both_diff = [0] * (len(periods) + 1)
+        active_both = [0] * len(periods)
+        new_and_active_end = [0] * len(periods)
+
+        subscriptions = self.subscriptions_collection.find(
+            {"start_date": {"$lte": end_date}, "expiration_date": {"$gt": periods[0][0]}},
+            {"_id": 0, "customer_id": 1, "start_date": 1, "expiration_date": 1},
+            sort=[("customer_id", 1), ("start_date", 1)],
+            batch_size=5000,
+            allow_disk_use=True
+        )
+
+        def add_range(diff, low, high):
+            if low < high:
+                diff[low] += 1
+                diff[high] -= 1
+
+        def accumulate(intervals):
+            merged = _merge_intervals(intervals)
+            merged_starts = [interval[0] for interval in merged]
+            for position, (start, expiration) in enumerate(merged):
+                # Activo al inicio / al cierre de los periodos cuyo inicio / cierre cae en [start, expiration).
+                first_start = bisect_left(period_starts, start)
+                add_range(active_start_diff, first_start, bisect_left(period_starts, expiration))
+                add_range(active_end_diff, bisect_left(period_ends, start), bisect_left(period_ends, expiration))
+                # Inicio y cierre dentro de este mismo intervalo.
+                add_range(active_both_diff, first_start, bisect_left(period_ends, expiration))
+                # Inicio en este intervalo y cierre en uno posterior: solo el periodo que contiene el hueco.
+                if position + 1 < len(merged):
+                    index = bisect_left(period_starts, expiration) - 1
+                    if (index >= 0 and period_starts[index] >= start and period_ends[index] >= expiration
+                            and _is_active_at(merged_starts, merged, period_ends[index])):
+                        active_both[index] += 1
+            # Periodos con alguna alta del cliente y activo al cierre (no cuentan como retenidos).
+            new_periods = set()
+            for start, _ in intervals:
+                index = bisect_right(period_starts, start) - 1
+                if index >= 0 and start <= period_ends[index]:
+                    new_periods.add(index)
+            for index in new_periods:
+                if _is_active_at(merged_starts, merged, period_ends[index]):
+                    new_and_active_end[index] += 1
+
+        current_customer = None
+        intervals = []
+        for sub in subscriptions:
+            if sub["customer_id"] != current_customer:
+                if intervals:
+                    accumulate(intervals)
+                current_customer = sub["customer_id"]
+                intervals = []
+            intervals.append((sub["start_date"], sub["expiration_date"]))
+        if intervals:
+            accumulate(intervals)
+
+        counters = []
+        at_start = at_end = both = 0
+        for index in range(len(periods)):
+            at_start += active_start_diff[index]
+            at_end += active_end_diff[index]
+            both += active_both_diff[index]
+            counters.append({
+                "at_start": at_start,
+                "lost": at_start - both - active_both[index],
+                "retained": at_end - new_and_active_end[index]
+            })
+
+        series = []
+        for counter, (period_start, period_end) in zip(counters, periods):
+            at_start = counter["at_start"]
+            series.append({
+                "period_start": period_start,
+                "period_end": period_end,
+                "customers_at_start": at_start,
+                "customer_retention_rate": round(counter["retained"] / at_start * 100, 2) if at_start else 0.0,
+                "churn_rate": round(counter["lost"] / at_start * 100, 2) if at_start else 0.0
+            })
+        return series
+
+    @cached_result(subscriptions_data_version)
     def calculate_aov(self):
         """
         Calcula el Valor Promedio del Pedido (AOV).
@@ -153,50 +426,176 @@ class MetricsService:
             return round(aov, 2)
         return 0.0
 
+    def count_distinct_customers(self, query=None, approximate=None):
+        """
+        Cuenta los clientes distintos con suscripciones que cumplen query sin traer la lista de IDs.
+        En modo exacto usa $group/$count en el servidor. En modo aproximado y sin query lee el
+        sketch HyperLogLog que el revenue_ledger mantiene en cada alta (O(1), error relativo
+        METRICS_HLL_ERROR_RATE); con query, o si el sketch no existe, se cuenta de forma exacta.
+        """
+        if approximate is None:
+            approximate = Config.METRICS_APPROXIMATE_COUNTS
+
+        if approximate and not query:
+            estimate = self.revenue_ledger.estimate_customers()
+            if estimate is not None:
+                return estimate
+
+        pipeline = [
+            {"$match": query or {}},
+            {"$group": {"_id": "$customer_id"}},
+            {"$count": "customers"}
+        ]
+        result = list(self.subscriptions_collection.aggregate(pipeline, allowDiskUse=True))
+        return result[0]["customers"] if result else 0
+
+    @cached_result(subscriptions_data_version)
     def calculate_rpr(self):
         """
         Calcula la Tasa de Compra Repetida (RPR).
+        Clientes totales y con más de una suscripción se cuentan en una sola agregación.
         """
+        if self._use_snapshot():
+            return self.snapshot.rpr()
+
         pipeline = [
             {"$group": {
                 "_id": "$customer_id", 
                 "subscription_count": {"$sum": 1} 
             }},
-            {"$match": {
-                "subscription_count": {"$gt": 1} 
-            }},
-            {"$count": "repeat_customers"}
+            {"$group": {
+                "_id": None,
+                "total_customers": {"$sum": 1},
+                "repeat_customers": {"$sum": {"$cond": [{"$gt": ["$subscription_count", 1]}, 1, 0]}}
+            }}
         ]
-        repeat_customers_result = list(self.subscriptions_collection.aggregate(pipeline))
-        num_repeat_customers = repeat_customers_result[0]["repeat_customers"] if repeat_customers_result else 0
-
-        total_customers_with_subscriptions = self.subscriptions_collection.distinct("customer_id")
-        num_total_customers = len(total_customers_with_subscriptions)
-
-        if num_total_customers == 0:
+        result = list(self.subscriptions_collection.aggregate(pipeline, allowDiskUse=True))
+        if not result or result[0]["total_customers"] == 0:
             return 0.0
         
-        rpr = (num_repeat_customers / num_total_customers) * 100
+        rpr = (result[0]["repeat_customers"] / result[0]["total_customers"]) * 100
         return round(rpr, 2)
     
-    def calculate_purchase_frequency(self):
+    @cached_result(subscriptions_data_version)
+    def calculate_purchase_frequency(self, approximate=None):
         """
         Calcula la frecuencia de compra promedio (suscripciones por cliente).
+        Con approximate=True ambos totales se leen en O(1): suscripciones con estimated_document_count
+        y clientes con el sketch HyperLogLog del revenue_ledger.
         """
-        total_subscriptions_pipeline = [
-            {"$group": {
-                "_id": None,
-                "count": {"$sum": 1}
-            }}
-        ]
-        total_subscriptions_result = list(self.subscriptions_collection.aggregate(total_subscriptions_pipeline))
-        num_total_subscriptions = total_subscriptions_result[0]["count"] if total_subscriptions_result else 0
+        if approximate is None:
+            approximate = Config.METRICS_APPROXIMATE_COUNTS
 
-        total_customers_with_subscriptions = self.subscriptions_collection.distinct("customer_id")
-        num_total_customers = len(total_customers_with_subscriptions)
+        if approximate:
+            num_total_subscriptions = self.subscriptions_collection.estimated_document_count()
+            num_total_customers = self.count_distinct_customers(approximate=True)
+        else:
+            pipeline = [
+                {"$group": {"_id": "$customer_id", "subscription_count": {"$sum": 1}}},
+                {"$group": {
+                    "_id": None,
+                    "total_customers": {"$sum": 1},
+                    "total_subscriptions": {"$sum": "$subscription_count"}
+                }}
+            ]
+            result = list(self.subscriptions_collection.aggregate(pipeline, allowDiskUse=True))
+            num_total_customers = result[0]["total_customers"] if result else 0
+            num_total_subscriptions = result[0]["total_subscriptions"] if result else 0
 
         if num_total_customers == 0:
             return 0.0
         
         purchase_frequency = num_total_subscriptions / num_total_customers
-        return round(purchase_frequency, 2)
\ No newline at end of file
+        return round(purchase_frequency, 2)
+
+    @cached_result(subscriptions_data_version)
+    def calculate_summary(self, fields=None):
+        """
+        Calcula las métricas puntuales (MRR, ARR, ARPU, AOV, RPR y frecuencia de compra).
+        MRR, ARR y ARPU salen del revenue_ledger, igual que /metrics/mrr, /arr y /arpu; el resto
+        con una única agregación $facet. Si se indica fields, solo se ejecutan las facetas necesarias.
+        """
+        fields = list(self.SUMMARY_FIELDS) if not fields else [f for f in fields if f in self.SUMMARY_FIELDS]
+        if not fields:
+            return {}
+
+        facets = {
+            "orders": [
+                {"$match": {"price_at_subscription": {"$exists": True, "$ne": None}}},
+                {"$group": {
+                    "_id": None,
+                    "total_revenue": {"$sum": "$price_at_subscription"},
+                    "total_subscriptions": {"$sum": 1}
+                }}
+            ],
+            "customers": [
+                {"$group": {"_id": "$customer_id", "subscription_count": {"$sum": 1}}},
+                {"$group": {
+                    "_id": None,
+                    "total_customers": {"$sum": 1},
+                    "repeat_customers": {"$sum": {"$cond": [{"$gt": ["$subscription_count", 1]}, 1, 0]}},
+                    "total_subscriptions": {"$sum": "$subscription_count"}
+                }}
+            ]
+        }
+        needed = {self.SUMMARY_FIELDS[field] for field in fields}
+        facet_results = {}
+        if needed - {"ledger"}:
+            pipeline = [{"$facet": {name: stages for name, stages in facets.items() if name in needed}}]
+            result = list(self.subscriptions_collection.aggregate(pipeline, allowDiskUse=True))
+            facet_results = result[0] if result else {}
+
+        def first(name):
+            docs = facet_results.get(name) or []
+            return docs[0] if docs else {}
+
+        orders = first("orders")
+        customers = first("customers")
+
+        totals = self.revenue_ledger.get_totals() if "ledger" in needed else {}
+        mrr = round(totals.get("mrr", 0.0), 2)
+        active_customers = totals.get("active_customers", 0)
+        total_customers = customers.get("total_customers", 0)
+        total_orders = orders.get("total_subscriptions", 0)
+
+        values = {
+            "mrr": mrr,
+            "arr": round(mrr * 12.0, 2),
+            "arpu": round(mrr / active_customers, 2) if active_customers else 0.0,
+            "aov": round(orders.get("total_revenue", 0.0) / total_orders, 2) if total_orders else 0.0,
+            "rpr": round(customers.get("repeat_customers", 0) / total_customers * 100, 2) if total_customers else 0.0,
+            "purchase_frequency": round(customers.get("total_subscriptions", 0) / total_customers, 2) if total_customers else 0.0
+        }
+        return {field: values[field] for field in fields}
+
+    def cache_stats(self):
+        """
+        Retorna los contadores de la caché de resultados (None si está desactivada).
+        """
+        return self.cache.stats() if self.cache else None
+
+    def refresh_snapshot(self, path=None):
+        """
+        Genera o actualiza incrementalmente la instantánea columnar de subscriptions.
+        """
+        snapshot = self.snapshot or SubscriptionSnapshot(path or Config.ANALYTICS_SNAPSHOT_PATH)
+        return snapshot.refresh(self.subscriptions_collection)
+
+    def backfill_monthly_amount(self):
+        """
+        Migración: calcula monthly_amount en las suscripciones que aún no lo tienen.
+        Se ejecuta en el servidor con un update por pipeline; retorna el número de documentos modificados.
+        """
+        result = self.subscriptions_collection.update_many(
+            {"monthly_amount": {"$exists": False}},
+            [{"$set": {"monthly_amount": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$periodicity_at_subscription", "monthly"]},
+                     "then": "$price_at_subscription"},
+                    {"case": {"$eq": ["$periodicity_at_subscription", "annually"]},
+                     "then": {"$divide": ["$price_at_subscription", 12.0]}}
+                ],
+                "default": None
+            }}}}]
+        )
+        return result.modified_count
\ No newline at end of file
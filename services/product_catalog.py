@@ -0,0 +1,93 @@
+import threading
+import time
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument
+from config import Config
+
+VERSION_ID = "products"
+
+class ProductCatalog:
+    """
+    Catálogo de productos en memoria, indexado por _id y por name.
+    La colección products es pequeña y casi nunca cambia, así que se carga entera y las
+    búsquedas nunca consultan MongoDB. Cada escritura en products incrementa un sello de
+    versión ({"_id": "products", "version": int} en catalog_versions); los workers comprueban
+    ese sello como mucho cada PRODUCT_CATALOG_STALENESS_SECONDS y recargan si ha cambiado.
+    """
+    def __init__(self, db, staleness_seconds=None):
+        self.db = db
+        self.products_collection = self.db.products
+        self.versions_collection = self.db.catalog_versions
+        self.staleness_seconds = (
+            Config.PRODUCT_CATALOG_STALENESS_SECONDS if staleness_seconds is None else staleness_seconds
+        )
+        self._by_id = {}
+        self._by_name = {}
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        stamp = self.versions_collection.find_one({"_id": VERSION_ID}, {"version": 1})
+        return stamp["version"] if stamp else 0
+
+    def _load(self, version):
+        products = list(self.products_collection.find({}))
+        # Se sustituyen los diccionarios completos: los lectores nunca ven un catálogo a medias.
+        self._by_id = {product["_id"]: product for product in products}
+        self._by_name = {product["name"]: product for product in products if "name" in product}
+        self._version = version
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.staleness_seconds:
+            return
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.staleness_seconds:
+                return
+            version = self._current_version()
+            if version != self._version:
+                self._load(version)
+            self._checked_at = time.monotonic()
+
+    def get(self, product_id):
+        """
+        Retorna el producto con ese _id (ObjectId o str) o None.
+        """
+        if not isinstance(product_id, ObjectId):
+            if not ObjectId.is_valid(product_id):
+                return None
+            product_id = ObjectId(product_id)
+        self._ensure_fresh()
+        return self._by_id.get(product_id)
+
+    def get_by_name(self, name):
+        self._ensure_fresh()
+        return self._by_name.get(name)
+
+    def all(self):
+        self._ensure_fresh()
+        return list(self._by_id.values())
+
+    def bump_version(self):
+        """
+        Debe llamarse tras cualquier escritura en products: publica una versión nueva para
+        todos los workers y recarga este catálogo de inmediato.
+        """
+        stamp = self.versions_collection.find_one_and_update(
+            {"_id": VERSION_ID},
+            {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        with self._lock:
+            self._load(stamp["version"] if stamp else None)
+            self._checked_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "products": len(self._by_id),
+            "version": self._version,
+            "staleness_seconds": self.staleness_seconds
+        }
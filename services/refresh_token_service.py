@@ -0,0 +1,69 @@
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+from bson import ObjectId
+from config import Config
+
+class RefreshTokenService:
+    """
+    Refresh tokens rotatorios guardados en la colección refresh_tokens.
+    Solo se guarda el SHA-256 del token como _id, así la renovación es una única búsqueda por _id:
+      {"_id": <sha256>, "family_id": ObjectId, "customer_id": ObjectId, "email": str,
+       "expires_at": datetime, "used_at": datetime | None}
+    Cada renovación marca el token como usado y emite otro de la misma familia; presentar
+    un token ya usado se trata como robo y revoca la familia entera.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.refresh_tokens_collection = self.db.refresh_tokens
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def issue(self, customer_id, email, family_id=None, now=None):
+        """
+        Emite un refresh token nuevo (en una familia nueva si no se indica) y retorna el token en claro.
+        """
+        now = now or datetime.utcnow()
+        token = secrets.token_urlsafe(32)
+        self.refresh_tokens_collection.insert_one({
+            "_id": self._digest(token),
+            "family_id": family_id or ObjectId(),
+            "customer_id": ObjectId(customer_id),
+            "email": email,
+            "expires_at": now + timedelta(seconds=Config.JWT_REFRESH_TOKEN_EXPIRES_SECONDS),
+            "used_at": None
+        })
+        return token
+
+    def rotate(self, token, now=None):
+        """
+        Consume un refresh token y emite su sucesor.
+        Retorna ({"customer_id", "email", "refresh_token"}, error).
+        """
+        now = now or datetime.utcnow()
+        digest = self._digest(token)
+        current = self.refresh_tokens_collection.find_one_and_update(
+            {"_id": digest, "used_at": None, "expires_at": {"$gt": now}},
+            {"$set": {"used_at": now}},
+            {"family_id": 1, "customer_id": 1, "email": 1}
+        )
+        if current is None:
+            reused = self.refresh_tokens_collection.find_one(
+                {"_id": digest, "used_at": {"$ne": None}}, {"family_id": 1}
+            )
+            if reused:
+                self.revoke_family(reused["family_id"])
+                return None, "Refresh token reuse detected"
+            return None, "Invalid or expired refresh token"
+
+        customer_id = str(current["customer_id"])
+        new_token = self.issue(customer_id, current["email"], family_id=current["family_id"], now=now)
+        return {"customer_id": customer_id, "email": current["email"], "refresh_token": new_token}, None
+
+    def revoke_family(self, family_id):
+        return self.refresh_tokens_collection.delete_many({"family_id": family_id}).deleted_count
+
+    def revoke_customer(self, customer_id):
+        return self.refresh_tokens_collection.delete_many({"customer_id": ObjectId(customer_id)}).deleted_count
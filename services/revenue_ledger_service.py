@@ -0,0 +1,232 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from config import Config
+from utils.hyperloglog import HyperLogLog
+
+TOTALS_ID = "totals"
+CUSTOMER_SKETCH_ID = "customer_hll"
+
+def _sketch_value(customer_id):
+    return customer_id.binary if isinstance(customer_id, ObjectId) else customer_id
+
+class RevenueLedgerService:
+    """
+    Mantiene el MRR actual de forma incremental en la colección revenue_ledger.
+    Documentos:
+      {"_id": "totals", "mrr": float, "active_subscriptions": int, "active_customers": int}
+      {"_id": <customer_id>, "active_subscriptions": int}
+      {"_id": "customer_hll", "precision": int, "registers": {"<índice>": rango}}
+    Cada suscripción contada en el ledger lleva in_ledger=True. customer_hll son los registros
+    HyperLogLog de todos los clientes que alguna vez se suscribieron, actualizados con $max.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.ledger_collection = self.db.revenue_ledger
+        self.subscriptions_collection = self.db.subscriptions
+
+    def get_totals(self):
+        """
+        Retorna los totales del ledger con una sola lectura por _id.
+        """
+        totals = self.ledger_collection.find_one({"_id": TOTALS_ID}) or {}
+        return {
+            "mrr": totals.get("mrr", 0.0),
+            "active_subscriptions": totals.get("active_subscriptions", 0),
+            "active_customers": totals.get("active_customers", 0)
+        }
+
+    def add_subscription(self, customer_id, monthly_amount):
+        """
+        Suma una suscripción activa al ledger.
+        """
+        previous = self.ledger_collection.find_one_and_update(
+            {"_id": customer_id},
+            {"$inc": {"active_subscriptions": 1}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        new_customer = 1 if not previous or previous.get("active_subscriptions", 0) <= 0 else 0
+        self.ledger_collection.bulk_write([
+            UpdateOne(
+                {"_id": TOTALS_ID},
+                {"$inc": {
+                    "mrr": monthly_amount or 0.0,
+                    "active_subscriptions": 1,
+                    "active_customers": new_customer
+                }},
+                upsert=True
+            ),
+            self._sketch_update([customer_id])
+        ], ordered=False)
+
+    def add_subscriptions(self, subscriptions):
+        """
+        Suma al ledger varias suscripciones activas [(customer_id, monthly_amount), ...] con un
+        bulk_write por cliente y un único $inc de los totales.
+        Un cliente es nuevo si su documento se crea en el upsert (remove_subscription lo borra al llegar a 0).
+        """
+        per_customer = {}
+        mrr = 0.0
+        for customer_id, monthly_amount in subscriptions:
+            per_customer[customer_id] = per_customer.get(customer_id, 0) + 1
+            mrr += monthly_amount or 0.0
+        if not per_customer:
+            return
+
+        result = self.ledger_collection.bulk_write([
+            UpdateOne({"_id": customer_id}, {"$inc": {"active_subscriptions": count}}, upsert=True)
+            for customer_id, count in per_customer.items()
+        ] + [self._sketch_update(per_customer)], ordered=False)
+        self.ledger_collection.update_one(
+            {"_id": TOTALS_ID},
+            {"$inc": {
+                "mrr": mrr,
+                "active_subscriptions": sum(per_customer.values()),
+                "active_customers": sum(1 for index in result.upserted_ids if index < len(per_customer))
+            }},
+            upsert=True
+        )
+
+    @staticmethod
+    def _sketch_update(customer_ids):
+        """
+        $max sobre los registros HyperLogLog de customer_ids. Una vez calentado el sketch casi todos
+        los $max son no-ops que MongoDB no llega a escribir.
+        """
+        sketch = HyperLogLog(Config.METRICS_HLL_ERROR_RATE)
+        maxima = {}
+        for customer_id in customer_ids:
+            index, rank = sketch.position(_sketch_value(customer_id))
+            field = f"registers.{index}"
+            maxima[field] = max(maxima.get(field, 0), rank)
+        return UpdateOne(
+            {"_id": CUSTOMER_SKETCH_ID},
+            {"$max": maxima, "$setOnInsert": {"precision": sketch.precision}},
+            upsert=True
+        )
+
+    def estimate_customers(self):
+        """
+        Estima los clientes distintos que alguna vez se suscribieron leyendo el sketch guardado: O(1).
+        Retorna None si el sketch aún no existe (flask ledger reconcile lo construye).
+        """
+        sketch = self.ledger_collection.find_one({"_id": CUSTOMER_SKETCH_ID})
+        if not sketch:
+            return None
+        return HyperLogLog.from_registers(sketch["precision"], sketch.get("registers", {})).count()
+
+    def remove_subscription(self, customer_id, monthly_amount):
+        """
+        Resta una suscripción que ha dejado de estar activa.
+        """
+        current = self.ledger_collection.find_one_and_update(
+            {"_id": customer_id},
+            {"$inc": {"active_subscriptions": -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        lost_customer = 1 if current and current.get("active_subscriptions", 0) <= 0 else 0
+        if lost_customer:
+            self.ledger_collection.delete_one({"_id": customer_id, "active_subscriptions": {"$lte": 0}})
+        self.ledger_collection.update_one(
+            {"_id": TOTALS_ID},
+            {"$inc": {
+                "mrr": -(monthly_amount or 0.0),
+                "active_subscriptions": -1,
+                "active_customers": -lost_customer
+            }},
+            upsert=True
+        )
+
+    def sweep_expired(self, now=None):
+        """
+        Resta del ledger las suscripciones que ya pasaron su expiration_date.
+        Pensado para ejecutarse periódicamente (flask ledger sweep). Retorna cuántas se restaron.
+        """
+        now = now or datetime.utcnow()
+        expired = self.subscriptions_collection.find(
+            {"in_ledger": True, "expiration_date": {"$lte": now}},
+            {"customer_id": 1, "monthly_amount": 1}
+        )
+        swept = 0
+        for subscription in expired:
+            # La condición sobre in_ledger evita restar dos veces si hay barridos concurrentes.
+            result = self.subscriptions_collection.update_one(
+                {"_id": subscription["_id"], "in_ledger": True, "expiration_date": {"$lte": now}},
+                {"$set": {"in_ledger": False}}
+            )
+            if result.modified_count == 1:
+                self.remove_subscription(subscription["customer_id"], subscription.get("monthly_amount"))
+                swept += 1
+        return swept
+
+    def reconcile(self, apply=True, now=None):
+        """
+        Recalcula el ledger desde subscriptions y reporta la deriva respecto a los totales guardados.
+        Con apply=True reescribe el ledger y las marcas in_ledger.
+        """
+        now = now or datetime.utcnow()
+        per_customer = list(self.subscriptions_collection.aggregate([
+            {"$match": {"expiration_date": {"$gt": now}}},
+            {"$group": {
+                "_id": "$customer_id",
+                "mrr": {"$sum": "$monthly_amount"},
+                "active_subscriptions": {"$sum": 1}
+            }}
+        ], allowDiskUse=True))
+
+        expected = {
+            "mrr": round(sum(doc["mrr"] or 0.0 for doc in per_customer), 2),
+            "active_subscriptions": sum(doc["active_subscriptions"] for doc in per_customer),
+            "active_customers": len(per_customer)
+        }
+        stored = self.get_totals()
+        drift = {
+            "mrr": round(stored["mrr"] - expected["mrr"], 2),
+            "active_subscriptions": stored["active_subscriptions"] - expected["active_subscriptions"],
+            "active_customers": stored["active_customers"] - expected["active_customers"]
+        }
+
+        if apply:
+            self.subscriptions_collection.update_many(
+                {"expiration_date": {"$gt": now}, "in_ledger": {"$ne": True}},
+                {"$set": {"in_ledger": True}}
+            )
+            self.subscriptions_collection.update_many(
+                {"expiration_date": {"$lte": now}, "in_ledger": {"$ne": False}},
+                {"$set": {"in_ledger": False}}
+            )
+            self.ledger_collection.delete_many({"_id": {"$nin": [TOTALS_ID, CUSTOMER_SKETCH_ID]}})
+            if per_customer:
+                self.ledger_collection.insert_many([
+                    {"_id": doc["_id"], "active_subscriptions": doc["active_subscriptions"]}
+                    for doc in per_customer
+                ])
+            self.ledger_collection.replace_one(
+                {"_id": TOTALS_ID},
+                {"_id": TOTALS_ID, **expected},
+                upsert=True
+            )
+            self._rebuild_sketch()
+
+        return {"expected": expected, "ledger": stored, "drift": drift}
+
+    def _rebuild_sketch(self):
+        """
+        Reconstruye customer_hll desde subscriptions (backfill o cambio de METRICS_HLL_ERROR_RATE).
+        """
+        sketch = HyperLogLog(Config.METRICS_HLL_ERROR_RATE)
+        customers = self.subscriptions_collection.aggregate(
+            [{"$group": {"_id": "$customer_id"}}], allowDiskUse=True, batchSize=10000
+        )
+        for customer in customers:
+            sketch.add(_sketch_value(customer["_id"]))
+        self.ledger_collection.replace_one(
+            {"_id": CUSTOMER_SKETCH_ID},
+            {
+                "_id": CUSTOMER_SKETCH_ID,
+                "precision": sketch.precision,
+                "registers": {str(index): rank for index, rank in enumerate(sketch.registers) if rank}
+            },
+            upsert=True
+        )
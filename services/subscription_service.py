@@ -2,8 +2,17 @@ from database import get_db
 from models.customer import customer_model
 from models.product import product_model
 from models.subscription import subscription_model
+from services.revenue_ledger_service import RevenueLedgerService
+from services.metric_results_service import MetricResultsService, as_naive_utc
+from services.product_catalog import ProductCatalog
+from utils.cache import subscriptions_data_version
+from utils.identity_map import load_one, forget
+from utils import settings_patch
+from config import Config
 from bson import ObjectId
 from datetime import datetime
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 
 class SubscriptionService:
     def __init__(self, db):
@@ -11,23 +20,35 @@ class SubscriptionService:
         self.customers_collection = self.db.customers
         self.products_collection = self.db.products
         self.subscriptions_collection = self.db.subscriptions
+        self.revenue_ledger = RevenueLedgerService(db)
+        self.metric_results = MetricResultsService(db)
+        self.product_catalog = ProductCatalog(db)
 
     def add_product(self, name, description, customizable, price, periodicity):
-        if self.products_collection.find_one({"name": name}):
-            return None, "Product with this name already exists"
-        
+        """
+        Crea un producto con una sola escritura; el índice único product_name rechaza los nombres repetidos.
+        Después publica una nueva versión del catálogo de productos.
+        """
         if not isinstance(price, (int, float)) or price <= 0:
             return None, "Price must be a positive number"
         if periodicity not in ["monthly", "annually"]: 
             return None, "Periodicity must be 'monthly' or 'annually'"
 
         product_data = product_model(name, description, customizable, price, periodicity)
-        result = self.products_collection.insert_one(product_data)
+        try:
+            result = self.products_collection.insert_one(product_data)
+        except DuplicateKeyError:
+            return None, "Product with this name already exists"
+        self.product_catalog.bump_version()
         return str(result.inserted_id), None
 
-    def subscribe_customer_to_product(self, customer_id_str, product_id_str, expiration_date_str, customization=None):
+    def subscribe_customer_to_product(self, customer_id_str, product_id_str, expiration_date_str, customization=None,
+                                      customer_verified=False):
         """
         Suscribe a un cliente a un producto
+        Con customer_verified=True (el cliente ya se validó en jwt_required) no se vuelve a leer customers.
+        El producto sale del catálogo en memoria y la regla de una suscripción activa por cliente y
+        producto se aplica en la propia escritura (upsert), así que el camino rápido es una sola operación.
         """
         try:
             customer_id = ObjectId(customer_id_str)
@@ -35,11 +56,36 @@ class SubscriptionService:
         except Exception:
             return None, "Invalid customer_id or product_id format"
 
-        customer = self.customers_collection.find_one({"_id": customer_id})
-        if not customer:
-            return None, "Customer not found"
+        if not customer_verified:
+            customer = self.customers_collection.find_one({"_id": customer_id}, {"_id": 1})
+            if not customer:
+                return None, "Customer not found"
+
+        subscription_data, error = self._new_subscription(customer_id, product_id, expiration_date_str, customization)
+        if error:
+            return None, error
 
-        product = self.products_collection.find_one({"_id": product_id})
+        # Solo inserta si no hay una suscripción activa (índice customer_product_expiration).
+        # customer_id y product_id se copian del filtro al documento insertado.
+        del subscription_data["customer_id"], subscription_data["product_id"]
+        result = self.subscriptions_collection.update_one(
+            {"customer_id": customer_id, "product_id": product_id, "expiration_date": {"$gt": datetime.utcnow()}},
+            {"$setOnInsert": subscription_data},
+            upsert=True
+        )
+        if result.upserted_id is None:
+            return None, "Customer already has an active subscription for this product"
+
+        self.revenue_ledger.add_subscription(customer_id, subscription_data["monthly_amount"])
+        subscriptions_data_version.bump()
+        return str(result.upserted_id), None
+
+    def _new_subscription(self, customer_id, product_id, expiration_date_str, customization):
+        """
+        Valida producto (catálogo en memoria), fecha y personalización y construye el documento.
+        No consulta MongoDB. Retorna (subscription_data, error).
+        """
+        product = self.product_catalog.get(product_id)
         if not product:
             return None, "Product not found"
 
@@ -49,17 +95,9 @@ class SubscriptionService:
                 expiration_date = expiration_date.replace(tzinfo=None)
             if expiration_date < datetime.utcnow():
                  return None, "Expiration date cannot be in the past"
-        except ValueError:
+        except (TypeError, ValueError):
             return None, "Invalid expiration date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)."
 
-        active_subscription = self.subscriptions_collection.find_one({
-            "customer_id": customer_id,
-            "product_id": product_id,
-            "expiration_date": {"$gt": datetime.utcnow()}
-        })
-        if active_subscription:
-            return None, "Customer already has an active subscription for this product"
-
         if product.get("customizable") and customization is None:
             return None, "Product is customizable, but no customization data provided"
         if not product.get("customizable") and customization is not None:
@@ -71,7 +109,6 @@ class SubscriptionService:
         if subscription_price is None or subscription_periodicity is None:
             return None, "Product is missing price or periodicity data." 
 
-
         subscription_data = subscription_model(
             customer_id=customer_id,
             product_id=product_id,
@@ -81,14 +118,114 @@ class SubscriptionService:
             periodicity_at_subscription=subscription_periodicity, 
             start_date=datetime.utcnow()
         )
-        result = self.subscriptions_collection.insert_one(subscription_data)
-        return str(result.inserted_id), None
+        subscription_data["in_ledger"] = True
+        return subscription_data, None
+
+    def subscribe_many(self, items, customer_id_str=None, customer_verified=False):
+        """
+        Suscripción en lote: items es una lista de {"customer_id", "product_id", "expiration_date", "customization"}.
+        Clientes y suscripciones activas se comprueban con una consulta $in cada uno para todo el lote,
+        los productos salen del catálogo y las altas van en un único insert_many(ordered=False).
+        Con customer_id_str solo se aceptan items de ese cliente (el resto son "forbidden") y, si además
+        customer_verified=True, no se vuelve a leer customers.
+        Retorna un resultado por item, en orden: {"index", "status": "created"|"duplicate"|"invalid"|
+        "not_found"|"forbidden", "subscription_id" o "error"}.
+        """
+        results = [None] * len(items)
+        pending = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = {"index": index, "status": "invalid", "error": "Each item must be an object"}
+                continue
+            customer_id_item = item.get("customer_id")
+            if customer_id_str is not None and customer_id_item != customer_id_str:
+                results[index] = {
+                    "index": index, "status": "forbidden", "error": "You can only subscribe on behalf of yourself."
+                }
+                continue
+            if not ObjectId.is_valid(customer_id_item) or not ObjectId.is_valid(item.get("product_id")):
+                results[index] = {"index": index, "status": "invalid", "error": "Invalid customer_id or product_id format"}
+                continue
+            subscription_data, error = self._new_subscription(
+                ObjectId(customer_id_item), ObjectId(item["product_id"]),
+                item.get("expiration_date"), item.get("customization")
+            )
+            if error:
+                status = "not_found" if "not found" in error else "invalid"
+                results[index] = {"index": index, "status": status, "error": error}
+                continue
+            pending.append((index, subscription_data))
+
+        customer_ids = {data["customer_id"] for _, data in pending}
+        if customer_verified and customer_id_str is not None:
+            known_customers = customer_ids
+        elif customer_ids:
+            known_customers = {
+                customer["_id"] for customer in
+                self.customers_collection.find({"_id": {"$in": list(customer_ids)}}, {"_id": 1})
+            }
+        else:
+            known_customers = set()
+
+        active = set()
+        if pending:
+            now = datetime.utcnow()
+            active = {
+                (subscription["customer_id"], subscription["product_id"])
+                for subscription in self.subscriptions_collection.find(
+                    {
+                        "customer_id": {"$in": list(customer_ids)},
+                        "product_id": {"$in": list({data["product_id"] for _, data in pending})},
+                        "expiration_date": {"$gt": now}
+                    },
+                    {"customer_id": 1, "product_id": 1}
+                )
+            }
+
+        to_insert = []
+        for index, subscription_data in pending:
+            key = (subscription_data["customer_id"], subscription_data["product_id"])
+            if subscription_data["customer_id"] not in known_customers:
+                results[index] = {"index": index, "status": "not_found", "error": "Customer not found"}
+            elif key in active:
+                results[index] = {
+                    "index": index, "status": "duplicate",
+                    "error": "Customer already has an active subscription for this product"
+                }
+            else:
+                # También evita dos altas del mismo cliente y producto dentro del lote.
+                active.add(key)
+                subscription_data["_id"] = ObjectId()
+                to_insert.append((index, subscription_data))
+
+        write_errors = {}
+        if to_insert:
+            try:
+                self.subscriptions_collection.insert_many([data for _, data in to_insert], ordered=False)
+            except BulkWriteError as error:
+                write_errors = {write_error["index"]: write_error for write_error in error.details["writeErrors"]}
+
+        created = []
+        for position, (index, subscription_data) in enumerate(to_insert):
+            write_error = write_errors.get(position)
+            if write_error is None:
+                created.append(subscription_data)
+                results[index] = {"index": index, "status": "created", "subscription_id": str(subscription_data["_id"])}
+            else:
+                results[index] = {"index": index, "status": "invalid", "error": write_error.get("errmsg", "Write error")}
+
+        if created:
+            self.revenue_ledger.add_subscriptions(
+                (data["customer_id"], data["monthly_amount"]) for data in created
+            )
+            subscriptions_data_version.bump()
+        return results
 
     def get_subscription_status(self, subscription_id_str):
         if not ObjectId.is_valid(subscription_id_str):
             return None, "Invalid subscription_id format."
 
-        subscription = self.subscriptions_collection.find_one({"_id": ObjectId(subscription_id_str)})
+        subscription = load_one(self.subscriptions_collection, "subscriptions", ObjectId(subscription_id_str))
         if not subscription:
             return None, "Subscription not found."
 
@@ -99,40 +236,167 @@ class SubscriptionService:
         if not ObjectId.is_valid(subscription_id_str):
             return None, "Invalid subscription_id format."
 
-        subscription = self.subscriptions_collection.find_one({"_id": ObjectId(subscription_id_str)})
+        subscription = load_one(self.subscriptions_collection, "subscriptions", ObjectId(subscription_id_str))
         if not subscription:
             return None, "Subscription not found."
         
-        product = self.products_collection.find_one({"_id": subscription["product_id"]})
+        product = self.product_catalog.get(subscription["product_id"])
         if not product or not product.get("customizable", False):
             return None, "Product associated with this subscription is not customizable."
 
         return subscription.get("customization", {}), None
 
-    def edit_subscription_settings(self, subscription_id_str, new_settings):
+    @staticmethod
+    def _version_filter(expected_version):
+        # Las suscripciones anteriores al campo version cuentan como versión 0.
+        return {"$in": [0, None]} if expected_version == 0 else expected_version
+
+    def _ownership_filter(self, subscription_id, customer_id_str, expected_version):
+        query = {"_id": subscription_id}
+        if customer_id_str is not None:
+            query["customer_id"] = ObjectId(customer_id_str)
+        if expected_version is not None:
+            query["version"] = self._version_filter(expected_version)
+        return query
+
+    def _diagnose_failed_update(self, subscription_id, customer_id_str, expected_version):
+        """
+        Solo tras una actualización condicional fallida: lee la suscripción para saber qué predicado no se cumplió.
+        Retorna (subscription, error); error es None si los predicados comunes se cumplen.
+        """
+        subscription = load_one(self.subscriptions_collection, "subscriptions", subscription_id)
+        if not subscription:
+            return None, "Subscription not found."
+        if customer_id_str is not None and str(subscription.get("customer_id")) != customer_id_str:
+            return subscription, "You are not authorized to modify this subscription."
+        if expected_version is not None and subscription.get("version", 0) != expected_version:
+            return subscription, "Subscription was modified concurrently (version mismatch)."
+        return subscription, None
+
+    def edit_subscription_settings(self, subscription_id_str, new_settings, customer_id_str=None, expected_version=None):
+        """
+        Reemplaza la personalización con un único find_one_and_update condicional: la propiedad
+        (customer_id), que el producto sea personalizable y, si se indica, la versión esperada van en el filtro.
+        Cada cambio incrementa version. Solo si la condición falla se lee la suscripción para dar el motivo.
+        """
         if not ObjectId.is_valid(subscription_id_str):
             return False, "Invalid subscription_id format."
 
         subscription_id = ObjectId(subscription_id_str)
-        subscription = self.subscriptions_collection.find_one({"_id": subscription_id})
-        if not subscription:
-            return False, "Subscription not found."
-        
-        product = self.products_collection.find_one({"_id": subscription["product_id"]})
-        if not product or not product.get("customizable", False):
-            return False, "Product associated with this subscription is not customizable, settings cannot be edited."
+        customizable_product_ids = [
+            product["_id"] for product in self.product_catalog.all() if product.get("customizable", False)
+        ]
+        query = self._ownership_filter(subscription_id, customer_id_str, expected_version)
+        query["product_id"] = {"$in": customizable_product_ids}
+        query["customization"] = {"$ne": new_settings}
 
-        result = self.subscriptions_collection.update_one(
-            {"_id": subscription_id},
-            {"$set": {"customization": new_settings}}
+        updated = self.subscriptions_collection.find_one_and_update(
+            query,
+            {"$set": {"customization": new_settings, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}},
+            projection={"_id": 1}
         )
-        if result.modified_count == 1:
+        forget("subscriptions", subscription_id)
+        if updated is not None:
+            subscriptions_data_version.bump()
             return True, None
-        elif result.matched_count == 1: 
+
+        subscription, error = self._diagnose_failed_update(subscription_id, customer_id_str, expected_version)
+        if error:
+            return False, error
+        product = self.product_catalog.get(subscription["product_id"])
+        if not product or not product.get("customizable", False):
+            return False, "Product associated with this subscription is not customizable, settings cannot be edited."
+        if subscription.get("customization") == new_settings:
             return True, "Settings already up to date, no changes made"
         return False, "Failed to update subscription settings."
 
-    def extend_subscription(self, subscription_id_str, new_expiration_date_str):
+    def patch_subscription_settings(self, subscription_id_str, patch, patch_format, customer_id_str=None, expected_version=None):
+        """
+        Aplica un JSON Merge Patch o un JSON Patch a la personalización con $set/$unset por ruta
+        (customization.<clave>), en vez de reescribir el objeto entero.
+        Retorna (nueva versión, error).
+        """
+        if not ObjectId.is_valid(subscription_id_str):
+            return None, "Invalid subscription_id format."
+        try:
+            set_fields, unset_fields, conditions = settings_patch.to_update(
+                patch, patch_format, max_operations=Config.SETTINGS_PATCH_MAX_OPERATIONS
+            )
+        except settings_patch.PatchError as error:
+            return None, f"Invalid patch: {error}"
+
+        subscription_id = ObjectId(subscription_id_str)
+        customizable_product_ids = [
+            product["_id"] for product in self.product_catalog.all() if product.get("customizable", False)
+        ]
+        query = self._ownership_filter(subscription_id, customer_id_str, expected_version)
+        query["product_id"] = {"$in": customizable_product_ids}
+        query.update(conditions)
+
+        update = {"$set": dict(set_fields, updated_at=datetime.utcnow()), "$inc": {"version": 1}}
+        if unset_fields:
+            update["$unset"] = unset_fields
+        try:
+            updated = self.subscriptions_collection.find_one_and_update(
+                query, update, projection={"version": 1}, return_document=ReturnDocument.AFTER
+            )
+        except OperationFailure:
+            # P. ej. crear customization.a.b cuando customization.a no es un objeto.
+            if patch_format != settings_patch.MERGE_PATCH:
+                return None, "Patch cannot be applied to the current settings."
+            return self._merge_patch_by_replacement(subscription_id, patch, customer_id_str, expected_version)
+        forget("subscriptions", subscription_id)
+        if updated is not None:
+            subscriptions_data_version.bump()
+            return updated["version"], None
+
+        subscription, error = self._diagnose_failed_update(subscription_id, customer_id_str, expected_version)
+        if error:
+            return None, error
+        product = self.product_catalog.get(subscription["product_id"])
+        if not product or not product.get("customizable", False):
+            return None, "Product associated with this subscription is not customizable, settings cannot be edited."
+        return None, "Patch cannot be applied to the current settings (test failed or path not found)."
+
+    def _merge_patch_by_replacement(self, subscription_id, patch, customer_id_str, expected_version):
+        """
+        Camino lento del merge patch cuando las rutas con puntos no valen (un escalar pasa a ser
+        objeto): se lee la suscripción, se aplica el patch en memoria y se reescribe la personalización
+        condicionada a la versión leída.
+        """
+        forget("subscriptions", subscription_id)
+        subscription, error = self._diagnose_failed_update(subscription_id, customer_id_str, expected_version)
+        if error:
+            return None, error
+        product = self.product_catalog.get(subscription["product_id"])
+        if not product or not product.get("customizable", False):
+            return None, "Product associated with this subscription is not customizable, settings cannot be edited."
+
+        current_version = subscription.get("version", 0)
+        updated = self.subscriptions_collection.find_one_and_update(
+            {"_id": subscription_id, "version": self._version_filter(current_version)},
+            {
+                "$set": {
+                    "customization": settings_patch.apply_merge_patch(subscription.get("customization"), patch),
+                    "updated_at": datetime.utcnow()
+                },
+                "$inc": {"version": 1}
+            },
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        forget("subscriptions", subscription_id)
+        if updated is None:
+            return None, "Subscription was modified concurrently (version mismatch)."
+        subscriptions_data_version.bump()
+        return updated["version"], None
+
+    def extend_subscription(self, subscription_id_str, new_expiration_date_str, customer_id_str=None, expected_version=None):
+        """
+        Extiende la expiración con un único find_one_and_update condicional: la propiedad, que la
+        fecha actual sea anterior a la nueva y, si se indica, la versión esperada van en el filtro.
+        Se pide el documento previo para ajustar el ledger y los resultados guardados.
+        """
         if not ObjectId.is_valid(subscription_id_str):
             return False, "Invalid subscription_id format."
 
@@ -145,31 +409,48 @@ class SubscriptionService:
             return False, "New expiration date cannot be in the past."
         
         subscription_id = ObjectId(subscription_id_str)
-        
-        subscription = self.subscriptions_collection.find_one({"_id": subscription_id})
-        
-        if subscription and subscription["expiration_date"] > new_expiration_date:
-            return False, "Subscription expiration date already set to this value or later"
-        if not subscription:
-            return False, "Subscription not found."
+        query = self._ownership_filter(subscription_id, customer_id_str, expected_version)
+        query["expiration_date"] = {"$lt": new_expiration_date}
 
-        result = self.subscriptions_collection.update_one(
-            {"_id": subscription_id},
-            {"$set": {"expiration_date": new_expiration_date}}
+        previous = self.subscriptions_collection.find_one_and_update(
+            query,
+            {
+                "$set": {"expiration_date": new_expiration_date, "in_ledger": True, "updated_at": datetime.utcnow()},
+                "$inc": {"version": 1}
+            },
+            projection={"customer_id": 1, "expiration_date": 1, "in_ledger": 1, "monthly_amount": 1},
+            return_document=ReturnDocument.BEFORE
         )
+        forget("subscriptions", subscription_id)
 
-        if result.modified_count == 1:
+        if previous is not None:
+            # Una suscripción ya barrida por expirar vuelve a contar en el ledger.
+            if previous.get("in_ledger") is False:
+                self.revenue_ledger.add_subscription(previous["customer_id"], previous.get("monthly_amount"))
+            # Si estaba expirada, cambia su actividad en periodos ya cerrados y guardados.
+            if as_naive_utc(previous["expiration_date"]) < datetime.utcnow():
+                self.metric_results.invalidate_range(previous["expiration_date"], new_expiration_date)
+            subscriptions_data_version.bump()
             return True, None
-        elif result.matched_count == 1:
+
+        subscription, error = self._diagnose_failed_update(subscription_id, customer_id_str, expected_version)
+        if error:
+            return False, error
+        if subscription["expiration_date"] == new_expiration_date:
             return True, "Subscription expiration date already set to this value"
+        if subscription["expiration_date"] > new_expiration_date:
+            return False, "Subscription expiration date already set to this value or later"
         return False, "Failed to extend subscription."
+
     def get_subscription_by_id(self, subscription_id_str):
         """
         Retorna un documento de suscripción por su ID.
+        Dentro de una petición se guarda en el identity map, así que el método de servicio
+        que la ruta llama después no vuelve a leerlo.
         """
         try:
             subscription_id = ObjectId(subscription_id_str)
         except Exception:
             return None 
         
-        return self.subscriptions_collection.find_one({"_id": subscription_id})
\ No newline at end of file
+        return load_one(self.subscriptions_collection, "subscriptions", subscription_id)
\ No newline at end of file
@@ -38,12 +38,29 @@ def mock_db(mocker):
     # 5. Crear mocks para las colecciones individuales (customers, products, subscriptions).
     mock_customers_collection = mocker.Mock()
     mock_products_collection = mocker.Mock()
+    mock_products_collection.find.return_value = []
     mock_subscriptions_collection = mocker.Mock()
+    mock_revenue_ledger_collection = mocker.Mock()
+    mock_revenue_ledger_collection.find_one.return_value = None
+    mock_revenue_ledger_collection.find_one_and_update.return_value = None
+    mock_revenue_ledger_collection.bulk_write.return_value.upserted_ids = {}
+    mock_metric_results_collection = mocker.Mock()
+    mock_metric_results_collection.find_one.return_value = None
+    mock_catalog_versions_collection = mocker.Mock()
+    mock_catalog_versions_collection.find_one.return_value = None
+    mock_catalog_versions_collection.find_one_and_update.return_value = {"_id": "products", "version": 1}
+    mock_refresh_tokens_collection = mocker.Mock()
+    mock_refresh_tokens_collection.find_one.return_value = None
+    mock_refresh_tokens_collection.find_one_and_update.return_value = None
 
     # 6. Configurar la instancia mock de la base de datos para que devuelva los mocks de las colecciones.
     mock_db_instance.customers = mock_customers_collection
     mock_db_instance.products = mock_products_collection
     mock_db_instance.subscriptions = mock_subscriptions_collection
+    mock_db_instance.revenue_ledger = mock_revenue_ledger_collection
+    mock_db_instance.metric_results = mock_metric_results_collection
+    mock_db_instance.refresh_tokens = mock_refresh_tokens_collection
+    mock_db_instance.catalog_versions = mock_catalog_versions_collection
 
     # 7. Parchear database.init_db y database.get_db.
     # init_db() no hará nada en las pruebas.
@@ -56,7 +73,11 @@ def mock_db(mocker):
         "db": mock_db_instance,
         "customers": mock_customers_collection,
         "products": mock_products_collection,
-        "subscriptions": mock_subscriptions_collection
+        "subscriptions": mock_subscriptions_collection,
+        "revenue_ledger": mock_revenue_ledger_collection,
+        "metric_results": mock_metric_results_collection,
+        "refresh_tokens": mock_refresh_tokens_collection,
+        "catalog_versions": mock_catalog_versions_collection
     }
 
 @pytest.fixture
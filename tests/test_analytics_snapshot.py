@@ -0,0 +1,123 @@
+import pytest
+from services.analytics_snapshot import SubscriptionSnapshot
+from bson import ObjectId
+from datetime import datetime
+
+def create_snapshot_subscription(customer_id, price, periodicity, start_date, expiration_date, updated_at=None):
+    return {
+        "_id": ObjectId(),
+        "customer_id": customer_id,
+        "product_id": ObjectId("000000000000000000000001"),
+        "price_at_subscription": price,
+        "periodicity_at_subscription": periodicity,
+        "start_date": start_date,
+        "expiration_date": expiration_date,
+        "updated_at": updated_at or start_date
+    }
+
+def test_snapshot_not_available_before_refresh(tmp_path):
+    """
+    Verifica que sin instantánea generada no está disponible.
+    """
+    snapshot = SubscriptionSnapshot(str(tmp_path))
+    assert snapshot.is_available() is False
+
+def test_snapshot_metrics(mock_db, tmp_path):
+    """
+    Verifica MRR, ARPU, churn y RPR calculados desde la instantánea.
+    """
+    customer1_id = ObjectId()
+    customer2_id = ObjectId()
+    mock_db['subscriptions'].find.return_value = [
+        create_snapshot_subscription(customer1_id, 100.0, "monthly", datetime(2024, 1, 1), datetime(2024, 12, 31)),
+        create_snapshot_subscription(customer1_id, 1200.0, "annually", datetime(2024, 1, 1), datetime(2025, 1, 1)),
+        create_snapshot_subscription(customer2_id, 50.0, "monthly", datetime(2024, 1, 1), datetime(2024, 2, 1)),
+    ]
+
+    snapshot = SubscriptionSnapshot(str(tmp_path))
+    assert snapshot.refresh(mock_db['subscriptions']) == 3
+    assert snapshot.is_available() is True
+
+    assert snapshot.mrr(datetime(2024, 1, 15)) == 250.0
+    assert snapshot.arpu(datetime(2024, 1, 15)) == 125.0
+    assert snapshot.churn_rate(datetime(2024, 1, 15), datetime(2024, 2, 15)) == 50.0
+    assert snapshot.rpr() == 50.0
+
+def test_snapshot_incremental_refresh(mock_db, tmp_path):
+    """
+    Verifica que el refresco incremental actualiza filas existentes por _id y publica una nueva generación.
+    """
+    customer_id = ObjectId()
+    subscription = create_snapshot_subscription(
+        customer_id, 100.0, "monthly", datetime(2024, 1, 1), datetime(2024, 2, 1), datetime(2024, 1, 1)
+    )
+    mock_db['subscriptions'].find.return_value = [subscription]
+    snapshot = SubscriptionSnapshot(str(tmp_path))
+    snapshot.refresh(mock_db['subscriptions'])
+    assert snapshot.mrr(datetime(2024, 3, 1)) == 0.0
+
+    extended = dict(subscription, expiration_date=datetime(2024, 6, 1), updated_at=datetime(2024, 1, 20))
+    mock_db['subscriptions'].find.return_value = [extended]
+    assert snapshot.refresh(mock_db['subscriptions'], overlap_seconds=60) == 1
+
+    query = mock_db['subscriptions'].find.call_args[0][0]
+    assert {"updated_at": {"$gte": datetime(2023, 12, 31, 23, 59)}} in query["$or"]
+
+    reader = SubscriptionSnapshot(str(tmp_path))
+    assert reader.mrr(datetime(2024, 3, 1)) == 100.0
+    assert reader._meta["rows"] == 1
+
+def test_snapshot_refresh_rereads_overlap_window(mock_db, tmp_path):
+    """
+    Verifica que el refresco relee con solape una escritura marcada antes de la marca de agua
+    y que releer filas sin cambios no publica una nueva generación.
+    """
+    first = create_snapshot_subscription(
+        ObjectId(), 100.0, "monthly", datetime(2024, 1, 1), datetime(2024, 6, 1), datetime(2024, 1, 10, 12, 0)
+    )
+    mock_db['subscriptions'].find.return_value = [first]
+    snapshot = SubscriptionSnapshot(str(tmp_path))
+    snapshot.refresh(mock_db['subscriptions'], overlap_seconds=300)
+
+    # Confirmada tras el refresco pero con updated_at del reloj de otro worker, anterior a la marca de agua.
+    late = create_snapshot_subscription(
+        ObjectId(), 50.0, "monthly", datetime(2024, 1, 1), datetime(2024, 6, 1), datetime(2024, 1, 10, 11, 58)
+    )
+    mock_db['subscriptions'].find.return_value = [first, late]
+    assert snapshot.refresh(mock_db['subscriptions'], overlap_seconds=300) == 1
+
+    query = mock_db['subscriptions'].find.call_args[0][0]
+    assert {"updated_at": {"$gte": datetime(2024, 1, 10, 11, 55)}} in query["$or"]
+    reader = SubscriptionSnapshot(str(tmp_path))
+    assert reader.mrr(datetime(2024, 3, 1)) == 150.0
+    generation = reader._meta["generation"]
+
+    assert snapshot.refresh(mock_db['subscriptions'], overlap_seconds=300) == 0
+    unchanged = SubscriptionSnapshot(str(tmp_path))
+    assert unchanged.mrr(datetime(2024, 3, 1)) == 150.0
+    assert unchanged._meta["generation"] == generation
+
+def test_snapshot_refresh_updates_and_appends_rows_in_place(mock_db, tmp_path):
+    """
+    Verifica que un refresco con filas cambiadas y nuevas reescribe solo esas posiciones
+    y añade las nuevas al final, conservando el resto de filas.
+    """
+    subscriptions = [
+        create_snapshot_subscription(ObjectId(), 10.0 * (i + 1), "monthly", datetime(2024, 1, 1), datetime(2024, 6, 1))
+        for i in range(4)
+    ]
+    mock_db['subscriptions'].find.return_value = subscriptions
+    snapshot = SubscriptionSnapshot(str(tmp_path))
+    snapshot.refresh(mock_db['subscriptions'], overlap_seconds=0)
+
+    repriced = dict(subscriptions[2], price_at_subscription=300.0, updated_at=datetime(2024, 1, 5))
+    added = create_snapshot_subscription(ObjectId(), 5.0, "monthly", datetime(2024, 1, 1), datetime(2024, 6, 1))
+    mock_db['subscriptions'].find.return_value = [subscriptions[3], repriced, added]
+    assert snapshot.refresh(mock_db['subscriptions'], overlap_seconds=0) == 2
+
+    reader = SubscriptionSnapshot(str(tmp_path))
+    reader.is_available()
+    assert list(reader._columns["price"]) == [10.0, 20.0, 300.0, 40.0, 5.0]
+    assert [row_id.tobytes() for row_id in reader._columns["ids"]] == [
+        subscription["_id"].binary for subscription in subscriptions + [added]
+    ]
@@ -1,6 +1,8 @@
+import pytest
 from services.auth_service import AuthService
-from utils.security import hash_password, verify_password
+from utils.security import hash_password, verify_password, get_hash_rounds, PasswordHasher, HasherBusyError
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from datetime import datetime, timedelta, timezone
 import jwt
 from config import Config
@@ -28,14 +30,14 @@ def test_register_customer_email_exists(mock_db):
     """
     Verifica que el registro falla si el email ya existe.
     """
-    mock_db['customers'].find_one.return_value = {"email": "existing@example.com"}
+    mock_db['customers'].insert_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
 
     auth_service = AuthService(mock_db['db'])
     customer_id, error = auth_service.register_customer("Existing User", "existing@example.com", "password123")
 
     assert customer_id is None
     assert "already exists" in error
-    mock_db['customers'].insert_one.assert_not_called()
+    mock_db['customers'].find_one.assert_not_called()
 
 def test_login_customer_success(mock_db, mocker):
     """
@@ -50,15 +52,20 @@ def test_login_customer_success(mock_db, mocker):
     
     mocker.patch('time.time', return_value=datetime.utcnow().timestamp())
     auth_service = AuthService(mock_db['db'])
-    token, error = auth_service.login_customer("login@example.com", "password123")
+    tokens, error = auth_service.login_customer("login@example.com", "password123")
 
     assert error is None
-    assert isinstance(token, str)
+    assert isinstance(tokens["access_token"], str)
+    assert isinstance(tokens["refresh_token"], str)
 
-    decoded_payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=["HS256"])
+    decoded_payload = jwt.decode(tokens["access_token"], Config.JWT_SECRET_KEY, algorithms=["HS256"])
     assert decoded_payload["sub"] == "60d5ec49f7e3b1a2b3c4d5e6"
     assert decoded_payload["email"] == "login@example.com"
 
+    stored_token = mock_db['refresh_tokens'].insert_one.call_args[0][0]
+    assert stored_token["customer_id"] == ObjectId("60d5ec49f7e3b1a2b3c4d5e6")
+    assert stored_token["_id"] != tokens["refresh_token"]
+
 def test_login_customer_invalid_credentials_email(mock_db):
     """
     Verifica que el login falla con credenciales inválidas (email no encontrado).
@@ -71,6 +78,22 @@ def test_login_customer_invalid_credentials_email(mock_db):
     assert token is None
     assert "Invalid credentials" in error
 
+def test_login_customer_disabled_account(mock_db):
+    """
+    Verifica que una cuenta deshabilitada no puede iniciar sesión ni obtiene refresh tokens.
+    """
+    mock_db['customers'].find_one.return_value = None
+
+    auth_service = AuthService(mock_db['db'])
+    tokens, error = auth_service.login_customer("disabled@example.com", "password123")
+
+    assert tokens is None
+    assert error == "Invalid credentials"
+    mock_db['customers'].find_one.assert_called_once_with(
+        {"email": "disabled@example.com", "disabled": {"$ne": True}}
+    )
+    mock_db['refresh_tokens'].insert_one.assert_not_called()
+
 def test_login_customer_invalid_credentials_password(mock_db):
     """
     Verifica que el login falla con credenciales inválidas (contraseña incorrecta).
@@ -110,3 +133,295 @@ def test_get_customer_by_id_invalid_id(mock_db):
 
     assert customer is None
     mock_db['customers'].find_one.assert_not_called() # No debería intentar buscar en la DB
+
+def test_customer_exists_uses_projection_and_cache(mock_db):
+    """
+    Verifica que la comprobación de existencia consulta solo el _id y luego se sirve desde la caché.
+    """
+    customer_id = ObjectId()
+    mock_db['customers'].find_one.return_value = {"_id": customer_id}
+
+    auth_service = AuthService(mock_db['db'])
+    assert auth_service.customer_exists(str(customer_id)) is True
+    assert auth_service.customer_exists(str(customer_id)) is True
+
+    mock_db['customers'].find_one.assert_called_once()
+    query, projection = mock_db['customers'].find_one.call_args[0]
+    assert query == {"_id": customer_id, "disabled": {"$ne": True}}
+    assert projection == {"_id": 1}
+    assert auth_service.customer_cache_stats()["hits"] == 1
+
+def test_customer_exists_not_found_is_not_cached(mock_db):
+    """
+    Verifica que un cliente inexistente no se guarda en la caché.
+    """
+    mock_db['customers'].find_one.return_value = None
+
+    auth_service = AuthService(mock_db['db'])
+    assert auth_service.customer_exists(str(ObjectId())) is False
+    assert auth_service.customer_cache_stats()["size"] == 0
+
+def test_disable_customer_invalidates_cache(mock_db):
+    """
+    Verifica que deshabilitar un cliente lo elimina de la caché de verificados.
+    """
+    customer_id = str(ObjectId())
+    mock_db['customers'].find_one.return_value = {"_id": ObjectId(customer_id)}
+    mock_db['customers'].update_one.return_value.matched_count = 1
+
+    auth_service = AuthService(mock_db['db'])
+    auth_service.customer_exists(customer_id)
+    success, error = auth_service.disable_customer(customer_id)
+
+    assert success is True
+    assert error is None
+    mock_db['customers'].find_one.return_value = None
+    assert auth_service.customer_exists(customer_id) is False
+
+def test_login_rehashes_password_with_outdated_cost(mock_db):
+    """
+    Verifica que un login correcto actualiza el hash si su coste difiere de BCRYPT_ROUNDS.
+    """
+    old_hash = hash_password("password123", rounds=4)
+    customer_id = ObjectId()
+    mock_db['customers'].find_one.return_value = {
+        "_id": customer_id,
+        "email": "login@example.com",
+        "password_hash": old_hash
+    }
+
+    auth_service = AuthService(mock_db['db'], hasher=PasswordHasher(workers=0, rounds=5))
+    token, error = auth_service.login_customer("login@example.com", "password123")
+
+    assert error is None
+    query, update = mock_db['customers'].update_one.call_args[0]
+    assert query == {"_id": customer_id, "password_hash": old_hash}
+    new_hash = update["$set"]["password_hash"]
+    assert get_hash_rounds(new_hash) == 5
+    assert verify_password("password123", new_hash)
+
+def test_login_does_not_rehash_current_cost(mock_db):
+    """
+    Verifica que no se reescribe el hash si ya tiene el coste configurado.
+    """
+    mock_db['customers'].find_one.return_value = {
+        "_id": ObjectId(),
+        "email": "login@example.com",
+        "password_hash": hash_password("password123", rounds=4)
+    }
+
+    auth_service = AuthService(mock_db['db'], hasher=PasswordHasher(workers=0, rounds=4))
+    token, error = auth_service.login_customer("login@example.com", "password123")
+
+    assert error is None
+    mock_db['customers'].update_one.assert_not_called()
+
+def test_login_busy_hasher_returns_error(mock_db, mocker):
+    """
+    Verifica que si la cola del pool está llena el login falla sin consultar bcrypt.
+    """
+    mock_db['customers'].find_one.return_value = {
+        "_id": ObjectId(),
+        "email": "login@example.com",
+        "password_hash": hash_password("password123", rounds=4)
+    }
+    hasher = PasswordHasher(workers=0)
+    mocker.patch.object(hasher, 'verify', side_effect=HasherBusyError("Password hashing queue is full"))
+
+    auth_service = AuthService(mock_db['db'], hasher=hasher)
+    token, error = auth_service.login_customer("login@example.com", "password123")
+
+    assert token is None
+    assert "busy" in error
+
+def test_login_succeeds_when_rehash_is_busy(mock_db, mocker):
+    """
+    Verifica que si la cola está llena durante el rehash opcional el login verificado no falla.
+    """
+    mock_db['customers'].find_one.return_value = {
+        "_id": ObjectId(),
+        "email": "login@example.com",
+        "password_hash": hash_password("password123", rounds=4)
+    }
+    hasher = PasswordHasher(workers=0, rounds=5)
+    mocker.patch.object(hasher, 'hash', side_effect=HasherBusyError("Password hashing queue is full"))
+
+    auth_service = AuthService(mock_db['db'], hasher=hasher)
+    tokens, error = auth_service.login_customer("login@example.com", "password123")
+
+    assert error is None
+    assert "access_token" in tokens
+    mock_db['customers'].update_one.assert_not_called()
+
+def test_password_hasher_process_pool():
+    """
+    Verifica que el pool de procesos hashea y verifica contraseñas.
+    """
+    hasher = PasswordHasher(workers=1, max_pending=2, rounds=4)
+    try:
+        hashed = hasher.hash("password123")
+        assert get_hash_rounds(hashed) == 4
+        assert hasher.verify("password123", hashed) is True
+        assert hasher.verify("wrong", hashed) is False
+        batch = hasher.hash_many(["a", "b", "c"])
+        assert [verify_password(password, hashed) for password, hashed in zip("abc", batch)] == [True] * 3
+        # El lote pasa por la cola acotada y devuelve todos sus huecos.
+        assert hasher._slots.acquire(timeout=1) and hasher._slots.acquire(timeout=1)
+    finally:
+        hasher.shutdown()
+
+def test_refresh_access_token_success(mock_db):
+    """
+    Verifica que un refresh token válido emite un nuevo par de tokens sin consultar customers.
+    """
+    customer_id = ObjectId()
+    mock_db['refresh_tokens'].find_one_and_update.return_value = {
+        "_id": b"digest", "family_id": ObjectId(), "customer_id": customer_id, "email": "login@example.com"
+    }
+
+    auth_service = AuthService(mock_db['db'])
+    tokens, error = auth_service.refresh_access_token("some_refresh_token")
+
+    assert error is None
+    decoded_payload = jwt.decode(tokens["access_token"], Config.JWT_SECRET_KEY, algorithms=["HS256"])
+    assert decoded_payload["sub"] == str(customer_id)
+    assert tokens["refresh_token"] != "some_refresh_token"
+    mock_db['customers'].find_one.assert_not_called()
+
+def test_refresh_access_token_invalid(mock_db):
+    """
+    Verifica que un refresh token desconocido o caducado es rechazado.
+    """
+    auth_service = AuthService(mock_db['db'])
+    tokens, error = auth_service.refresh_access_token("unknown_token")
+
+    assert tokens is None
+    assert "Invalid or expired" in error
+
+def test_decode_token_caches_verified_payload(mocker):
+    """
+    Verifica que un token repetido no vuelve a pasar por jwt.decode.
+    """
+    from utils import auth
+    auth.decoded_tokens.clear()
+    token = jwt.encode(
+        {"sub": "60d5ec49f7e3b1a2b3c4d5e6", "exp": datetime.now(timezone.utc) + timedelta(minutes=5)},
+        Config.JWT_SECRET_KEY, algorithm="HS256"
+    )
+    decode_spy = mocker.spy(auth.jwt, 'decode')
+
+    first = auth.decode_token(token)
+    second = auth.decode_token(token)
+
+    assert first == second
+    assert first["sub"] == "60d5ec49f7e3b1a2b3c4d5e6"
+    decode_spy.assert_called_once()
+
+def test_decode_token_does_not_cache_invalid_tokens():
+    """
+    Verifica que los tokens expirados siguen fallando y no entran en la caché.
+    """
+    from utils import auth
+    auth.decoded_tokens.clear()
+    token = jwt.encode(
+        {"sub": "60d5ec49f7e3b1a2b3c4d5e6", "exp": datetime.now(timezone.utc) - timedelta(minutes=5)},
+        Config.JWT_SECRET_KEY, algorithm="HS256"
+    )
+
+    with pytest.raises(jwt.ExpiredSignatureError):
+        auth.decode_token(token)
+    assert auth.decoded_tokens.stats()["size"] == 0
+
+def test_login_signs_with_active_eddsa_key(mock_db, tmp_path):
+    """
+    Verifica que con EdDSA el token lleva el kid activo y se valida con el JWKS publicado.
+    """
+    from utils.jwt_keys import KeyRing, generate_signing_key
+    generate_signing_key(str(tmp_path), "2024-01", "EdDSA")
+    generate_signing_key(str(tmp_path), "2024-02", "EdDSA")
+    key_ring = KeyRing("EdDSA", str(tmp_path))
+    mock_db['customers'].find_one.return_value = {
+        "_id": ObjectId("60d5ec49f7e3b1a2b3c4d5e6"),
+        "email": "login@example.com",
+        "password_hash": hash_password("password123", rounds=4)
+    }
+
+    auth_service = AuthService(mock_db['db'], hasher=PasswordHasher(workers=0, rounds=4), key_ring=key_ring)
+    tokens, error = auth_service.login_customer("login@example.com", "password123")
+
+    assert error is None
+    assert jwt.get_unverified_header(tokens["access_token"])["kid"] == "2024-02"
+    jwks = key_ring.jwks()
+    assert sorted(key["kid"] for key in jwks["keys"]) == ["2024-01", "2024-02"]
+    public_key = jwt.PyJWKSet.from_dict(jwks)["2024-02"].key
+    decoded_payload = jwt.decode(tokens["access_token"], public_key, algorithms=["EdDSA"])
+    assert decoded_payload["sub"] == "60d5ec49f7e3b1a2b3c4d5e6"
+
+def test_key_ring_verifies_tokens_from_retired_keys(tmp_path):
+    """
+    Verifica que tras rotar la clave activa los tokens firmados con la anterior siguen siendo válidos,
+    y que un kid desconocido se rechaza.
+    """
+    from utils.jwt_keys import KeyRing, generate_signing_key
+    generate_signing_key(str(tmp_path / "ring"), "2024-01", "RS256")
+    old_token = KeyRing("RS256", str(tmp_path / "ring")).encode({"sub": "abc"})
+
+    generate_signing_key(str(tmp_path / "ring"), "2024-02", "RS256")
+    rotated = KeyRing("RS256", str(tmp_path / "ring"))
+    assert rotated.active_kid == "2024-02"
+    assert rotated.decode(old_token)["sub"] == "abc"
+
+    generate_signing_key(str(tmp_path / "other"), "2024-03", "RS256")
+    foreign_token = KeyRing("RS256", str(tmp_path / "other")).encode({"sub": "abc"})
+    with pytest.raises(jwt.InvalidTokenError):
+        rotated.decode(foreign_token)
+
+def test_import_customers_rejects_non_string_fields(mock_db):
+    """
+    Verifica que los campos que no son texto se informan como inválidos sin abortar la importación.
+    """
+    lines = [
+        '{"name": "A", "email": "a@example.com", "password": 123}',
+        '{"name": ["B"], "email": "b@example.com", "password": "secret"}',
+        '{"name": "C", "email": "c@example.com", "password": "secret"}'
+    ]
+
+    auth_service = AuthService(mock_db['db'], hasher=PasswordHasher(workers=0, rounds=4))
+    results = list(auth_service.import_customers(lines))
+
+    assert [result["status"] for result in results] == ["invalid", "invalid", "created"]
+    assert results[0]["error"] == "password must be a string"
+
+def test_import_customers_batches_and_reports_each_line(mock_db):
+    """
+    Verifica que la importación escribe por lotes sin orden, respeta los hashes bcrypt existentes
+    e informa de duplicados y líneas inválidas.
+    """
+    existing_hash = hash_password("legacy", rounds=4)
+    lines = [
+        '{"name": "A", "email": "a@example.com", "password": "secret"}',
+        '{"name": "B", "email": "b@example.com", "password_hash": "%s"}' % existing_hash,
+        'not json',
+        '{"name": "C", "email": "a@example.com", "password": "secret"}',
+        '{"name": "D", "email": "d@example.com", "password_hash": "plain"}',
+        '{"name": "E", "email": "e@example.com", "password": "secret"}'
+    ]
+    mock_db['customers'].insert_many.side_effect = [
+        None,
+        BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000 duplicate key error"}]})
+    ]
+
+    auth_service = AuthService(mock_db['db'], hasher=PasswordHasher(workers=0, rounds=4))
+    results = list(auth_service.import_customers(lines, batch_size=3))
+
+    assert [result["line"] for result in results] == [1, 2, 3, 4, 5, 6]
+    assert [result["status"] for result in results] == [
+        "created", "created", "invalid", "duplicate", "invalid", "created"
+    ]
+    assert mock_db['customers'].insert_many.call_count == 2
+    first_batch, options = mock_db['customers'].insert_many.call_args_list[0]
+    assert options == {"ordered": False}
+    assert first_batch[0][0]["password_hash"] != "secret"
+    assert verify_password("secret", first_batch[0][0]["password_hash"])
+    assert first_batch[0][1]["password_hash"] == existing_hash
+    assert results[0]["customer_id"] == str(first_batch[0][0]["_id"])
@@ -0,0 +1,55 @@
+import pytest
+from services.cohort_service import CohortService
+from bson import ObjectId
+from datetime import datetime
+
+def test_calculate_cohorts_empty(mock_db):
+    """
+    Verifica que sin suscripciones no hay cohortes.
+    """
+    mock_db['subscriptions'].find.return_value = []
+    cohort_service = CohortService(mock_db['db'])
+    assert cohort_service.calculate_cohorts(as_of=datetime(2024, 4, 15)) == []
+
+def test_calculate_cohorts_without_active_months(mock_db):
+    """
+    Verifica que si ninguna suscripción está activa un mes completo no hay cohortes (y no falla).
+    """
+    mock_db['subscriptions'].find.return_value = [
+        {"customer_id": ObjectId(), "start_date": datetime(2024, 3, 1), "expiration_date": datetime(2024, 3, 1), "monthly_amount": 10.0}
+    ]
+    cohort_service = CohortService(mock_db['db'])
+    assert cohort_service.calculate_cohorts(as_of=datetime(2024, 4, 15)) == []
+
+def test_calculate_cohorts_logo_and_revenue_retention(mock_db):
+    """
+    Verifica la matriz de retención de clientes e ingresos por cohorte mensual.
+    """
+    customer1_id = ObjectId()
+    customer2_id = ObjectId()
+    customer3_id = ObjectId()
+
+    mock_db['subscriptions'].find.return_value = [
+        # Cohorte 2024-01: customer1 sigue activo hasta marzo, customer2 abandona tras enero.
+        {"customer_id": customer1_id, "start_date": datetime(2024, 1, 10), "expiration_date": datetime(2024, 4, 1), "monthly_amount": 100.0},
+        {"customer_id": customer1_id, "start_date": datetime(2024, 2, 1), "expiration_date": datetime(2024, 3, 1), "monthly_amount": 20.0},
+        {"customer_id": customer2_id, "start_date": datetime(2024, 1, 5), "expiration_date": datetime(2024, 2, 1), "monthly_amount": 50.0},
+        # Cohorte 2024-03.
+        {"customer_id": customer3_id, "start_date": datetime(2024, 3, 3), "expiration_date": datetime(2025, 3, 3), "monthly_amount": 10.0},
+    ]
+
+    cohort_service = CohortService(mock_db['db'])
+    cohorts = cohort_service.calculate_cohorts(as_of=datetime(2024, 4, 15))
+
+    assert [cohort["cohort"] for cohort in cohorts] == ["2024-01", "2024-03"]
+    january = cohorts[0]
+    assert january["customers"] == 2
+    assert january["logo_retention"] == [100.0, 50.0, 50.0, 0.0]
+    assert january["revenue"] == [150.0, 120.0, 100.0, 0.0]
+    assert january["revenue_retention"] == [100.0, 80.0, 66.67, 0.0]
+
+    march = cohorts[1]
+    assert march["customers"] == 1
+    assert march["logo_retention"] == [100.0, 100.0]
+
+    mock_db['subscriptions'].find.assert_called_once()
@@ -0,0 +1,42 @@
+from indexes import INDEXES, ensure_indexes, index_report
+
+def test_ensure_indexes_one_call_per_collection(mock_db):
+    """
+    Verifica que se crean todos los índices del registro con un create_indexes por colección.
+    """
+    for name in ("customers", "products", "subscriptions", "metric_results", "refresh_tokens"):
+        collection = getattr(mock_db['db'], name)
+        collection.create_indexes.side_effect = lambda models: [model.document["name"] for model in models]
+
+    names = ensure_indexes(mock_db['db'])
+
+    assert sorted(names) == sorted(spec["options"]["name"] for spec in INDEXES)
+    mock_db['subscriptions'].create_indexes.assert_called_once()
+    unique_email = mock_db['customers'].create_indexes.call_args[0][0][0].document
+    assert unique_email["key"] == {"email": 1}
+    assert unique_email["unique"] is True
+
+def test_ensure_indexes_limited_to_collections(mock_db):
+    """
+    Verifica que se puede limitar el registro a algunas colecciones.
+    """
+    mock_db['products'].create_indexes.return_value = ["product_name"]
+
+    names = ensure_indexes(mock_db['db'], ["products"])
+
+    assert names == ["product_name"]
+    mock_db['customers'].create_indexes.assert_not_called()
+
+def test_index_report_marks_missing_indexes(mock_db):
+    """
+    Verifica que el informe indica qué índices faltan y qué consultas cubren.
+    """
+    mock_db['products'].index_information.return_value = {"_id_": {}, "product_name": {}}
+    mock_db['customers'].index_information.return_value = {"_id_": {}}
+
+    report = index_report(mock_db['db'], ["customers", "products"])
+
+    by_name = {entry["name"]: entry for entry in report}
+    assert by_name["product_name"]["present"] is True
+    assert by_name["customer_email"]["present"] is False
+    assert "AuthService.login_customer" in by_name["customer_email"]["covers"]
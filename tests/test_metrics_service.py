@@ -1,5 +1,7 @@
 import pytest
-from services.metrics_service import MetricsService
+from services.metrics_service import MetricsService, build_periods
+from services.revenue_ledger_service import RevenueLedgerService
+from utils.cache import TTLCache, subscriptions_data_version
 from bson import ObjectId
 from datetime import datetime, timedelta, timezone 
 
@@ -23,74 +25,135 @@ def create_mock_subscription(
         "customization": customization
     }
 
+def test_get_active_subscriptions_in_period_streams(mock_db):
+    """
+    Verifica que las suscripciones activas se generan una a una con proyección y tamaño de lote.
+    """
+    subscriptions = [{"_id": ObjectId()}, {"_id": ObjectId()}]
+    mock_db['subscriptions'].find.return_value = iter(subscriptions)
+    start_date = datetime(2024, 1, 1)
+    end_date = datetime(2024, 1, 31)
+
+    metrics_service = MetricsService(mock_db['db'])
+    generator = metrics_service.get_active_subscriptions_in_period(
+        start_date, end_date, projection={"customer_id": 1}, batch_size=500
+    )
+    mock_db['subscriptions'].find.assert_not_called()
+
+    assert list(generator) == subscriptions
+    query, projection = mock_db['subscriptions'].find.call_args[0]
+    assert query == {"start_date": {"$lte": end_date}, "expiration_date": {"$gt": start_date}}
+    assert projection == {"customer_id": 1}
+    assert mock_db['subscriptions'].find.call_args[1] == {"batch_size": 500}
+
+def test_get_active_subscriptions_in_period_keyset_page(mock_db):
+    """
+    Verifica la paginación por clave a partir del último _id recibido.
+    """
+    last_id = ObjectId()
+    last_start = datetime(2024, 1, 10)
+    mock_db['subscriptions'].find_one.return_value = {"_id": last_id, "start_date": last_start}
+    mock_db['subscriptions'].find.return_value = iter([])
+
+    metrics_service = MetricsService(mock_db['db'])
+    list(metrics_service.get_active_subscriptions_in_period(
+        datetime(2024, 1, 1), datetime(2024, 1, 31), after_id=last_id, limit=100
+    ))
+
+    query = mock_db['subscriptions'].find.call_args[0][0]
+    options = mock_db['subscriptions'].find.call_args[1]
+    assert query["start_date"] == {"$lte": datetime(2024, 1, 31), "$gte": last_start}
+    assert query["$or"] == [{"start_date": {"$gt": last_start}}, {"_id": {"$gt": last_id}}]
+    assert options["sort"] == [("start_date", 1), ("_id", 1)]
+    assert options["limit"] == 100
+
+def test_get_active_subscriptions_in_period_after_without_limit_is_sorted(mock_db):
+    """
+    Verifica que con after_id y sin limit los resultados también se ordenan por la clave de paginación.
+    """
+    last_id = ObjectId()
+    mock_db['subscriptions'].find_one.return_value = {"_id": last_id, "start_date": datetime(2024, 1, 10)}
+    mock_db['subscriptions'].find.return_value = iter([])
+
+    metrics_service = MetricsService(mock_db['db'])
+    list(metrics_service.get_active_subscriptions_in_period(
+        datetime(2024, 1, 1), datetime(2024, 1, 31), after_id=last_id
+    ))
+
+    options = mock_db['subscriptions'].find.call_args[1]
+    assert options["sort"] == [("start_date", 1), ("_id", 1)]
+    assert "limit" not in options
+
 def test_calculate_mrr_no_active_subscriptions(mock_db):
     """
-    Verifica que el MRR es 0.0 si no hay suscripciones activas.
+    Verifica que el MRR es 0.0 si el ledger está vacío.
     """
-    mock_db['subscriptions'].find.return_value = [] 
     metrics_service = MetricsService(mock_db['db'])
     mrr = metrics_service.calculate_mrr()
     assert mrr == 0.0
 
-def test_calculate_mrr_with_monthly_subscriptions(mock_db):
+def test_calculate_mrr_reads_ledger(mock_db):
     """
-    Verifica el cálculo del MRR con suscripciones mensuales activas.
+    Verifica que el MRR se lee del revenue_ledger sin recorrer subscriptions.
     """
-    now = datetime.utcnow() 
-    
-    subscriptions = [
-        create_mock_subscription(ObjectId(), ObjectId(), 100.0, "monthly", now - timedelta(days=5), now + timedelta(days=25)),
-        create_mock_subscription(ObjectId(), ObjectId(), 50.0, "monthly", now - timedelta(days=10), now + timedelta(days=20)),
-    ]
-    mock_db['subscriptions'].find.return_value = iter(subscriptions)
+    mock_db['revenue_ledger'].find_one.return_value = {
+        "_id": "totals", "mrr": 275.004, "active_subscriptions": 3, "active_customers": 3
+    }
     
     metrics_service = MetricsService(mock_db['db'])
     mrr = metrics_service.calculate_mrr()
-    assert mrr == 150.0
+    assert mrr == 275.0
+    mock_db['revenue_ledger'].find_one.assert_called_once_with({"_id": "totals"})
+    mock_db['subscriptions'].find.assert_not_called()
+    mock_db['subscriptions'].aggregate.assert_not_called()
 
-def test_calculate_mrr_with_annual_subscriptions(mock_db): 
+def test_calculate_mrr_as_of_date(mock_db):
     """
-    Verifica el cálculo del MRR con suscripciones anuales activas.
+    Verifica que el MRR a una fecha dada se agrega sobre las suscripciones activas en esa fecha.
     """
-    now = datetime.utcnow()
-    
-    subscriptions = [
-        create_mock_subscription(ObjectId(), ObjectId(), 1200.0, "annually", now - timedelta(days=5), now + timedelta(days=360)), 
-        create_mock_subscription(ObjectId(), ObjectId(), 600.0, "annually", now - timedelta(days=10), now + timedelta(days=350)), 
-    ]
-    mock_db['subscriptions'].find.return_value = iter(subscriptions)
-    
+    as_of = datetime(2024, 3, 1)
+    mock_db['subscriptions'].aggregate.return_value = [{"_id": None, "mrr": 80.0}]
+
     metrics_service = MetricsService(mock_db['db'])
-    mrr = metrics_service.calculate_mrr()
-    assert mrr == 150.0 
+    mrr = metrics_service.calculate_mrr(as_of=as_of)
+
+    assert mrr == 80.0
+    match = mock_db['subscriptions'].aggregate.call_args[0][0][0]["$match"]
+    assert match == {"start_date": {"$lte": as_of}, "expiration_date": {"$gt": as_of}}
 
-def test_calculate_mrr_mixed_subscriptions(mock_db):
+def test_build_periods_monthly(mock_db):
     """
-    Verifica el cálculo del MRR.
+    Verifica la división en periodos mensuales con fin inclusivo.
     """
-    now = datetime.utcnow()
-    
-    subscriptions = [
-        create_mock_subscription(ObjectId(), ObjectId(), 100.0, "monthly", now - timedelta(days=5), now + timedelta(days=25)),
-        create_mock_subscription(ObjectId(), ObjectId(), 1200.0, "annually", now - timedelta(days=10), now + timedelta(days=350)), 
-        create_mock_subscription(ObjectId(), ObjectId(), 75.0, "monthly", now - timedelta(days=2), now + timedelta(days=28)),
+    periods = build_periods(datetime(2024, 1, 15), datetime(2024, 3, 31, 23, 59, 59), "month")
+    assert periods == [
+        (datetime(2024, 1, 15), datetime(2024, 1, 31, 23, 59, 59)),
+        (datetime(2024, 2, 1), datetime(2024, 2, 29, 23, 59, 59)),
+        (datetime(2024, 3, 1), datetime(2024, 3, 31, 23, 59, 59))
     ]
-    mock_db['subscriptions'].find.return_value = iter(subscriptions)
-    
+
+def test_calculate_mrr_series_sweeps_events(mock_db):
+    """
+    Verifica que la serie de MRR refleja altas y expiraciones en el periodo correcto.
+    """
+    mock_db['subscriptions'].find.return_value = [
+        {"start_date": datetime(2023, 12, 1), "expiration_date": datetime(2024, 2, 15), "monthly_amount": 100.0},
+        {"start_date": datetime(2024, 2, 10), "expiration_date": datetime(2025, 1, 1), "monthly_amount": 50.0},
+        {"start_date": datetime(2024, 3, 5), "expiration_date": datetime(2024, 3, 20), "monthly_amount": 10.0},
+    ]
+
     metrics_service = MetricsService(mock_db['db'])
-    mrr = metrics_service.calculate_mrr()
-    assert mrr == 275.0 
+    series = metrics_service.calculate_mrr_series(datetime(2024, 1, 1), datetime(2024, 3, 31, 23, 59, 59), "month")
+
+    assert [point["mrr"] for point in series] == [100.0, 50.0, 50.0]
+    assert series[0]["arr"] == 1200.0
+    mock_db['subscriptions'].find.assert_called_once()
 
 def test_calculate_arr(mock_db):
     """
     Verifica el cálculo del ARR (MRR * 12).
     """
-    now = datetime.utcnow()
-    
-    subscriptions = [
-        create_mock_subscription(ObjectId(), ObjectId(), 100.0, "monthly", now - timedelta(days=5), now + timedelta(days=25)),
-    ]
-    mock_db['subscriptions'].find.return_value = iter(subscriptions)
+    mock_db['revenue_ledger'].find_one.return_value = {"_id": "totals", "mrr": 100.0}
     
     metrics_service = MetricsService(mock_db['db'])
     arr = metrics_service.calculate_arr()
@@ -100,34 +163,36 @@ def test_calculate_arpu_no_active_customers(mock_db):
     """
     Verifica que el ARPU es 0.0 si no hay clientes activos.
     """
-    now = datetime.utcnow()
-    
-    mock_db['subscriptions'].find.return_value = []
-    mock_db['subscriptions'].distinct.return_value = []
+    mock_db['revenue_ledger'].find_one.return_value = {"_id": "totals", "mrr": 0.0, "active_customers": 0}
     metrics_service = MetricsService(mock_db['db'])
     arpu = metrics_service.calculate_arpu()
     assert arpu == 0.0
 
 def test_calculate_arpu_with_active_customers(mock_db): 
     """
-    Verifica el cálculo del ARPU con clientes activos.
+    Verifica el cálculo del ARPU con clientes activos a partir del ledger.
     """
-    now = datetime.utcnow()
-    
-    customer1_id = ObjectId()
-    customer2_id = ObjectId()
-
-    subscriptions = [
-        create_mock_subscription(customer1_id, ObjectId(), 100.0, "monthly", now - timedelta(days=5), now + timedelta(days=25)),
-        create_mock_subscription(customer2_id, ObjectId(), 50.0, "monthly", now - timedelta(days=10), now + timedelta(days=20)),
-        create_mock_subscription(customer1_id, ObjectId(), 20.0, "monthly", now - timedelta(days=1), now + timedelta(days=29)), 
-    ]
-    mock_db['subscriptions'].find.return_value = iter(subscriptions)
-    mock_db['subscriptions'].distinct.return_value = [customer1_id, customer2_id] 
+    mock_db['revenue_ledger'].find_one.return_value = {
+        "_id": "totals", "mrr": 170.0, "active_subscriptions": 3, "active_customers": 2
+    }
     
     metrics_service = MetricsService(mock_db['db'])
     arpu = metrics_service.calculate_arpu()
     assert arpu == 85.0
+    mock_db['subscriptions'].distinct.assert_not_called()
+
+def test_backfill_monthly_amount(mock_db):
+    """
+    Verifica que la migración solo toca suscripciones sin monthly_amount.
+    """
+    mock_db['subscriptions'].update_many.return_value.modified_count = 4
+
+    metrics_service = MetricsService(mock_db['db'])
+    modified = metrics_service.backfill_monthly_amount()
+
+    assert modified == 4
+    query = mock_db['subscriptions'].update_many.call_args[0][0]
+    assert query == {"monthly_amount": {"$exists": False}}
 
 def test_calculate_customer_retention_rate_no_customers_at_start(mock_db):
     """
@@ -164,6 +229,46 @@ def test_calculate_customer_retention_rate_basic(mock_db):
     mock_db['subscriptions'].distinct.side_effect = None
 
 
+def test_calculate_customer_retention_rate_closed_period_from_store(mock_db):
+    """
+    Verifica que un periodo cerrado ya guardado se responde desde metric_results sin consultar subscriptions.
+    """
+    mock_db['metric_results'].find_one.return_value = {"value": 72.5}
+
+    metrics_service = MetricsService(mock_db['db'])
+    crr = metrics_service.calculate_customer_retention_rate(datetime(2024, 1, 1), datetime(2024, 1, 31))
+
+    assert crr == 72.5
+    mock_db['subscriptions'].distinct.assert_not_called()
+
+def test_calculate_churn_rate_closed_period_is_stored(mock_db):
+    """
+    Verifica que el resultado de un periodo cerrado se guarda en metric_results.
+    """
+    mock_db['subscriptions'].distinct.side_effect = [[ObjectId(), ObjectId()], []]
+
+    metrics_service = MetricsService(mock_db['db'])
+    churn_rate = metrics_service.calculate_churn_rate(datetime(2024, 1, 1), datetime(2024, 1, 31))
+
+    assert churn_rate == 100.0
+    stored = mock_db['metric_results'].replace_one.call_args[0][1]
+    assert stored["metric"] == "churn_rate"
+    assert stored["value"] == 100.0
+    mock_db['subscriptions'].distinct.side_effect = None
+
+def test_calculate_churn_rate_open_period_not_stored(mock_db):
+    """
+    Verifica que un periodo que aún no ha terminado no se guarda.
+    """
+    mock_db['subscriptions'].distinct.return_value = []
+    now = datetime.utcnow()
+
+    metrics_service = MetricsService(mock_db['db'])
+    metrics_service.calculate_churn_rate(now - timedelta(days=10), now + timedelta(days=10))
+
+    mock_db['metric_results'].find_one.assert_not_called()
+    mock_db['metric_results'].replace_one.assert_not_called()
+
 def test_calculate_churn_rate_no_customers_at_start(mock_db):
     """
     Verifica que la Tasa de Abandono es 0.0 si no hay clientes al inicio del período.
@@ -197,6 +302,36 @@ def test_calculate_churn_rate_basic(mock_db):
     
     mock_db['subscriptions'].distinct.side_effect = None
 
+def test_calculate_retention_series_matches_single_period(mock_db):
+    """
+    Verifica que la serie reproduce CRR y churn por periodo con un solo recorrido ordenado.
+    """
+    customer1_id = ObjectId("000000000000000000000001")
+    customer2_id = ObjectId("000000000000000000000002")
+    customer3_id = ObjectId("000000000000000000000003")
+
+    mock_db['subscriptions'].find.return_value = [
+        # customer1: activo todo el rango mediante dos suscripciones encadenadas.
+        {"customer_id": customer1_id, "start_date": datetime(2023, 12, 1), "expiration_date": datetime(2024, 1, 20)},
+        {"customer_id": customer1_id, "start_date": datetime(2024, 1, 20), "expiration_date": datetime(2024, 6, 1)},
+        # customer2: activo al inicio de enero, abandona en febrero.
+        {"customer_id": customer2_id, "start_date": datetime(2023, 11, 1), "expiration_date": datetime(2024, 2, 10)},
+        # customer3: nuevo en febrero.
+        {"customer_id": customer3_id, "start_date": datetime(2024, 2, 5), "expiration_date": datetime(2024, 6, 1)},
+    ]
+
+    metrics_service = MetricsService(mock_db['db'])
+    series = metrics_service.calculate_retention_series(
+        datetime(2024, 1, 1), datetime(2024, 2, 29, 23, 59, 59), "month"
+    )
+
+    assert [point["customers_at_start"] for point in series] == [2, 2]
+    assert [point["churn_rate"] for point in series] == [0.0, 50.0]
+    # En enero customer1 tiene un alta (renovación) dentro del periodo, igual que en calculate_customer_retention_rate.
+    assert [point["customer_retention_rate"] for point in series] == [50.0, 50.0]
+    mock_db['subscriptions'].find.assert_called_once()
+    mock_db['subscriptions'].distinct.assert_not_called()
+
 def test_calculate_aov_no_subscriptions(mock_db):
     """
     Verifica que el AOV es 0.0 si no hay suscripciones.
@@ -222,53 +357,174 @@ def test_calculate_rpr_no_customers(mock_db):
     Verifica que el RPR es 0.0 si no hay clientes con suscripciones.
     """
     mock_db['subscriptions'].aggregate.return_value = [] 
-    mock_db['subscriptions'].distinct.return_value = [] 
     metrics_service = MetricsService(mock_db['db'])
     rpr = metrics_service.calculate_rpr()
     assert rpr == 0.0
 
 def test_calculate_rpr_with_repeat_customers(mock_db):
     """
-    Verifica el cálculo del RPR con clientes que repiten compra.
+    Verifica el cálculo del RPR con clientes que repiten compra, sin materializar distinct.
     """
-    customer1_id = ObjectId()
-    customer2_id = ObjectId()
-    customer3_id = ObjectId()
-
-    mock_db['subscriptions'].aggregate.side_effect = [
-        [{"_id": customer1_id, "subscription_count": 2, "repeat_customers": 1}], 
-        [] 
+    mock_db['subscriptions'].aggregate.return_value = [
+        {"_id": None, "total_customers": 3, "repeat_customers": 1}
     ]
-    mock_db['subscriptions'].distinct.return_value = [customer1_id, customer2_id, customer3_id]
     
     metrics_service = MetricsService(mock_db['db'])
     rpr = metrics_service.calculate_rpr()
     assert rpr == 33.33
-    
-    mock_db['subscriptions'].aggregate.side_effect = None 
+    mock_db['subscriptions'].aggregate.assert_called_once()
+    mock_db['subscriptions'].distinct.assert_not_called()
 
 def test_calculate_purchase_frequency_no_subscriptions(mock_db):
     """
     Verifica que la frecuencia de compra es 0.0 si no hay suscripciones.
     """
     mock_db['subscriptions'].aggregate.return_value = []
-    mock_db['subscriptions'].distinct.return_value = []
     metrics_service = MetricsService(mock_db['db'])
     frequency = metrics_service.calculate_purchase_frequency()
     assert frequency == 0.0
 
 def test_calculate_purchase_frequency_with_data(mock_db):
     """
-    Verifica el cálculo de la frecuencia de compra.
+    Verifica el cálculo de la frecuencia de compra con una sola agregación de conteos.
     """
-    customer1_id = ObjectId()
-    customer2_id = ObjectId()
-
     mock_db['subscriptions'].aggregate.return_value = [
-        {"_id": None, "count": 3} 
+        {"_id": None, "total_customers": 2, "total_subscriptions": 3} 
     ]
-    mock_db['subscriptions'].distinct.return_value = [customer1_id, customer2_id] 
     
     metrics_service = MetricsService(mock_db['db'])
     frequency = metrics_service.calculate_purchase_frequency()
     assert frequency == 1.5
+    mock_db['subscriptions'].distinct.assert_not_called()
+
+def test_calculate_purchase_frequency_approximate(mock_db):
+    """
+    Verifica que el modo aproximado lee el sketch HyperLogLog del ledger sin recorrer subscriptions.
+    """
+    customer_ids = [ObjectId() for _ in range(2000)]
+    sketch_update = RevenueLedgerService._sketch_update(customer_ids * 2)._doc
+    mock_db['revenue_ledger'].find_one.return_value = {
+        "_id": "customer_hll",
+        "precision": sketch_update["$setOnInsert"]["precision"],
+        "registers": {field.split(".")[1]: rank for field, rank in sketch_update["$max"].items()}
+    }
+    mock_db['subscriptions'].estimated_document_count.return_value = 4000
+
+    metrics_service = MetricsService(mock_db['db'])
+    frequency = metrics_service.calculate_purchase_frequency(approximate=True)
+
+    assert frequency == pytest.approx(2.0, rel=0.05)
+    mock_db['subscriptions'].aggregate.assert_not_called()
+    mock_db['subscriptions'].find.assert_not_called()
+
+def test_count_distinct_customers_approximate_without_sketch(mock_db):
+    """
+    Verifica que sin sketch guardado el modo aproximado cuenta de forma exacta.
+    """
+    mock_db['revenue_ledger'].find_one.return_value = None
+    mock_db['subscriptions'].aggregate.return_value = [{"customers": 7}]
+
+    metrics_service = MetricsService(mock_db['db'])
+    assert metrics_service.count_distinct_customers(approximate=True) == 7
+
+def test_count_distinct_customers_exact(mock_db):
+    """
+    Verifica que el conteo exacto devuelve solo un entero desde $count.
+    """
+    mock_db['subscriptions'].aggregate.return_value = [{"customers": 42}]
+
+    metrics_service = MetricsService(mock_db['db'])
+    assert metrics_service.count_distinct_customers({"expiration_date": {"$gt": datetime(2024, 1, 1)}}) == 42
+
+    pipeline = mock_db['subscriptions'].aggregate.call_args[0][0]
+    assert pipeline[-1] == {"$count": "customers"}
+
+def test_calculate_summary_all_fields(mock_db):
+    """
+    Verifica que el resumen lee MRR, ARR y ARPU del ledger y calcula el resto con una sola agregación $facet.
+    """
+    mock_db['revenue_ledger'].find_one.return_value = {
+        "_id": "totals", "mrr": 170.0, "active_subscriptions": 3, "active_customers": 2
+    }
+    mock_db['subscriptions'].aggregate.return_value = [{
+        "orders": [{"_id": None, "total_revenue": 300.0, "total_subscriptions": 3}],
+        "customers": [{"_id": None, "total_customers": 3, "repeat_customers": 1, "total_subscriptions": 4}]
+    }]
+
+    metrics_service = MetricsService(mock_db['db'])
+    summary = metrics_service.calculate_summary()
+
+    assert summary == {
+        "mrr": 170.0,
+        "arr": 2040.0,
+        "arpu": 85.0,
+        "aov": 100.0,
+        "rpr": 33.33,
+        "purchase_frequency": 1.33
+    }
+    mock_db['subscriptions'].aggregate.assert_called_once()
+    pipeline = mock_db['subscriptions'].aggregate.call_args[0][0]
+    assert set(pipeline[0]["$facet"]) == {"orders", "customers"}
+    mock_db['subscriptions'].distinct.assert_not_called()
+
+def test_calculate_summary_revenue_fields_from_ledger_only(mock_db):
+    """
+    Verifica que pedir solo MRR, ARR y ARPU no ejecuta ninguna agregación.
+    """
+    mock_db['revenue_ledger'].find_one.return_value = {
+        "_id": "totals", "mrr": 100.0, "active_subscriptions": 2, "active_customers": 4
+    }
+
+    metrics_service = MetricsService(mock_db['db'])
+    summary = metrics_service.calculate_summary(["mrr", "arr", "arpu"])
+
+    assert summary == {"mrr": 100.0, "arr": 1200.0, "arpu": 25.0}
+    mock_db['subscriptions'].aggregate.assert_not_called()
+
+def test_calculate_summary_skips_unused_facets(mock_db):
+    """
+    Verifica que solo se ejecutan las facetas de los campos pedidos.
+    """
+    mock_db['subscriptions'].aggregate.return_value = [{"orders": []}]
+
+    metrics_service = MetricsService(mock_db['db'])
+    summary = metrics_service.calculate_summary(["aov"])
+
+    assert summary == {"aov": 0.0}
+    pipeline = mock_db['subscriptions'].aggregate.call_args[0][0]
+    assert list(pipeline[0]["$facet"].keys()) == ["orders"]
+
+def test_metrics_cache_hit_and_invalidation(mock_db):
+    """
+    Verifica que un resultado se sirve desde la caché y que una escritura lo invalida.
+    """
+    mock_db['subscriptions'].aggregate.return_value = [
+        {"_id": None, "total_revenue": 300.0, "total_subscriptions": 3}
+    ]
+    metrics_service = MetricsService(mock_db['db'])
+
+    assert metrics_service.calculate_aov() == 100.0
+    assert metrics_service.calculate_aov() == 100.0
+    assert mock_db['subscriptions'].aggregate.call_count == 1
+
+    subscriptions_data_version.bump()
+    assert metrics_service.calculate_aov() == 100.0
+    assert mock_db['subscriptions'].aggregate.call_count == 2
+
+    stats = metrics_service.cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+def test_ttl_cache_lru_eviction():
+    """
+    Verifica que la caché desaloja la entrada menos usada recientemente.
+    """
+    cache = TTLCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
@@ -0,0 +1,55 @@
+from bson import ObjectId
+from services.product_catalog import ProductCatalog
+from services.subscription_service import SubscriptionService
+
+def test_catalog_serves_lookups_from_memory(mock_db):
+    """
+    Verifica que el catálogo carga products una vez y resuelve por _id y por nombre sin más consultas.
+    """
+    product_id = ObjectId()
+    mock_db['products'].find.return_value = [{"_id": product_id, "name": "Basic Plan", "price": 10.0}]
+
+    catalog = ProductCatalog(mock_db['db'], staleness_seconds=60)
+    assert catalog.get(str(product_id))["name"] == "Basic Plan"
+    assert catalog.get_by_name("Basic Plan")["_id"] == product_id
+    assert catalog.get(ObjectId()) is None
+    assert catalog.get("invalid") is None
+
+    mock_db['products'].find.assert_called_once()
+    mock_db['catalog_versions'].find_one.assert_called_once()
+    mock_db['products'].find_one.assert_not_called()
+
+def test_catalog_reloads_when_version_changes(mock_db):
+    """
+    Verifica que, pasada la ventana de antigüedad, el catálogo solo recarga si el sello de versión cambió.
+    """
+    first, second = ObjectId(), ObjectId()
+    mock_db['products'].find.return_value = [{"_id": first, "name": "A"}]
+    mock_db['catalog_versions'].find_one.return_value = {"_id": "products", "version": 1}
+
+    catalog = ProductCatalog(mock_db['db'], staleness_seconds=0)
+    assert catalog.get(first) is not None
+    catalog.get(first)
+    assert mock_db['products'].find.call_count == 1
+
+    mock_db['products'].find.return_value = [{"_id": first, "name": "A"}, {"_id": second, "name": "B"}]
+    mock_db['catalog_versions'].find_one.return_value = {"_id": "products", "version": 2}
+    assert catalog.get(second)["name"] == "B"
+    assert mock_db['products'].find.call_count == 2
+
+def test_add_product_bumps_catalog_version(mock_db):
+    """
+    Verifica que añadir un producto publica una nueva versión y el producto queda disponible de inmediato.
+    """
+    product_id = ObjectId()
+    mock_db['products'].insert_one.return_value.inserted_id = product_id
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    subscription_service.product_catalog.get(product_id)
+    mock_db['products'].find.return_value = [{"_id": product_id, "name": "New Plan"}]
+    subscription_service.add_product("New Plan", "Description", False, 10.0, "monthly")
+
+    query, update = mock_db['catalog_versions'].find_one_and_update.call_args[0]
+    assert query == {"_id": "products"}
+    assert update["$inc"] == {"version": 1}
+    assert subscription_service.product_catalog.get(product_id)["name"] == "New Plan"
@@ -0,0 +1,73 @@
+import hashlib
+from datetime import datetime, timedelta
+from bson import ObjectId
+from services.refresh_token_service import RefreshTokenService
+from config import Config
+
+def test_issue_stores_only_digest(mock_db):
+    """
+    Verifica que solo se guarda el SHA-256 del token, con caducidad y familia.
+    """
+    now = datetime(2024, 1, 1)
+    customer_id = ObjectId()
+
+    service = RefreshTokenService(mock_db['db'])
+    token = service.issue(str(customer_id), "a@example.com", now=now)
+
+    stored = mock_db['refresh_tokens'].insert_one.call_args[0][0]
+    assert stored["_id"] == hashlib.sha256(token.encode('utf-8')).digest()
+    assert stored["customer_id"] == customer_id
+    assert isinstance(stored["family_id"], ObjectId)
+    assert stored["expires_at"] == now + timedelta(seconds=Config.JWT_REFRESH_TOKEN_EXPIRES_SECONDS)
+    assert stored["used_at"] is None
+
+def test_rotate_consumes_token_and_keeps_family(mock_db):
+    """
+    Verifica que la rotación marca el token como usado y emite uno nuevo en la misma familia.
+    """
+    now = datetime(2024, 1, 1)
+    family_id = ObjectId()
+    customer_id = ObjectId()
+    mock_db['refresh_tokens'].find_one_and_update.return_value = {
+        "_id": b"digest", "family_id": family_id, "customer_id": customer_id, "email": "a@example.com"
+    }
+
+    service = RefreshTokenService(mock_db['db'])
+    rotated, error = service.rotate("old_token", now=now)
+
+    assert error is None
+    assert rotated["customer_id"] == str(customer_id)
+    query, update = mock_db['refresh_tokens'].find_one_and_update.call_args[0][:2]
+    assert query == {
+        "_id": hashlib.sha256(b"old_token").digest(), "used_at": None, "expires_at": {"$gt": now}
+    }
+    assert update == {"$set": {"used_at": now}}
+    successor = mock_db['refresh_tokens'].insert_one.call_args[0][0]
+    assert successor["family_id"] == family_id
+    assert successor["_id"] == hashlib.sha256(rotated["refresh_token"].encode('utf-8')).digest()
+
+def test_rotate_reused_token_revokes_family(mock_db):
+    """
+    Verifica que reutilizar un token ya consumido revoca toda su familia.
+    """
+    family_id = ObjectId()
+    mock_db['refresh_tokens'].find_one.return_value = {"_id": b"digest", "family_id": family_id}
+
+    service = RefreshTokenService(mock_db['db'])
+    rotated, error = service.rotate("stolen_token")
+
+    assert rotated is None
+    assert "reuse" in error
+    mock_db['refresh_tokens'].delete_many.assert_called_once_with({"family_id": family_id})
+    mock_db['refresh_tokens'].insert_one.assert_not_called()
+
+def test_rotate_unknown_token(mock_db):
+    """
+    Verifica que un token desconocido o caducado no revoca nada.
+    """
+    service = RefreshTokenService(mock_db['db'])
+    rotated, error = service.rotate("unknown_token")
+
+    assert rotated is None
+    assert "Invalid or expired" in error
+    mock_db['refresh_tokens'].delete_many.assert_not_called()
@@ -0,0 +1,105 @@
+import pytest
+from services.revenue_ledger_service import RevenueLedgerService
+from bson import ObjectId
+from datetime import datetime, timedelta
+
+def test_add_subscription_first_for_customer(mock_db):
+    """
+    Verifica que la primera suscripción de un cliente incrementa MRR y clientes activos.
+    """
+    customer_id = ObjectId()
+    mock_db['revenue_ledger'].find_one_and_update.return_value = None
+
+    ledger = RevenueLedgerService(mock_db['db'])
+    ledger.add_subscription(customer_id, 50.0)
+
+    totals_update, sketch_update = mock_db['revenue_ledger'].bulk_write.call_args[0][0]
+    assert totals_update._doc["$inc"] == {"mrr": 50.0, "active_subscriptions": 1, "active_customers": 1}
+    assert sketch_update._filter == {"_id": "customer_hll"}
+    assert list(sketch_update._doc["$max"].values())[0] >= 1
+
+def test_add_subscription_existing_customer(mock_db):
+    """
+    Verifica que una segunda suscripción no vuelve a contar al cliente.
+    """
+    mock_db['revenue_ledger'].find_one_and_update.return_value = {"_id": ObjectId(), "active_subscriptions": 1}
+
+    ledger = RevenueLedgerService(mock_db['db'])
+    ledger.add_subscription(ObjectId(), 10.0)
+
+    totals_update = mock_db['revenue_ledger'].bulk_write.call_args[0][0][0]
+    assert totals_update._doc["$inc"]["active_customers"] == 0
+
+def test_add_subscriptions_batches_ledger_writes(mock_db):
+    """
+    Verifica que sumar varias suscripciones usa un bulk_write por cliente y un único $inc de totales.
+    """
+    first_customer, second_customer = ObjectId(), ObjectId()
+    # Índice 1: segundo cliente; índice 2: el sketch, que no cuenta como cliente nuevo.
+    mock_db['revenue_ledger'].bulk_write.return_value.upserted_ids = {1: second_customer, 2: "customer_hll"}
+
+    ledger = RevenueLedgerService(mock_db['db'])
+    ledger.add_subscriptions([(first_customer, 10.0), (first_customer, 5.0), (second_customer, None)])
+
+    *customer_updates, sketch_update = mock_db['revenue_ledger'].bulk_write.call_args[0][0]
+    assert [operation._doc["$inc"]["active_subscriptions"] for operation in customer_updates] == [2, 1]
+    assert "$max" in sketch_update._doc
+    mock_db['revenue_ledger'].update_one.assert_called_once()
+    totals_update = mock_db['revenue_ledger'].update_one.call_args[0][1]
+    assert totals_update["$inc"] == {"mrr": 15.0, "active_subscriptions": 3, "active_customers": 1}
+
+def test_sweep_expired_removes_from_ledger(mock_db):
+    """
+    Verifica que el barrido resta del ledger las suscripciones expiradas.
+    """
+    customer_id = ObjectId()
+    now = datetime(2024, 6, 1)
+    mock_db['subscriptions'].find.return_value = [
+        {"_id": ObjectId(), "customer_id": customer_id, "monthly_amount": 30.0}
+    ]
+    mock_db['subscriptions'].update_one.return_value.modified_count = 1
+    mock_db['revenue_ledger'].find_one_and_update.return_value = {"_id": customer_id, "active_subscriptions": 0}
+
+    ledger = RevenueLedgerService(mock_db['db'])
+    swept = ledger.sweep_expired(now)
+
+    assert swept == 1
+    mock_db['revenue_ledger'].delete_one.assert_called_once()
+    totals_update = mock_db['revenue_ledger'].update_one.call_args[0][1]
+    assert totals_update["$inc"] == {"mrr": -30.0, "active_subscriptions": -1, "active_customers": -1}
+
+def test_reconcile_reports_drift(mock_db):
+    """
+    Verifica que la reconciliación compara el ledger con el recálculo desde cero.
+    """
+    mock_db['subscriptions'].aggregate.return_value = [
+        {"_id": ObjectId(), "mrr": 100.0, "active_subscriptions": 2},
+        {"_id": ObjectId(), "mrr": 50.0, "active_subscriptions": 1}
+    ]
+    mock_db['revenue_ledger'].find_one.return_value = {
+        "_id": "totals", "mrr": 160.0, "active_subscriptions": 3, "active_customers": 2
+    }
+
+    ledger = RevenueLedgerService(mock_db['db'])
+    report = ledger.reconcile(apply=False)
+
+    assert report["expected"] == {"mrr": 150.0, "active_subscriptions": 3, "active_customers": 2}
+    assert report["drift"] == {"mrr": 10.0, "active_subscriptions": 0, "active_customers": 0}
+    mock_db['revenue_ledger'].replace_one.assert_not_called()
+
+def test_estimate_customers_from_sketch(mock_db):
+    """
+    Verifica que el número de clientes se estima desde el sketch guardado, sin leer subscriptions.
+    """
+    customer_ids = [ObjectId() for _ in range(500)]
+    sketch_update = RevenueLedgerService._sketch_update(customer_ids)._doc
+    mock_db['revenue_ledger'].find_one.return_value = {
+        "_id": "customer_hll",
+        "precision": sketch_update["$setOnInsert"]["precision"],
+        "registers": {field.split(".")[1]: rank for field, rank in sketch_update["$max"].items()}
+    }
+
+    ledger = RevenueLedgerService(mock_db['db'])
+
+    assert ledger.estimate_customers() == pytest.approx(500, rel=0.05)
+    mock_db['subscriptions'].find.assert_not_called()
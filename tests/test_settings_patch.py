@@ -0,0 +1,101 @@
+import pytest
+from utils.settings_patch import JSON_PATCH, MERGE_PATCH, PatchError, apply_merge_patch, to_update
+
+def test_merge_patch_to_dotted_paths():
+    """
+    Verifica que un JSON Merge Patch se traduce a $set/$unset por ruta, recorriendo objetos anidados.
+    """
+    set_fields, unset_fields, conditions = to_update(
+        {"color": "green", "old": None, "size": {"width": 10}}, MERGE_PATCH
+    )
+
+    assert set_fields == {"customization.color": "green", "customization.size.width": 10}
+    assert unset_fields == {"customization.old": ""}
+    assert conditions == {}
+
+def test_json_patch_operations():
+    """
+    Verifica add/replace/remove/test y que replace y remove exigen que la ruta exista.
+    """
+    set_fields, unset_fields, conditions = to_update([
+        {"op": "test", "path": "/color", "value": "red"},
+        {"op": "replace", "path": "/color", "value": "blue"},
+        {"op": "add", "path": "/a~1b", "value": 1},
+        {"op": "remove", "path": "/old"}
+    ], JSON_PATCH)
+
+    assert set_fields == {"customization.color": "blue", "customization.a/b": 1}
+    assert unset_fields == {"customization.old": ""}
+    assert conditions == {"customization.color": {"$eq": "red"}, "customization.old": {"$exists": True}}
+
+def test_json_patch_test_value_is_not_a_query_operator():
+    """
+    Verifica que el valor de un test se compara con $eq y no se interpreta como operador.
+    """
+    _, _, conditions = to_update([
+        {"op": "test", "path": "/a", "value": {"$exists": False}},
+        {"op": "add", "path": "/b", "value": 1}
+    ], JSON_PATCH)
+
+    assert conditions == {"customization.a": {"$eq": {"$exists": False}}}
+
+def test_merge_patch_empty_object_is_a_no_op():
+    """
+    Verifica que un objeto vacío en un merge patch no sustituye el objeto existente.
+    """
+    set_fields, unset_fields, _ = to_update({"size": {}, "color": "green"}, MERGE_PATCH)
+
+    assert set_fields == {"customization.color": "green"}
+    assert unset_fields == {}
+
+def test_apply_merge_patch_replaces_scalars_with_objects():
+    """
+    Verifica el algoritmo de RFC 7396 en memoria, incluida la sustitución de un escalar por un objeto.
+    """
+    target = {"color": "red", "size": {"width": 1, "height": 2}, "old": True}
+    patch = {"color": {"r": 255}, "size": {"height": None}, "old": None}
+
+    assert apply_merge_patch(target, patch) == {"color": {"r": 255}, "size": {"width": 1}}
+    assert apply_merge_patch(None, {"a": {"b": 1}}) == {"a": {"b": 1}}
+
+@pytest.mark.parametrize("patch, patch_format", [
+    ([{"op": "move", "from": "/a", "path": "/b"}], JSON_PATCH),
+    ([{"op": "add", "path": "/list/-", "value": 1}], JSON_PATCH),
+    ([{"op": "add", "path": "/a", "value": 1}, {"op": "test", "path": "/a", "value": 1}], JSON_PATCH),
+    ([{"op": "add", "path": "/a", "value": {}}, {"op": "add", "path": "/a/b", "value": 1}], JSON_PATCH),
+    ({"a.b": 1}, MERGE_PATCH),
+    ({"$where": 1}, MERGE_PATCH),
+    ({}, MERGE_PATCH),
+    ([{"op": "add", "path": "/a", "value": 1}], MERGE_PATCH)
+])
+def test_invalid_patches_rejected(patch, patch_format):
+    """
+    Verifica que se rechazan los patches que no caben en una sola actualización por rutas.
+    """
+    with pytest.raises(PatchError):
+        to_update(patch, patch_format)
+
+def test_json_patch_array_positions_rejected():
+    """
+    Verifica que add/remove sobre una posición de array se rechazan en vez de sobrescribir
+    el elemento o dejar un null.
+    """
+    with pytest.raises(PatchError, match="array positions"):
+        to_update([{"op": "remove", "path": "/tags/0"}], JSON_PATCH)
+    with pytest.raises(PatchError, match="array positions"):
+        to_update([{"op": "add", "path": "/tags/1", "value": "x"}], JSON_PATCH)
+
+    # replace sobre un elemento y rutas dentro de un elemento sí tienen la semántica de RFC 6902.
+    set_fields, unset_fields, _ = to_update([
+        {"op": "replace", "path": "/tags/0", "value": "x"},
+        {"op": "remove", "path": "/items/1/name"}
+    ], JSON_PATCH)
+    assert set_fields == {"customization.tags.0": "x"}
+    assert unset_fields == {"customization.items.1.name": ""}
+
+def test_patch_operation_limit():
+    """
+    Verifica el límite de rutas modificadas por patch.
+    """
+    with pytest.raises(PatchError, match="limit"):
+        to_update({f"key{i}": i for i in range(5)}, MERGE_PATCH, max_operations=4)
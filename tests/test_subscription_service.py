@@ -1,13 +1,14 @@
 import pytest
 from services.subscription_service import SubscriptionService
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError, OperationFailure
 from datetime import datetime, timedelta
 
 def test_add_product_success(mock_db):
     """
     Verifica que se puede añadir un producto exitosamente.
     """
-    mock_db['products'].find_one.return_value = None
+    mock_db['products'].find.return_value = []
     mock_db['products'].insert_one.return_value.inserted_id = ObjectId()
 
     subscription_service = SubscriptionService(mock_db['db'])
@@ -24,7 +25,7 @@ def test_add_product_name_exists(mock_db):
     """
     Verifica que no se puede añadir un producto con un nombre ya existente.
     """
-    mock_db['products'].find_one.return_value = {"name": "Existing Plan"}
+    mock_db['products'].insert_one.side_effect = DuplicateKeyError("E11000 duplicate key error")
 
     subscription_service = SubscriptionService(mock_db['db'])
     product_id, error = subscription_service.add_product(
@@ -33,13 +34,13 @@ def test_add_product_name_exists(mock_db):
 
     assert product_id is None
     assert "Product with this name already exists" in error
-    mock_db['products'].insert_one.assert_not_called()
+    mock_db['products'].find_one.assert_not_called()
 
 def test_add_product_invalid_price(mock_db):
     """
     Verifica que no se puede añadir un producto con un precio inválido.
     """    
-    mock_db['products'].find_one.return_value = None
+    mock_db['products'].find.return_value = []
     subscription_service = SubscriptionService(mock_db['db'])
     product_id, error = subscription_service.add_product(
         "Invalid Price Plan", "Description", False, -10.0, "monthly"
@@ -52,7 +53,7 @@ def test_add_product_invalid_periodicity(mock_db):
     """
     Verifica que no se puede añadir un producto con una periodicidad inválida.
     """
-    mock_db['products'].find_one.return_value = None
+    mock_db['products'].find.return_value = []
     subscription_service = SubscriptionService(mock_db['db'])
     product_id, error = subscription_service.add_product(
         "Invalid Periodicity Plan", "Description", False, 10.0, "weekly"
@@ -69,11 +70,10 @@ def test_subscribe_customer_to_product_success(mock_db):
     product_id = ObjectId()
     
     mock_db['customers'].find_one.return_value = {"_id": customer_id, "email": "test@example.com"}
-    mock_db['products'].find_one.return_value = {
+    mock_db['products'].find.return_value = [{
         "_id": product_id, "name": "Basic Plan", "price": 10.0, "periodicity": "monthly", "customizable": False
-    }
-    mock_db['subscriptions'].find_one.return_value = None
-    mock_db['subscriptions'].insert_one.return_value.inserted_id = ObjectId()
+    }]
+    mock_db['subscriptions'].update_one.return_value.upserted_id = ObjectId()
 
     subscription_service = SubscriptionService(mock_db['db'])
     expiration_date = (datetime.utcnow() + timedelta(days=30)).isoformat()
@@ -84,12 +84,19 @@ def test_subscribe_customer_to_product_success(mock_db):
 
     assert error is None
     assert isinstance(subscription_id, str)
-    mock_db['subscriptions'].insert_one.assert_called_once()
-    inserted_data = mock_db['subscriptions'].insert_one.call_args[0][0]
-    assert inserted_data['customer_id'] == customer_id
-    assert inserted_data['product_id'] == product_id
+    mock_db['subscriptions'].update_one.assert_called_once()
+    query, update = mock_db['subscriptions'].update_one.call_args[0]
+    assert mock_db['subscriptions'].update_one.call_args[1] == {"upsert": True}
+    assert query['customer_id'] == customer_id
+    assert query['product_id'] == product_id
+    assert '$gt' in query['expiration_date']
+    inserted_data = update['$setOnInsert']
     assert inserted_data['price_at_subscription'] == 10.0
     assert inserted_data['periodicity_at_subscription'] == "monthly"
+    assert inserted_data['monthly_amount'] == 10.0
+    assert inserted_data['in_ledger'] is True
+    ledger_totals_update = mock_db['revenue_ledger'].bulk_write.call_args[0][0][0]._doc
+    assert ledger_totals_update['$inc']['mrr'] == 10.0
 
 
 def test_subscribe_customer_to_product_customer_not_found(mock_db):
@@ -98,9 +105,9 @@ def test_subscribe_customer_to_product_customer_not_found(mock_db):
     """
     product_id = ObjectId()
     mock_db['customers'].find_one.return_value = None 
-    mock_db['products'].find_one.return_value = {
+    mock_db['products'].find.return_value = [{
         "_id": product_id, "name": "Basic Plan", "price": 10.0, "periodicity": "monthly", "customizable": False
-    }
+    }]
 
     subscription_service = SubscriptionService(mock_db['db'])
     expiration_date = (datetime.utcnow() + timedelta(days=30)).isoformat()
@@ -110,7 +117,7 @@ def test_subscribe_customer_to_product_customer_not_found(mock_db):
 
     assert subscription_id is None
     assert "Customer not found" in error
-    mock_db['subscriptions'].insert_one.assert_not_called()
+    mock_db['subscriptions'].update_one.assert_not_called()
 
 def test_subscribe_customer_to_product_product_not_found(mock_db):
     """
@@ -118,7 +125,7 @@ def test_subscribe_customer_to_product_product_not_found(mock_db):
     """
     customer_id = ObjectId()
     mock_db['customers'].find_one.return_value = {"_id": customer_id, "email": "test@example.com"}
-    mock_db['products'].find_one.return_value = None 
+    mock_db['products'].find.return_value = []
 
     subscription_service = SubscriptionService(mock_db['db'])
     expiration_date = (datetime.utcnow() + timedelta(days=30)).isoformat()
@@ -128,7 +135,7 @@ def test_subscribe_customer_to_product_product_not_found(mock_db):
 
     assert subscription_id is None
     assert "Product not found" in error
-    mock_db['subscriptions'].insert_one.assert_not_called()
+    mock_db['subscriptions'].update_one.assert_not_called()
 
 def test_subscribe_customer_to_product_already_active_subscription(mock_db):
     """
@@ -138,14 +145,11 @@ def test_subscribe_customer_to_product_already_active_subscription(mock_db):
     product_id = ObjectId()
     
     mock_db['customers'].find_one.return_value = {"_id": customer_id, "email": "test@example.com"}
-    mock_db['products'].find_one.return_value = {
+    mock_db['products'].find.return_value = [{
         "_id": product_id, "name": "Basic Plan", "price": 10.0, "periodicity": "monthly", "customizable": False
-    }
-    mock_db['subscriptions'].find_one.return_value = {
-        "customer_id": customer_id,
-        "product_id": product_id,
-        "expiration_date": datetime.utcnow() + timedelta(days=5) 
-    }
+    }]
+    # El upsert encuentra la suscripción activa existente y no inserta nada.
+    mock_db['subscriptions'].update_one.return_value.upserted_id = None
 
     subscription_service = SubscriptionService(mock_db['db'])
     expiration_date = (datetime.utcnow() + timedelta(days=30)).isoformat()
@@ -155,7 +159,7 @@ def test_subscribe_customer_to_product_already_active_subscription(mock_db):
 
     assert subscription_id is None
     assert "Customer already has an active subscription for this product" in error
-    mock_db['subscriptions'].insert_one.assert_not_called()
+    mock_db['revenue_ledger'].update_one.assert_not_called()
 
 def test_subscribe_customer_to_product_invalid_date_format(mock_db):
     """
@@ -165,9 +169,9 @@ def test_subscribe_customer_to_product_invalid_date_format(mock_db):
     product_id = ObjectId()
     
     mock_db['customers'].find_one.return_value = {"_id": customer_id, "email": "test@example.com"}
-    mock_db['products'].find_one.return_value = {
+    mock_db['products'].find.return_value = [{
         "_id": product_id, "name": "Basic Plan", "price": 10.0, "periodicity": "monthly", "customizable": False
-    }
+    }]
 
     subscription_service = SubscriptionService(mock_db['db'])
     invalid_expiration_date = "invalid-date"
@@ -178,7 +182,7 @@ def test_subscribe_customer_to_product_invalid_date_format(mock_db):
 
     assert subscription_id is None
     assert "Invalid expiration date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)." in error
-    mock_db['subscriptions'].insert_one.assert_not_called()
+    mock_db['subscriptions'].update_one.assert_not_called()
 
 def test_subscribe_customer_to_product_expiration_date_in_past(mock_db):
     """
@@ -188,9 +192,9 @@ def test_subscribe_customer_to_product_expiration_date_in_past(mock_db):
     product_id = ObjectId()
     
     mock_db['customers'].find_one.return_value = {"_id": customer_id, "email": "test@example.com"}
-    mock_db['products'].find_one.return_value = {
+    mock_db['products'].find.return_value = [{
         "_id": product_id, "name": "Basic Plan", "price": 10.0, "periodicity": "monthly", "customizable": False
-    }
+    }]
     mock_db['subscriptions'].find_one.return_value = None
 
     subscription_service = SubscriptionService(mock_db['db'])
@@ -202,7 +206,7 @@ def test_subscribe_customer_to_product_expiration_date_in_past(mock_db):
 
     assert subscription_id is None
     assert "Expiration date cannot be in the past" in error
-    mock_db['subscriptions'].insert_one.assert_not_called()
+    mock_db['subscriptions'].update_one.assert_not_called()
 
 def test_subscribe_customer_to_product_customizable_missing_customization(mock_db):
     """
@@ -212,11 +216,11 @@ def test_subscribe_customer_to_product_customizable_missing_customization(mock_d
     product_id = ObjectId()
     
     mock_db['customers'].find_one.return_value = {"_id": customer_id, "email": "test@example.com"}
-    mock_db['products'].find_one.return_value = {
+    mock_db['products'].find.return_value = [{
         "_id": product_id, "name": "Customizable Plan", "price": 20.0, "periodicity": "monthly", "customizable": True
-    }
+    }]
     mock_db['subscriptions'].find_one.return_value = None
-    mock_db['subscriptions'].insert_one.return_value.inserted_id = ObjectId()
+    mock_db['subscriptions'].update_one.return_value.upserted_id = ObjectId()
 
     subscription_service = SubscriptionService(mock_db['db'])
     expiration_date = (datetime.utcnow() + timedelta(days=30)).isoformat()
@@ -227,7 +231,7 @@ def test_subscribe_customer_to_product_customizable_missing_customization(mock_d
 
     assert subscription_id is None
     assert "Product is customizable, but no customization data provided" in error
-    mock_db['subscriptions'].insert_one.assert_not_called()
+    mock_db['subscriptions'].update_one.assert_not_called()
 
 def test_subscribe_customer_to_product_non_customizable_with_customization(mock_db):
     """
@@ -237,11 +241,11 @@ def test_subscribe_customer_to_product_non_customizable_with_customization(mock_
     product_id = ObjectId()
     
     mock_db['customers'].find_one.return_value = {"_id": customer_id, "email": "test@example.com"}
-    mock_db['products'].find_one.return_value = {
+    mock_db['products'].find.return_value = [{
         "_id": product_id, "name": "Non-Customizable Plan", "price": 10.0, "periodicity": "monthly", "customizable": False
-    }
+    }]
     mock_db['subscriptions'].find_one.return_value = None
-    mock_db['subscriptions'].insert_one.return_value.inserted_id = ObjectId()
+    mock_db['subscriptions'].update_one.return_value.upserted_id = ObjectId()
 
     subscription_service = SubscriptionService(mock_db['db'])
     expiration_date = (datetime.utcnow() + timedelta(days=30)).isoformat()
@@ -252,7 +256,69 @@ def test_subscribe_customer_to_product_non_customizable_with_customization(mock_
 
     assert subscription_id is None
     assert "Product is not customizable, but customization data was provided" in error
-    mock_db['subscriptions'].insert_one.assert_not_called()
+    mock_db['subscriptions'].update_one.assert_not_called()
+
+def test_subscribe_many_resolves_batch_with_in_queries(mock_db):
+    """
+    Verifica que un lote se valida con una consulta $in de clientes y otra de suscripciones activas
+    y se escribe con un único insert_many, con un resultado por item.
+    """
+    customer_id = ObjectId()
+    other_customer_id = ObjectId()
+    product_id = ObjectId()
+    expiration = (datetime.utcnow() + timedelta(days=30)).isoformat()
+    mock_db['products'].find.return_value = [
+        {"_id": product_id, "customizable": False, "price": 10.0, "periodicity": "monthly"}
+    ]
+    mock_db['customers'].find.return_value = [{"_id": customer_id}]
+    mock_db['subscriptions'].find.return_value = []
+    mock_db['revenue_ledger'].bulk_write.return_value.upserted_ids = {0: customer_id}
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    results = subscription_service.subscribe_many([
+        {"customer_id": str(customer_id), "product_id": str(product_id), "expiration_date": expiration},
+        {"customer_id": str(customer_id), "product_id": str(product_id), "expiration_date": expiration},
+        {"customer_id": str(other_customer_id), "product_id": str(product_id), "expiration_date": expiration},
+        {"customer_id": str(customer_id), "product_id": str(ObjectId()), "expiration_date": expiration},
+        {"customer_id": "invalid", "product_id": str(product_id), "expiration_date": expiration}
+    ])
+
+    assert [result["status"] for result in results] == ["created", "duplicate", "not_found", "not_found", "invalid"]
+    assert results[2]["error"] == "Customer not found"
+    assert results[3]["error"] == "Product not found"
+    customers_query = mock_db['customers'].find.call_args[0][0]
+    assert set(customers_query["_id"]["$in"]) == {customer_id, other_customer_id}
+    mock_db['subscriptions'].find.assert_called_once()
+    inserted = mock_db['subscriptions'].insert_many.call_args[0][0]
+    assert len(inserted) == 1
+    assert results[0]["subscription_id"] == str(inserted[0]["_id"])
+    assert mock_db['subscriptions'].insert_many.call_args[1] == {"ordered": False}
+    mock_db['subscriptions'].update_one.assert_not_called()
+    mock_db['revenue_ledger'].bulk_write.assert_called_once()
+
+def test_subscribe_many_skips_existing_active_and_foreign_items(mock_db):
+    """
+    Verifica que con customer_id_str solo se aceptan items de ese cliente y que las suscripciones
+    activas existentes se informan como duplicadas sin leer customers.
+    """
+    customer_id = ObjectId()
+    product_id = ObjectId()
+    expiration = (datetime.utcnow() + timedelta(days=30)).isoformat()
+    mock_db['products'].find.return_value = [
+        {"_id": product_id, "customizable": False, "price": 10.0, "periodicity": "monthly"}
+    ]
+    mock_db['subscriptions'].find.return_value = [{"customer_id": customer_id, "product_id": product_id}]
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    results = subscription_service.subscribe_many([
+        {"customer_id": str(customer_id), "product_id": str(product_id), "expiration_date": expiration},
+        {"customer_id": str(ObjectId()), "product_id": str(product_id), "expiration_date": expiration}
+    ], customer_id_str=str(customer_id), customer_verified=True)
+
+    assert [result["status"] for result in results] == ["duplicate", "forbidden"]
+    mock_db['customers'].find.assert_not_called()
+    mock_db['subscriptions'].insert_many.assert_not_called()
+    mock_db['revenue_ledger'].bulk_write.assert_not_called()
 
 def test_get_subscription_status_active(mock_db):
     """
@@ -306,13 +372,14 @@ def test_get_subscription_settings_success(mock_db):
     Verifica que se pueden obtener las configuraciones de una suscripción personalizable.
     """
     subscription_id = ObjectId()
+    product_id = ObjectId()
     customization_data = {"color": "red", "size": "large"}
     mock_db['subscriptions'].find_one.return_value = {
         "_id": subscription_id,
         "customization": customization_data,
-        "product_id": ObjectId() 
+        "product_id": product_id 
     }
-    mock_db['products'].find_one.return_value = {"customizable": True} 
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}] 
 
     subscription_service = SubscriptionService(mock_db['db'])
     settings, error = subscription_service.get_subscription_settings(str(subscription_id))
@@ -324,12 +391,13 @@ def test_get_subscription_settings_not_customizable(mock_db):
     Verifica que obtener configuraciones de una suscripción no personalizable devuelve un diccionario vacío.
     """
     subscription_id = ObjectId()
+    product_id = ObjectId()
     mock_db['subscriptions'].find_one.return_value = {
         "_id": subscription_id,
         "customization": None, 
-        "product_id": ObjectId()
+        "product_id": product_id
     }
-    mock_db['products'].find_one.return_value = {"customizable": False} 
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": False}] 
 
     subscription_service = SubscriptionService(mock_db['db'])
     settings, error = subscription_service.get_subscription_settings(str(subscription_id))
@@ -348,44 +416,48 @@ def test_get_subscription_settings_not_found(mock_db):
 
 def test_edit_subscription_settings_success(mock_db):
     """
-    Verifica que se pueden editar las configuraciones de una suscripción personalizable.
+    Verifica que se pueden editar las configuraciones de una suscripción personalizable en una sola operación.
     """
     subscription_id = ObjectId()
-    initial_customization = {"color": "red"}
+    product_id = ObjectId()
+    customer_id = ObjectId()
     new_settings = {"size": "large"}
     
-    mock_db['subscriptions'].find_one.return_value = {
-        "_id": subscription_id,
-        "customization": initial_customization,
-        "product_id": ObjectId()
-    }
-    mock_db['products'].find_one.return_value = {"customizable": True}
-    mock_db['subscriptions'].update_one.return_value.modified_count = 1
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
+    mock_db['subscriptions'].find_one_and_update.return_value = {"_id": subscription_id}
 
     subscription_service = SubscriptionService(mock_db['db'])
-    success, error = subscription_service.edit_subscription_settings(str(subscription_id), new_settings)
+    success, error = subscription_service.edit_subscription_settings(
+        str(subscription_id), new_settings, customer_id_str=str(customer_id)
+    )
     
     assert success is True
     assert error is None
-    mock_db['subscriptions'].update_one.assert_called_once()
-    assert mock_db['subscriptions'].update_one.call_args[0][1]['$set']['customization'] == new_settings
+    query, update = mock_db['subscriptions'].find_one_and_update.call_args[0][:2]
+    assert query["_id"] == subscription_id
+    assert query["customer_id"] == customer_id
+    assert query["product_id"] == {"$in": [product_id]}
+    assert query["customization"] == {"$ne": new_settings}
+    assert update["$set"]["customization"] == new_settings
+    assert update["$inc"] == {"version": 1}
+    mock_db['subscriptions'].find_one.assert_not_called()
 
 def test_edit_subscription_settings_already_up_to_date(mock_db):
     """
     Verifica que no se actualiza si las configuraciones ya están al día.
     """
     subscription_id = ObjectId()
+    product_id = ObjectId()
     current_customization = {"color": "red", "size": "large"}
     new_settings = {"size": "large", "color": "red"}
 
+    mock_db['subscriptions'].find_one_and_update.return_value = None
     mock_db['subscriptions'].find_one.return_value = {
         "_id": subscription_id,
         "customization": current_customization,
-        "product_id": ObjectId()
+        "product_id": product_id
     }
-    mock_db['products'].find_one.return_value = {"customizable": True}
-    mock_db['subscriptions'].update_one.return_value.modified_count = 0 
-    mock_db['subscriptions'].update_one.return_value.matched_count = 1 
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
 
     subscription_service = SubscriptionService(mock_db['db'])
     success, error = subscription_service.edit_subscription_settings(str(subscription_id), new_settings)
@@ -398,42 +470,228 @@ def test_edit_subscription_settings_not_customizable(mock_db):
     Verifica que no se pueden editar las configuraciones de una suscripción no personalizable.
     """
     subscription_id = ObjectId()
+    product_id = ObjectId()
+    mock_db['subscriptions'].find_one_and_update.return_value = None
     mock_db['subscriptions'].find_one.return_value = {
         "_id": subscription_id,
         "customization": None,
-        "product_id": ObjectId()
+        "product_id": product_id
     }
-    mock_db['products'].find_one.return_value = {"customizable": False}
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": False}]
 
     subscription_service = SubscriptionService(mock_db['db'])
     success, error = subscription_service.edit_subscription_settings(str(subscription_id), {"color": "blue"})
     
     assert success is False
     assert "Product associated with this subscription is not customizable" in error
-    mock_db['subscriptions'].update_one.assert_not_called()
+    query = mock_db['subscriptions'].find_one_and_update.call_args[0][0]
+    assert query["product_id"] == {"$in": []}
+
+def test_edit_subscription_settings_not_owner(mock_db):
+    """
+    Verifica que un cliente no puede editar la suscripción de otro.
+    """
+    subscription_id = ObjectId()
+    mock_db['subscriptions'].find_one_and_update.return_value = None
+    mock_db['subscriptions'].find_one.return_value = {
+        "_id": subscription_id,
+        "customer_id": ObjectId(),
+        "product_id": ObjectId()
+    }
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    success, error = subscription_service.edit_subscription_settings(
+        str(subscription_id), {"color": "blue"}, customer_id_str=str(ObjectId())
+    )
+
+    assert success is False
+    assert "not authorized" in error
+
+def test_edit_subscription_settings_version_conflict(mock_db):
+    """
+    Verifica que una versión esperada desactualizada se detecta como modificación concurrente.
+    """
+    subscription_id = ObjectId()
+    product_id = ObjectId()
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
+    mock_db['subscriptions'].find_one_and_update.return_value = None
+    mock_db['subscriptions'].find_one.return_value = {
+        "_id": subscription_id,
+        "product_id": product_id,
+        "customization": {"color": "red"},
+        "version": 3
+    }
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    success, error = subscription_service.edit_subscription_settings(
+        str(subscription_id), {"color": "blue"}, expected_version=2
+    )
+
+    assert success is False
+    assert "modified concurrently" in error
+    assert mock_db['subscriptions'].find_one_and_update.call_args[0][0]["version"] == 2
+
+def test_edit_subscription_settings_version_zero_matches_legacy(mock_db):
+    """
+    Verifica que la versión 0 también acepta suscripciones creadas antes del campo version.
+    """
+    product_id = ObjectId()
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
+    mock_db['subscriptions'].find_one_and_update.return_value = {"_id": ObjectId()}
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    success, _ = subscription_service.edit_subscription_settings(
+        str(ObjectId()), {"color": "blue"}, expected_version=0
+    )
+
+    assert success is True
+    assert mock_db['subscriptions'].find_one_and_update.call_args[0][0]["version"] == {"$in": [0, None]}
+
+def test_patch_subscription_settings_targeted_update(mock_db):
+    """
+    Verifica que un merge patch actualiza solo las rutas indicadas y retorna la nueva versión.
+    """
+    subscription_id = ObjectId()
+    product_id = ObjectId()
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
+    mock_db['subscriptions'].find_one_and_update.return_value = {"_id": subscription_id, "version": 4}
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    version, error = subscription_service.patch_subscription_settings(
+        str(subscription_id), {"color": "green", "old": None}, "merge", expected_version=3
+    )
+
+    assert error is None
+    assert version == 4
+    query, update = mock_db['subscriptions'].find_one_and_update.call_args[0][:2]
+    assert query["version"] == 3
+    assert query["product_id"] == {"$in": [product_id]}
+    assert update["$set"]["customization.color"] == "green"
+    assert "customization" not in update["$set"]
+    assert update["$unset"] == {"customization.old": ""}
+    assert update["$inc"] == {"version": 1}
+
+def test_patch_subscription_settings_failed_test_operation(mock_db):
+    """
+    Verifica que un test de JSON Patch que no se cumple no modifica nada y se informa como conflicto.
+    """
+    subscription_id = ObjectId()
+    product_id = ObjectId()
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
+    mock_db['subscriptions'].find_one_and_update.return_value = None
+    mock_db['subscriptions'].find_one.return_value = {
+        "_id": subscription_id,
+        "product_id": product_id,
+        "customization": {"color": "red"}
+    }
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    version, error = subscription_service.patch_subscription_settings(
+        str(subscription_id),
+        [{"op": "test", "path": "/color", "value": "blue"}, {"op": "replace", "path": "/color", "value": "green"}],
+        "json-patch"
+    )
+
+    assert version is None
+    assert "cannot be applied" in error
+    assert mock_db['subscriptions'].find_one_and_update.call_args[0][0]["customization.color"] == {"$eq": "blue"}
+
+def test_patch_subscription_settings_scalar_to_object_fallback(mock_db):
+    """
+    Verifica que si MongoDB no puede aplicar las rutas (un escalar pasa a ser objeto) el merge patch
+    se aplica en memoria y se reescribe condicionado a la versión leída.
+    """
+    subscription_id = ObjectId()
+    product_id = ObjectId()
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
+    mock_db['subscriptions'].find_one_and_update.side_effect = [
+        OperationFailure("Cannot create field 'r' in element {color: \"red\"}"),
+        {"_id": subscription_id, "version": 3}
+    ]
+    mock_db['subscriptions'].find_one.return_value = {
+        "_id": subscription_id,
+        "product_id": product_id,
+        "customization": {"color": "red", "size": "L"},
+        "version": 2
+    }
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    version, error = subscription_service.patch_subscription_settings(
+        str(subscription_id), {"color": {"r": 255}}, "merge"
+    )
+
+    assert error is None
+    assert version == 3
+    query, update = mock_db['subscriptions'].find_one_and_update.call_args[0][:2]
+    assert query == {"_id": subscription_id, "version": 2}
+    assert update["$set"]["customization"] == {"color": {"r": 255}, "size": "L"}
+
+def test_patch_subscription_settings_invalid_patch(mock_db):
+    """
+    Verifica que un patch inválido se rechaza sin consultar MongoDB.
+    """
+    subscription_service = SubscriptionService(mock_db['db'])
+    version, error = subscription_service.patch_subscription_settings(
+        str(ObjectId()), [{"op": "copy", "from": "/a", "path": "/b"}], "json-patch"
+    )
+
+    assert version is None
+    assert error.startswith("Invalid patch")
+    mock_db['subscriptions'].find_one_and_update.assert_not_called()
 
 def test_extend_subscription_success(mock_db):
     """
-    Verifica que se puede extender la fecha de expiración de una suscripción.
+    Verifica que se puede extender la fecha de expiración de una suscripción en una sola operación.
     """
     subscription_id = ObjectId()
+    customer_id = ObjectId()
     old_expiration = datetime.utcnow() + timedelta(days=10)
     new_expiration = old_expiration + timedelta(days=30)
     
-    mock_db['subscriptions'].find_one.return_value = {
+    mock_db['subscriptions'].find_one_and_update.return_value = {
         "_id": subscription_id,
-        "expiration_date": old_expiration
+        "customer_id": customer_id,
+        "expiration_date": old_expiration,
+        "in_ledger": True
     }
-    mock_db['subscriptions'].update_one.return_value.modified_count = 1
 
     subscription_service = SubscriptionService(mock_db['db'])
-    success, error = subscription_service.extend_subscription(str(subscription_id), new_expiration.isoformat())
+    success, error = subscription_service.extend_subscription(
+        str(subscription_id), new_expiration.isoformat(), customer_id_str=str(customer_id)
+    )
     
     assert success is True
     assert error is None
-    mock_db['subscriptions'].update_one.assert_called_once()
-    updated_date = mock_db['subscriptions'].update_one.call_args[0][1]['$set']['expiration_date']
-    assert int(updated_date.timestamp()) == int(new_expiration.timestamp())
+    query, update = mock_db['subscriptions'].find_one_and_update.call_args[0][:2]
+    assert query["customer_id"] == customer_id
+    assert int(query["expiration_date"]["$lt"].timestamp()) == int(new_expiration.timestamp())
+    assert update["$inc"] == {"version": 1}
+    assert int(update["$set"]["expiration_date"].timestamp()) == int(new_expiration.timestamp())
+    mock_db['subscriptions'].find_one.assert_not_called()
+    mock_db['metric_results'].delete_many.assert_not_called()
+
+def test_extend_expired_subscription_invalidates_stored_periods(mock_db):
+    """
+    Verifica que extender una suscripción expirada invalida los resultados guardados que cubren esas fechas.
+    """
+    subscription_id = ObjectId()
+    old_expiration = datetime.utcnow() - timedelta(days=40)
+    new_expiration = datetime.utcnow() + timedelta(days=30)
+
+    mock_db['subscriptions'].find_one_and_update.return_value = {
+        "_id": subscription_id,
+        "customer_id": ObjectId(),
+        "expiration_date": old_expiration,
+        "in_ledger": True
+    }
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    success, error = subscription_service.extend_subscription(str(subscription_id), new_expiration.isoformat())
+
+    assert success is True
+    query = mock_db['metric_results'].delete_many.call_args[0][0]
+    assert query["period_end"] == {"$gte": old_expiration}
+    assert int(query["period_start"]["$lte"].timestamp()) == int(new_expiration.timestamp())
 
 def test_extend_subscription_already_extended(mock_db):
     """
@@ -443,11 +701,11 @@ def test_extend_subscription_already_extended(mock_db):
     current_expiration = datetime.utcnow() + timedelta(days=30)
     new_expiration = current_expiration - timedelta(days=5)
     
+    mock_db['subscriptions'].find_one_and_update.return_value = None
     mock_db['subscriptions'].find_one.return_value = {
         "_id": subscription_id,
         "expiration_date": current_expiration
     }
-    mock_db['subscriptions'].update_one.return_value.modified_count = 0 
 
     subscription_service = SubscriptionService(mock_db['db'])
     success, error = subscription_service.extend_subscription(str(subscription_id), new_expiration.isoformat())
@@ -456,6 +714,27 @@ def test_extend_subscription_already_extended(mock_db):
     assert "Subscription expiration date already set to this value or later" in error
     mock_db['subscriptions'].update_one.assert_not_called() 
 
+def test_extend_subscription_version_conflict(mock_db):
+    """
+    Verifica que extender con una versión esperada desactualizada se detecta como modificación concurrente.
+    """
+    subscription_id = ObjectId()
+    mock_db['subscriptions'].find_one_and_update.return_value = None
+    mock_db['subscriptions'].find_one.return_value = {
+        "_id": subscription_id,
+        "expiration_date": datetime.utcnow() + timedelta(days=10),
+        "version": 5
+    }
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    new_expiration = datetime.utcnow() + timedelta(days=60)
+    success, error = subscription_service.extend_subscription(
+        str(subscription_id), new_expiration.isoformat(), expected_version=4
+    )
+
+    assert success is False
+    assert "modified concurrently" in error
+
 def test_extend_subscription_invalid_date_format(mock_db):
     """
     Verifica que la extensión falla con un formato de fecha inválido.
@@ -521,3 +800,74 @@ def test_get_subscription_by_id_invalid_id(mock_db):
     subscription_service = SubscriptionService(mock_db['db'])
     subscription = subscription_service.get_subscription_by_id("invalid_id")
     assert subscription is None
+
+def test_subscribe_fast_path_skips_customer_and_cached_product_reads(mock_db):
+    """
+    Verifica que con el cliente ya verificado y el producto en el catálogo la suscripción es una sola escritura.
+    """
+    customer_id = ObjectId()
+    product_id = ObjectId()
+    mock_db['products'].find.return_value = [{
+        "_id": product_id, "name": "Basic Plan", "price": 10.0, "periodicity": "monthly", "customizable": False
+    }]
+    mock_db['subscriptions'].update_one.return_value.upserted_id = ObjectId()
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    expiration_date = (datetime.utcnow() + timedelta(days=30)).isoformat()
+    for _ in range(2):
+        subscription_id, error = subscription_service.subscribe_customer_to_product(
+            str(customer_id), str(product_id), expiration_date, None, customer_verified=True
+        )
+        assert error is None
+
+    mock_db['customers'].find_one.assert_not_called()
+    mock_db['products'].find.assert_called_once()
+    mock_db['products'].find_one.assert_not_called()
+    mock_db['subscriptions'].find_one.assert_not_called()
+    assert mock_db['subscriptions'].update_one.call_count == 2
+
+def test_subscription_loaded_once_per_request(mock_db):
+    """
+    Verifica que dentro de una petición la comprobación de propiedad y el método de servicio comparten una sola lectura.
+    """
+    from flask import Flask
+    from utils.identity_map import query_counts
+    subscription_id = ObjectId()
+    product_id = ObjectId()
+    mock_db['subscriptions'].find_one.return_value = {
+        "_id": subscription_id,
+        "customization": {"color": "red"},
+        "product_id": product_id
+    }
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    with Flask(__name__).test_request_context():
+        subscription_service.get_subscription_by_id(str(subscription_id))
+        settings, error = subscription_service.get_subscription_settings(str(subscription_id))
+
+        assert settings == {"color": "red"}
+        assert query_counts() == {"subscriptions": 1}
+    mock_db['subscriptions'].find_one.assert_called_once()
+
+def test_identity_map_forgets_modified_subscription(mock_db):
+    """
+    Verifica que tras editar una suscripción la siguiente lectura en la misma petición vuelve a MongoDB.
+    """
+    from flask import Flask
+    subscription_id = ObjectId()
+    product_id = ObjectId()
+    mock_db['subscriptions'].find_one.return_value = {
+        "_id": subscription_id,
+        "customization": {"color": "red"},
+        "product_id": product_id
+    }
+    mock_db['products'].find.return_value = [{"_id": product_id, "customizable": True}]
+    mock_db['subscriptions'].find_one_and_update.return_value = {"_id": subscription_id}
+
+    subscription_service = SubscriptionService(mock_db['db'])
+    with Flask(__name__).test_request_context():
+        subscription_service.get_subscription_by_id(str(subscription_id))
+        subscription_service.edit_subscription_settings(str(subscription_id), {"color": "blue"})
+        subscription_service.get_subscription_by_id(str(subscription_id))
+    assert mock_db['subscriptions'].find_one.call_count == 2
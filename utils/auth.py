@@ -1,8 +1,37 @@
+import hashlib
+import time
 import jwt
 from flask import request, jsonify, current_app
 from functools import wraps
 from config import Config
 from services.auth_service import AuthService 
+from utils.cache import TTLCache
+from utils.jwt_keys import get_verifier
+
+# Payloads ya verificados, por SHA-256 del token; cada entrada caduca en el exp del token.
+decoded_tokens = None
+if Config.JWT_DECODE_CACHE_MAX_ENTRIES > 0:
+    decoded_tokens = TTLCache(Config.JWT_DECODE_CACHE_MAX_ENTRIES, Config.JWT_ACCESS_TOKEN_EXPIRES_SECONDS)
+
+def decode_token(token):
+    """
+    Verifica y decodifica un JWT (KeyRing local o JWKS remoto). Un token repetido se sirve desde la
+    caché sin volver a comprobar la firma ni parsear el JSON; lanza las mismas excepciones que jwt.decode.
+    """
+    if decoded_tokens is None:
+        return get_verifier().decode(token)
+
+    key = hashlib.sha256(token.encode('utf-8')).digest()
+    payload = decoded_tokens.get(key)
+    if payload is not None:
+        return payload
+
+    payload = get_verifier().decode(token)
+    expires_at = payload.get('exp')
+    ttl_seconds = expires_at - time.time() if expires_at is not None else None
+    if ttl_seconds is None or ttl_seconds > 0:
+        decoded_tokens.set(key, payload, ttl_seconds)
+    return payload
 
 def jwt_required(f):
     @wraps(f)
@@ -21,14 +50,14 @@ def jwt_required(f):
             return jsonify({"error": "Unsupported authorization type"}), 401
 
         try:
-            payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=["HS256"])
+            payload = decode_token(token)
             
             user_id = payload.get('sub')
             
             
             auth_service = current_app.auth_service 
             
-            if not user_id or not auth_service.get_customer_by_id(user_id):
+            if not user_id or not auth_service.customer_exists(user_id):
                 return jsonify({"error": "User specified in token not found"}), 401
 
             kwargs['current_user_id'] = user_id 
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+_MISSING = object()
+
+class TTLCache:
+    """
+    Caché en memoria con expiración por entrada (TTL) y desalojo LRU.
+    Es segura entre hilos y lleva contadores de aciertos y fallos.
+    """
+    def __init__(self, max_entries=256, ttl_seconds=30):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl_seconds=None):
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds
+            }
+
+class DataVersion:
+    """
+    Contador de versión de datos. Las escrituras lo incrementan y las entradas de caché
+    creadas con una versión anterior dejan de ser alcanzables.
+    """
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    def bump(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
+# Versión de la colección subscriptions dentro de este proceso.
+subscriptions_data_version = DataVersion()
+
+def _freeze(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+def cached_result(data_version):
+    """
+    Decorador para métodos de servicios con atributo cache (TTLCache o None).
+    La clave incluye el método, sus argumentos y la versión de datos actual.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, "cache", None)
+            if cache is None:
+                return method(self, *args, **kwargs)
+
+            key = (method.__name__, data_version.value, _freeze(args), _freeze(kwargs))
+            result = cache.get(key, _MISSING)
+            if result is _MISSING:
+                result = method(self, *args, **kwargs)
+                cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,57 @@
+import hashlib
+import math
+
+class HyperLogLog:
+    """
+    Estimador de cardinalidad HyperLogLog.
+    error_rate es el error estándar relativo deseado (1.04 / sqrt(m)); la memoria es de m bytes.
+    """
+    def __init__(self, error_rate=0.01, precision=None):
+        if precision is None:
+            if not 0 < error_rate < 1:
+                raise ValueError("error_rate must be between 0 and 1")
+            precision = math.ceil(math.log2((1.04 / error_rate) ** 2))
+        self.precision = min(max(precision, 4), 18)
+        self.num_registers = 1 << self.precision
+        self.registers = bytearray(self.num_registers)
+
+    @classmethod
+    def from_registers(cls, precision, registers):
+        """
+        Reconstruye un estimador desde registros guardados ({índice: rango}, índices int o str).
+        """
+        estimator = cls(precision=precision)
+        for index, rank in registers.items():
+            estimator.registers[int(index)] = rank
+        return estimator
+
+    def position(self, value):
+        """
+        Retorna (índice de registro, rango) de value, para mantener los registros fuera de memoria (p. ej. con $max).
+        """
+        if not isinstance(value, bytes):
+            value = str(value).encode("utf-8")
+        hashed = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        remainder = hashed & ((1 << remaining_bits) - 1)
+        return index, remaining_bits - remainder.bit_length() + 1
+
+    def add(self, value):
+        index, rank = self.position(value)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = self.num_registers
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+
+        zero_registers = self.registers.count(0)
+        if estimate <= 2.5 * m and zero_registers:
+            # Corrección para cardinalidades pequeñas (linear counting).
+            estimate = m * math.log(m / zero_registers)
+        return int(round(estimate))
@@ -0,0 +1,43 @@
+from flask import g, has_request_context
+
+def _request_state():
+    """
+    Estado de la petición actual en flask.g, o None fuera de una petición (CLI, tests de servicios).
+    """
+    if not has_request_context():
+        return None
+    if "identity_map" not in g:
+        g.identity_map = {}
+        g.query_counts = {}
+    return g
+
+def load_one(collection, collection_name, document_id):
+    """
+    Carga un documento por _id como mucho una vez por petición.
+    Los siguientes accesos al mismo (colección, _id) se sirven desde el identity map, también si no existe.
+    """
+    state = _request_state()
+    key = (collection_name, document_id)
+    if state is not None and key in state.identity_map:
+        return state.identity_map[key]
+
+    document = collection.find_one({"_id": document_id})
+    if state is not None:
+        state.identity_map[key] = document
+        state.query_counts[collection_name] = state.query_counts.get(collection_name, 0) + 1
+    return document
+
+def forget(collection_name, document_id):
+    """
+    Descarta un documento del identity map; debe llamarse tras modificarlo.
+    """
+    state = _request_state()
+    if state is not None:
+        state.identity_map.pop((collection_name, document_id), None)
+
+def query_counts():
+    """
+    Lecturas por colección hechas a través del identity map en la petición actual.
+    """
+    state = _request_state()
+    return dict(state.query_counts) if state is not None else {}
@@ -0,0 +1,145 @@
+import os
+import jwt
+from jwt.algorithms import get_default_algorithms
+from config import Config
+
+ASYMMETRIC_ALGORITHMS = ("EdDSA", "RS256")
+
+class KeyRing:
+    """
+    Claves de firma de JWT.
+    Con HS256 se usa Config.JWT_SECRET_KEY. Con EdDSA/RS256 cada fichero <kid>.pem de keys_dir
+    es una clave privada; se firma con active_kid (por defecto, el kid mayor en orden alfabético)
+    y se verifica con cualquiera de ellas, de modo que las claves retiradas siguen validando
+    los tokens emitidos hasta que se borra su fichero.
+    """
+    def __init__(self, algorithm="HS256", keys_dir=None, active_kid=None):
+        self.algorithm = algorithm
+        self.private_keys = {}
+        self.active_kid = None
+        if algorithm in ASYMMETRIC_ALGORITHMS:
+            self.private_keys = self._load_private_keys(keys_dir)
+            if not self.private_keys:
+                raise ValueError(f"No signing keys found in {keys_dir}")
+            self.active_kid = active_kid or max(self.private_keys)
+            if self.active_kid not in self.private_keys:
+                raise ValueError(f"Active key '{self.active_kid}' not found in {keys_dir}")
+        self.public_keys = {kid: key.public_key() for kid, key in self.private_keys.items()}
+
+    @classmethod
+    def from_config(cls):
+        return cls(Config.JWT_ALGORITHM, Config.JWT_KEYS_DIR, Config.JWT_ACTIVE_KID or None)
+
+    @staticmethod
+    def _load_private_keys(keys_dir):
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+        keys = {}
+        if not keys_dir or not os.path.isdir(keys_dir):
+            return keys
+        for file_name in sorted(os.listdir(keys_dir)):
+            kid, extension = os.path.splitext(file_name)
+            if extension != ".pem":
+                continue
+            with open(os.path.join(keys_dir, file_name), "rb") as key_file:
+                keys[kid] = load_pem_private_key(key_file.read(), password=None)
+        return keys
+
+    @property
+    def is_asymmetric(self):
+        return self.algorithm in ASYMMETRIC_ALGORITHMS
+
+    def encode(self, payload):
+        if not self.is_asymmetric:
+            return jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm=self.algorithm)
+        return jwt.encode(
+            payload, self.private_keys[self.active_kid], algorithm=self.algorithm,
+            headers={"kid": self.active_kid}
+        )
+
+    def decode(self, token):
+        if not self.is_asymmetric:
+            return jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=[self.algorithm])
+        kid = jwt.get_unverified_header(token).get("kid")
+        public_key = self.public_keys.get(kid)
+        if public_key is None:
+            raise jwt.InvalidTokenError(f"Unknown signing key '{kid}'")
+        return jwt.decode(token, public_key, algorithms=[self.algorithm])
+
+    def jwks(self):
+        """
+        Retorna el JWK Set público ({"keys": [...]}); vacío con HS256.
+        """
+        if not self.is_asymmetric:
+            return {"keys": []}
+        to_jwk = get_default_algorithms()[self.algorithm].to_jwk
+        keys = []
+        for kid, public_key in self.public_keys.items():
+            jwk = to_jwk(public_key, as_dict=True)
+            jwk.update({"kid": kid, "alg": self.algorithm, "use": "sig"})
+            keys.append(jwk)
+        return {"keys": keys}
+
+class RemoteKeySet:
+    """
+    Verifica tokens contra un JWKS publicado por otro servicio (p. ej. un nodo gateway).
+    PyJWKClient guarda el JWK Set en memoria durante JWKS_CACHE_MAX_AGE_SECONDS, así que
+    solo se sale a la red al caducar o al ver un kid desconocido.
+    """
+    def __init__(self, jwks_url, lifespan=None):
+        self.client = jwt.PyJWKClient(
+            jwks_url, cache_keys=True, lifespan=lifespan or Config.JWKS_CACHE_MAX_AGE_SECONDS
+        )
+
+    def decode(self, token):
+        try:
+            signing_key = self.client.get_signing_key_from_jwt(token)
+        except jwt.PyJWKClientError as error:
+            raise jwt.InvalidTokenError(str(error))
+        return jwt.decode(token, signing_key.key, algorithms=list(ASYMMETRIC_ALGORITHMS))
+
+_key_ring = None
+_verifier = None
+
+def get_key_ring():
+    """
+    KeyRing del proceso, cargado desde Config la primera vez.
+    """
+    global _key_ring
+    if _key_ring is None:
+        _key_ring = KeyRing.from_config()
+    return _key_ring
+
+def get_verifier():
+    """
+    Verificador de jwt_required: el JWKS remoto si JWT_JWKS_URL está definido, si no el KeyRing local.
+    """
+    global _verifier
+    if _verifier is None:
+        _verifier = RemoteKeySet(Config.JWT_JWKS_URL) if Config.JWT_JWKS_URL else get_key_ring()
+    return _verifier
+
+def generate_signing_key(keys_dir, kid, algorithm):
+    """
+    Genera una clave privada nueva <kid>.pem en keys_dir y retorna su ruta.
+    """
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+    if algorithm == "EdDSA":
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    elif algorithm == "RS256":
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    else:
+        raise ValueError(f"Unsupported algorithm: {algorithm}")
+
+    os.makedirs(keys_dir, exist_ok=True)
+    path = os.path.join(keys_dir, f"{kid}.pem")
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    # O_EXCL: nunca sobrescribir una clave con la que ya se han firmado tokens.
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, "wb") as key_file:
+        key_file.write(pem)
+    return path
@@ -1,10 +1,128 @@
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from bcrypt import hashpw, gensalt, checkpw
+from config import Config
 
-def hash_password(password: str) -> str:
+def hash_password(password: str, rounds: int = None) -> str:
     """Hashea una contraseña usando bcrypt."""
-    hashed = hashpw(password.encode('utf-8'), gensalt())
-    return hashed.decode('utf-8') 
+    salt = gensalt(rounds) if rounds else gensalt()
+    hashed = hashpw(password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica una contraseña en texto plano contra su hash."""
-    return checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
\ No newline at end of file
+    return checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def get_hash_rounds(hashed_password: str):
+    """Retorna el factor de coste de un hash bcrypt ($2b$<coste>$...) o None si no es válido."""
+    parts = hashed_password.split('$')
+    if len(parts) < 4 or not parts[2].isdigit():
+        return None
+    return int(parts[2])
+
+def is_bcrypt_hash(value) -> bool:
+    """Comprueba que un valor tiene la forma de un hash bcrypt ($2a$, $2b$ o $2y$, 60 caracteres)."""
+    return (
+        isinstance(value, str) and len(value) == 60 and value[:4] in ("$2a$", "$2b$", "$2y$")
+        and get_hash_rounds(value) is not None
+    )
+
+class HasherBusyError(Exception):
+    """La cola del pool de hashing está llena."""
+
+class PasswordHasher:
+    """
+    Ejecuta bcrypt en un pool de procesos para no ocupar los hilos de las peticiones.
+    La cola está acotada: si hay demasiadas operaciones pendientes se lanza HasherBusyError.
+    Con BCRYPT_POOL_WORKERS=0 el hashing se hace en el propio hilo.
+    """
+    def __init__(self, workers=None, max_pending=None, rounds=None):
+        self._workers = workers
+        self._max_pending = max_pending
+        self._rounds = rounds
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    @property
+    def workers(self):
+        return Config.BCRYPT_POOL_WORKERS if self._workers is None else self._workers
+
+    @property
+    def rounds(self):
+        return self._rounds or Config.BCRYPT_ROUNDS
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                max_pending = self._max_pending or Config.BCRYPT_MAX_PENDING or self.workers * 4
+                self._slots = threading.BoundedSemaphore(max_pending)
+                # spawn evita heredar hilos y sockets del worker web al crear los procesos.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+
+        executor = self._get_executor()
+        if not self._slots.acquire(timeout=Config.BCRYPT_QUEUE_TIMEOUT_SECONDS):
+            raise HasherBusyError("Password hashing queue is full")
+        try:
+            return executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def hash_many(self, passwords):
+        """
+        Hashea un lote (importaciones masivas) pasando por la cola acotada, con como mucho la mitad
+        de los procesos del pool ocupados por el lote: el resto queda libre para /login y /register_customer.
+        Espera a que haya hueco en la cola en vez de lanzar HasherBusyError.
+        """
+        if self.workers <= 0:
+            return [hash_password(password, self.rounds) for password in passwords]
+
+        executor = self._get_executor()
+        in_flight = max(1, self.workers // 2)
+        pending = deque()
+        hashes = []
+        try:
+            for password in passwords:
+                if len(pending) >= in_flight:
+                    hashes.append(pending.popleft().result())
+                self._slots.acquire()
+                try:
+                    future = executor.submit(hash_password, password, self.rounds)
+                except BaseException:
+                    self._slots.release()
+                    raise
+                future.add_done_callback(lambda _: self._slots.release())
+                pending.append(future)
+            while pending:
+                hashes.append(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+        return hashes
+
+    def verify(self, password, hashed_password):
+        return self._run(verify_password, password, hashed_password)
+
+    def needs_rehash(self, hashed_password):
+        return get_hash_rounds(hashed_password) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+# Pool compartido por los servicios del proceso.
+password_hasher = PasswordHasher()
@@ -0,0 +1,126 @@
+MERGE_PATCH = "merge"
+JSON_PATCH = "json-patch"
+
+class PatchError(ValueError):
+    """
+    Patch mal formado o que no se puede expresar como actualización por rutas de MongoDB.
+    """
+
+def _field(key):
+    if not isinstance(key, str) or not key or "." in key or key.startswith("$"):
+        raise PatchError(f"Invalid settings key: {key!r}")
+    return key
+
+def _join(prefix, key):
+    return f"{prefix}.{_field(key)}"
+
+def _pointer_path(pointer, prefix):
+    """
+    Traduce un JSON Pointer (RFC 6901) a ruta con puntos bajo prefix; "" es el propio prefix.
+    """
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith("/")):
+        raise PatchError(f"Invalid JSON Pointer: {pointer!r}")
+    path = prefix
+    for token in pointer.split("/")[1:]:
+        if token == "-":
+            raise PatchError("Appending to arrays ('-') is not supported")
+        path = _join(path, token.replace("~1", "/").replace("~0", "~"))
+    return path
+
+def _is_array_index(pointer):
+    token = pointer.rsplit("/", 1)[-1]
+    return token == "0" or (token.isdigit() and not token.startswith("0"))
+
+def _merge_patch(patch, prefix, set_fields, unset_fields):
+    for key, value in patch.items():
+        path = _join(prefix, key)
+        if value is None:
+            unset_fields[path] = ""
+        elif isinstance(value, dict):
+            # Un objeto vacío no cambia un objeto existente (RFC 7396). No se crea {} en claves
+            # inexistentes: eso exigiría leer el documento.
+            _merge_patch(value, path, set_fields, unset_fields)
+        else:
+            set_fields[path] = value
+
+def apply_merge_patch(target, patch):
+    """
+    Aplica un JSON Merge Patch en memoria (algoritmo de RFC 7396). Se usa cuando las rutas con
+    puntos no bastan, p. ej. para sustituir un valor escalar por un objeto.
+    """
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_merge_patch(result.get(key), value)
+    return result
+
+def _json_patch(operations, prefix, set_fields, unset_fields, conditions):
+    for operation in operations:
+        if not isinstance(operation, dict) or "path" not in operation:
+            raise PatchError("Each JSON Patch operation needs 'op' and 'path'")
+        op = operation.get("op")
+        path = _pointer_path(operation["path"], prefix)
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise PatchError(f"'{op}' operation requires a value")
+        if op in ("add", "remove") and _is_array_index(operation["path"]):
+            # En un array, add inserta y remove desplaza; $set/$unset sobre "lista.N" sobrescribiría
+            # el elemento o dejaría un null.
+            raise PatchError(f"'{op}' on array positions is not supported: {operation['path']}")
+
+        if op == "add":
+            set_fields[path] = operation["value"]
+        elif op == "replace":
+            set_fields[path] = operation["value"]
+            conditions.setdefault(path, {"$exists": True})
+        elif op == "remove":
+            if path == prefix:
+                raise PatchError("Cannot remove the whole settings document")
+            unset_fields[path] = ""
+            conditions.setdefault(path, {"$exists": True})
+        elif op == "test":
+            # El filtro ve el documento anterior al patch: un test tras cambiar esa ruta no se puede evaluar.
+            if any(_overlaps(path, changed) for changed in list(set_fields) + list(unset_fields)):
+                raise PatchError(f"'test' after a change to {operation['path']} is not supported")
+            # $eq: el valor se compara tal cual y nunca se interpreta como operador de consulta.
+            conditions[path] = {"$eq": operation["value"]}
+        else:
+            # move y copy necesitan leer el valor de origen: no caben en una sola actualización.
+            raise PatchError(f"Unsupported JSON Patch operation: {op!r}")
+
+def _overlaps(path, other):
+    return path == other or path.startswith(other + ".") or other.startswith(path + ".")
+
+def _check_conflicts(paths):
+    ordered = sorted(paths)
+    for previous, current in zip(ordered, ordered[1:]):
+        if current == previous or current.startswith(previous + "."):
+            raise PatchError(f"Conflicting patch paths: {previous} and {current}")
+
+def to_update(patch, patch_format, prefix="customization", max_operations=None):
+    """
+    Traduce un JSON Merge Patch (RFC 7396) o un JSON Patch (RFC 6902) a actualizaciones por ruta.
+    Retorna (set_fields, unset_fields, conditions); conditions son predicados para el filtro
+    (test, y que exista la ruta en replace/remove). Lanza PatchError si el patch no es válido.
+    """
+    set_fields, unset_fields, conditions = {}, {}, {}
+    if patch_format == MERGE_PATCH:
+        if not isinstance(patch, dict):
+            raise PatchError("A JSON Merge Patch must be an object")
+        _merge_patch(patch, prefix, set_fields, unset_fields)
+    elif patch_format == JSON_PATCH:
+        if not isinstance(patch, list):
+            raise PatchError("A JSON Patch must be an array of operations")
+        _json_patch(patch, prefix, set_fields, unset_fields, conditions)
+    else:
+        raise PatchError(f"Unsupported patch format: {patch_format!r}")
+
+    if not set_fields and not unset_fields:
+        raise PatchError("Patch contains no changes")
+    if max_operations and len(set_fields) + len(unset_fields) > max_operations:
+        raise PatchError(f"Patch exceeds the limit of {max_operations} changed paths")
+    _check_conflicts(list(set_fields) + list(unset_fields))
+    return set_fields, unset_fields, conditions